@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""End-to-end crawl benchmark against the local stand-in server.
+
+Runs `redditdownload.main()` in-process with all its HTTP going to
+`fakereddit.FakeReddit` and reports posts/sec, bytes/sec, peak RSS and
+the per-stage timings (from the `--metrics-file` snapshot).
+
+    python -m benchmarks.bench_crawl --posts 500 --latency 0.02
+    python -m benchmarks.bench_crawl --throttle-rate 0.05 -- --sfw --score 100
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import tempfile
+import argparse
+from unittest import mock
+
+from redditdownload import redditdownload, crawler
+
+from .fakereddit import FakeReddit
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description='Benchmark a crawl against a local fake reddit.')
+    parser.add_argument('--posts', type=int, default=200, help='Posts in the fake subreddit.')
+    parser.add_argument('--page-size', type=int, default=25, help='Posts per listing page.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds per response.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of 503 responses.')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Share of 429 responses.')
+    parser.add_argument('--image-size', default='1920x1080', help='Synthetic image size, WxH.')
+    parser.add_argument('--keep-throttle', default=False, action='store_true',
+                        help='Keep the listing throttle (off by default).')
+    parser.add_argument('--annotate', default=False, action='store_true',
+                        help='Keep the title/comment annotation (needs nltk data and fonts; '
+                             'the comment fetch goes to the real reddit).')
+    parser.add_argument('--dir', default=None, help='Download dir (a temporary one by default).')
+    parser.add_argument('--json', metavar='FILE', default=None, help='Write the report to FILE.')
+    parser.add_argument('main_args', nargs='*', help='Extra redditdl.py arguments (after --).')
+    return parser.parse_args(args)
+
+
+def summarize_stages(snapshot):
+    stages = {}
+    for series in snapshot['histograms'].get('stage_seconds', []):
+        labels = dict(series['labels'])
+        name = labels.pop('stage')
+        if labels:
+            name = '{}[{}]'.format(name, ','.join('{}={}'.format(*item) for item in sorted(labels.items())))
+        stages[name] = dict(count=series['count'], seconds=round(series['sum'], 4),
+                            mean=round(series['sum'] / series['count'], 4) if series['count'] else None)
+    return stages
+
+
+def run(posts=200, page_size=25, latency=0.0, error_rate=0.0, throttle_rate=0.0,
+        image_size=(1920, 1080), keep_throttle=False, annotate=False, target_dir=None,
+        main_args=()):
+    """Run one crawl, return the report dict"""
+    fake = FakeReddit(posts=posts, page_size=page_size, latency=latency, error_rate=error_rate,
+                      throttle_rate=throttle_rate, image_size=image_size).start()
+    workdir = tempfile.mkdtemp(prefix='redditdl-bench-')
+    target_dir = target_dir or os.path.join(workdir, 'out')
+    metrics_file = os.path.join(workdir, 'metrics.json')
+    argv = ['redditdl.py', fake.subreddit, target_dir, '--num', '0',
+            '--metrics-file', metrics_file, '--metrics-format', 'json'] + list(main_args)
+    if not annotate:
+        argv.append('--no-annotate')
+    patches = [mock.patch.object(sys, 'argv', argv)]
+    if not keep_throttle:
+        patches.append(mock.patch.object(crawler, '_LISTING_THROTTLE', 0))
+    fake.install_opener()
+    try:
+        for patch in patches:
+            patch.start()
+        start = time.perf_counter()
+        redditdownload.main()
+        elapsed = time.perf_counter() - start
+    finally:
+        for patch in reversed(patches):
+            patch.stop()
+        fake.stop()
+    with open(metrics_file) as f:
+        snapshot = json.load(f)
+    shutil.rmtree(workdir, ignore_errors=True)
+    counters = snapshot['counters']
+    downloaded_bytes = sum(item['value'] for item in counters.get('downloaded_bytes', []))
+    return dict(
+        posts=posts,
+        pages=sum(item['value'] for item in counters.get('listing_pages', [])),
+        elapsed=round(elapsed, 3),
+        posts_per_sec=round(posts / elapsed, 2),
+        bytes=downloaded_bytes,
+        bytes_per_sec=round(downloaded_bytes / elapsed),
+        # kilobytes on linux
+        peak_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+        outcomes={item['labels']['outcome']: item['value'] for item in counters.get('outcomes', [])},
+        stages=summarize_stages(snapshot),
+        server=fake.stats())
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    width, height = map(int, args.image_size.lower().split('x'))
+    report = run(posts=args.posts, page_size=args.page_size, latency=args.latency,
+                 error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                 image_size=(width, height), keep_throttle=args.keep_throttle,
+                 annotate=args.annotate, target_dir=args.dir, main_args=args.main_args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    print('{posts} posts ({pages} listing pages) in {elapsed}s: {posts_per_sec} posts/s, {bytes_per_sec} B/s, '
+          'peak RSS {peak_rss_mb} MiB'.format(**report))
+    print('Outcomes: {}'.format(json.dumps(report['outcomes'], sort_keys=True)))
+    for name, stage in sorted(report['stages'].items()):
+        print('  {:<32} {count:>6} x {mean}s = {seconds}s'.format(name, **stage))
+
+
+if __name__ == '__main__':
+    main()
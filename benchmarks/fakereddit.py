@@ -0,0 +1,232 @@
+"""Local stand-in for reddit, imgur, gfycat and deviantart.
+
+The server is used as an HTTP proxy, so the downloader's hard-coded
+urls (``http://www.reddit.com/r/<sub>.json`` etc.) reach it unchanged;
+see `FakeReddit.install_opener`.
+"""
+
+import io
+import re
+import json
+import time
+import random
+import threading
+import urllib.request
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+
+# kind -> share of the posts
+DEFAULT_MIX = dict(ireddit=0.5, imgur=0.25, gfycat=0.1, deviantart=0.1, self=0.05)
+
+
+def to_base36(num):
+    chars = '0123456789abcdefghijklmnopqrstuvwxyz'
+    res = ''
+    while True:
+        num, rem = divmod(num, 36)
+        res = chars[rem] + res
+        if not num:
+            return res
+
+
+def make_jpeg(size, quality=85):
+    """A noisy (so not too compressible) synthetic JPEG"""
+    from PIL import Image
+    rnd = random.Random(size[0] * size[1])
+    img = Image.frombytes('L', (size[0] // 8, size[1] // 8),
+                          bytes(rnd.getrandbits(8) for _ in range((size[0] // 8) * (size[1] // 8))))
+    img = img.resize(size).convert('RGB')
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', quality=quality)
+    return buf.getvalue()
+
+
+class FakeReddit(object):
+    """
+    The fake hosts, with configurable per-response `latency` (seconds)
+    and shares of the responses being 5xx errors (`error_rate`) or 429s
+    (`throttle_rate`).
+
+    :Example:
+
+    >>> server = FakeReddit(posts=50).start()  # doctest: +SKIP
+    >>> server.install_opener()  # doctest: +SKIP
+    >>> # ... run the downloader ...
+    >>> server.stop()  # doctest: +SKIP
+    """
+
+    def __init__(self, subreddit='bench', posts=200, page_size=25, mix=None,
+                 image_size=(1920, 1080), video_bytes=2 ** 20,
+                 latency=0.0, error_rate=0.0, throttle_rate=0.0, seed=0):
+        self.subreddit = subreddit
+        self.page_size = page_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.image = make_jpeg(image_size)
+        self.video = b'\x00\x00\x00\x18ftypmp42' + b'\x00' * max(0, video_bytes - 12)
+        self._rnd = random.Random(seed)
+        self._rnd_lock = threading.Lock()
+        self.posts = self._make_posts(posts, mix or DEFAULT_MIX)
+        self.requests = Counter()  # host -> count
+        self.responses = Counter()  # status -> count
+        self.bytes_served = 0
+        self._stats_lock = threading.Lock()
+        self._server = None
+
+    def _make_posts(self, amount, mix):
+        kinds = sorted(mix)
+        weights = [mix[kind] for kind in kinds]
+        rnd = random.Random(len(kinds))
+        posts = []
+        for num in range(amount):
+            post_id = to_base36(36 ** 5 + num)
+            kind = rnd.choices(kinds, weights)[0]
+            url = {
+                'ireddit': 'http://i.redd.it/{}.jpg',
+                'imgur': 'http://i.imgur.com/{}.jpg',
+                'imgur_album': 'http://imgur.com/a/{}',
+                'gfycat': 'http://gfycat.com/Gfy{}',
+                'deviantart': 'http://someone.deviantart.com/art/Picture-{}',
+                'self': 'http://www.reddit.com/r/%s/comments/{}/some_title/' % (self.subreddit,),
+            }[kind].format(post_id)
+            posts.append(dict(
+                id=post_id, name='t3_' + post_id, url=url, title='Bench post {}'.format(num),
+                score=rnd.randint(0, 5000), over_18=rnd.random() < 0.1,
+                created_utc=1500000000 - num * 60, subreddit=self.subreddit,
+                is_self=(kind == 'self')))
+        return posts
+
+    # Responses
+
+    @staticmethod
+    def search_matches(post, query):
+        """Whether the post matches the reddit search `query` (the
+        `nsfw:`, `self:`, `site:` and `title:` terms only)"""
+        for key, value in re.findall(r'(\w+):("[^"]*"|\S+)', query):
+            value = value.strip('"').lower()
+            if key == 'nsfw' and post['over_18'] != (value == 'yes'):
+                return False
+            if key == 'self' and post['is_self'] != (value == 'yes'):
+                return False
+            if key == 'site':
+                host = urlsplit(post['url']).hostname
+                if host != value and not host.endswith('.' + value):
+                    return False
+            if key == 'title':
+                words = set(re.findall(r'\w+', post['title'].lower()))
+                if not set(re.findall(r'\w+', value)) <= words:
+                    return False
+        return True
+
+    def _listing(self, query, search=False):
+        posts = self.posts
+        if search:
+            posts = [post for post in posts if self.search_matches(post, query.get('q', [''])[0])]
+        after = query.get('after', [None])[0]
+        start = 0
+        if after:
+            names = [post['name'] for post in posts]
+            start = names.index(after) + 1 if after in names else len(posts)
+        page = posts[start:start + self.page_size]
+        data = dict(kind='Listing', data=dict(
+            children=[dict(kind='t3', data=post) for post in page],
+            after=page[-1]['name'] if page else None))
+        return 200, 'application/json; charset=UTF-8', json.dumps(data).encode('utf-8')
+
+    def route(self, host, path, query):
+        """(status, content_type, body) for the request"""
+        if host == 'www.reddit.com' and path.endswith('.json'):
+            return self._listing(query, search=path.endswith('/search.json'))
+        if path.endswith(('.jpg', '.jpeg')):
+            return 200, 'image/jpeg', self.image
+        if path.endswith(('.mp4', '.webm')):
+            return 200, 'video/' + path.rsplit('.', 1)[1], self.video
+        if host == 'imgur.com' and path.startswith('/a/'):
+            hashes = [path[3:] + suffix for suffix in 'abc']
+            body = ''.join('{{"hash":"{}","title":"x"}}\n'.format(imghash) for imghash in hashes)
+            return 200, 'text/html', body.encode('utf-8')
+        if host == 'gfycat.com' and path.startswith('/cajax/get/'):
+            name = path.rsplit('/', 1)[1]
+            item = dict(gfyName=name, mp4Size=len(self.video), webmSize=len(self.video) + 1,
+                        mp4Url='http://giant.gfycat.com/{}.mp4'.format(name),
+                        webmUrl='http://giant.gfycat.com/{}.webm'.format(name))
+            return 200, 'application/json', json.dumps(dict(gfyItem=item)).encode('utf-8')
+        if host.endswith('.deviantart.com') and '/art/' in path:
+            art_id = path.rsplit('-', 1)[1]
+            body = ('<html><body><img src="http://t00.deviantart.net/x=/fit-in/150x150/'
+                    'filters:no_upscale():origin()/pre00/{}.jpg"/></body></html>').format(art_id)
+            return 200, 'text/html', body.encode('utf-8')
+        return 404, 'text/html', b'<html>not found</html>'
+
+    def handle(self, handler):
+        url = urlsplit(handler.path)
+        host = (url.hostname or handler.headers.get('Host', '')).lower()
+        with self._rnd_lock:
+            roll = self._rnd.random()
+        if self.latency:
+            time.sleep(self.latency)
+        headers = {}
+        if host != 'www.reddit.com' and roll < self.throttle_rate:
+            status, content_type, body = 429, 'text/plain', b'Too Many Requests'
+            headers['Retry-After'] = '1'
+        elif host != 'www.reddit.com' and roll < self.throttle_rate + self.error_rate:
+            status, content_type, body = 503, 'text/plain', b'Service Unavailable'
+        else:
+            status, content_type, body = self.route(host, url.path, parse_qs(url.query))
+        with self._stats_lock:
+            self.requests[host] += 1
+            self.responses[status] += 1
+            self.bytes_served += len(body)
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(body)))
+        for key, value in headers.items():
+            handler.send_header(key, value)
+        handler.end_headers()
+        if handler.command != 'HEAD':
+            handler.wfile.write(body)
+
+    # Server
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                fake.handle(self)
+
+            do_HEAD = do_GET
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever, name='fakereddit')
+        thread.daemon = True
+        thread.start()
+        return self
+
+    @property
+    def proxy_url(self):
+        return 'http://127.0.0.1:{}'.format(self._server.server_address[1])
+
+    def install_opener(self):
+        """Route all the `urllib` http(s) requests of this process here"""
+        urllib.request.install_opener(urllib.request.build_opener(
+            urllib.request.ProxyHandler({'http': self.proxy_url, 'https': self.proxy_url})))
+
+    def stop(self):
+        urllib.request.install_opener(None)
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(requests=dict(self.requests), responses=dict(self.responses),
+                        bytes_served=self.bytes_served)
@@ -0,0 +1,769 @@
+"""Embeddable crawl pipeline.
+
+A `Crawler` chains lazy generator stages::
+
+    listing -> filter -> resolve -> download -> postprocess
+
+and yields a `Result` for every outcome (skipped posts, downloaded
+files, errors).  The work can also be split in two: `plan` stops after
+the resolve stage with a 'planned' result (and manifest entry) per post,
+`fetch` downloads the manifest entries.  Several crawlers can run in
+one process sharing the metrics, tracer and event log objects.
+
+:Example:
+
+>>> crawler = Crawler('wallpaper', 'wallpaper', score=50, num=10)  # doctest: +SKIP
+>>> crawler.on_result.append(print)  # doctest: +SKIP
+>>> for result in crawler.results():  # doctest: +SKIP
+...     if result.ok:
+...         print(result.filename)
+"""
+
+import os
+import re
+import time
+import socket
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+from http.client import InvalidURL
+from os.path import join as pathjoin, basename as pathbasename, splitext as pathsplitext
+
+from .gfycat import gfycat
+from .reddit import getitems
+from .metrics import Metrics
+from .trace import NullTracer
+from .filterplan import FilterPlan
+from .hostsched import HostScheduler, url_host
+from .retry import CircuitOpenError, error_status
+from .thumbs import ThumbnailPool
+from .layout import layout_path, existing_path, resolve_layout
+from .manifest import manifest_entry
+from .embedded import embedded_urls, hinted_urls, media_extension, media_basename
+from .variants import pick_variant
+from .listarchive import ListingArchive, DEFAULT_DIRNAME as ARCHIVE_DIRNAME
+from .negcache import NegativeCache, DEAD_STATUSES, DEFAULT_FILENAME as NEGCACHE_FILENAME
+from .watermark import WatermarkStore, watermark_key, is_seen
+from .redditdownload import (
+    extract_urls, url_resolver, download_from_url, slugify, _log_wrongtype,
+    writeTitleIntoImage, writeCommentIntoImage, get_first_comment_from_post,
+    WrongFileTypeException, FileExistsException)
+
+
+_log = logging.getLogger(__name__)
+
+# Minimal seconds between the listing requests, as per reddit api guidelines.
+_LISTING_THROTTLE = 4
+
+# outcome -> the `Crawler.stats` counter it adds to
+_OUTCOME_COUNTERS = dict(
+    downloaded='downloaded', skipped='skipped', wrong_type='skipped',
+    exists='errors', annotate_failed='errors', known_dead='skipped',
+    http_error='failed', url_error='failed', invalid_url='failed', error='failed',
+    deferred='failed')
+
+# Initial per-host concurrency of the parallel downloads.
+_HOST_CONCURRENCY = 2
+
+# Parallel downloads of `--fetch` without `--jobs`.
+_FETCH_JOBS = 16
+
+# connect (in a `URLError`) and read timeouts
+_TIMEOUT_ERRORS = (socket.timeout, TimeoutError)
+
+
+def congestion_outcome(result):
+    """The `hostsched.Slot.outcome` for a download result"""
+    if result.ok:
+        return 'ok'
+    if result.outcome == 'http_error' and (result.details['code'] == 429 or
+                                           result.details['code'] >= 500):
+        return 'congested'
+    if result.details.get('timeout'):
+        return 'congested'
+    return None
+
+
+def dead_kind(result):
+    """The negative cache kind for a failed result, None if the failure
+    may be transient"""
+    if result.outcome in ('wrong_type', 'invalid_url'):
+        return result.outcome
+    if result.outcome in ('http_error', 'extract_failed') and \
+            result.details.get('code') in DEAD_STATUSES:
+        return 'removed' if 'removed' in result.details['error'] else 'not_found'
+    return None
+
+
+def _known_dead(item, url, entry):
+    return Result('known_dead', item, url, kind=entry['kind'], failures=entry['failures'])
+
+
+def _unpack_job(obj):
+    """(item, urls[, paths]) -> item, urls, paths (None: the paths are
+    made up at the download)"""
+    if len(obj) == 2:
+        return obj[0], obj[1], None
+    return obj
+
+
+# outcomes that keep the post from being covered by the watermark
+_RETRY_OUTCOMES = frozenset((
+    'http_error', 'url_error', 'invalid_url', 'error', 'extract_failed', 'deferred'))
+
+
+class Result(object):
+    """Outcome for a post (e.g. 'skipped', 'extract_failed') or for one
+    of its media urls (e.g. 'downloaded', 'http_error').
+
+    `details` holds the outcome-specific data: reason, error, code, nbytes.
+    """
+
+    def __init__(self, outcome, item, url=None, filename=None, **details):
+        self.outcome = outcome
+        self.item = item
+        self.url = url
+        self.filename = filename
+        self.details = details
+
+    @property
+    def ok(self):
+        return self.outcome == 'downloaded'
+
+    def as_dict(self):
+        res = dict(self.details, outcome=self.outcome, id=self.item.get('id'), url=self.url)
+        if self.filename is not None:
+            res['filename'] = self.filename
+        return res
+
+    def __repr__(self):
+        return '<Result {} {!r} {!r}>'.format(self.outcome, self.item.get('id'), self.url)
+
+
+class Crawler(object):
+    """
+    Download the media of a subreddit (or multireddit) listing.
+
+    The options mirror the command line arguments (see `from_args`).
+    `metrics`, `tracer` and `events` (an `eventlog.EventLog`) can be
+    shared between crawlers.
+
+    Callbacks: `on_attempt` callables get `(item, url, filename)` before
+    each download, `on_result` ones get every `Result`.
+    """
+
+    def __init__(self, reddit, target_dir, multireddit=False, last='', sort_type=None,
+                 score=0, num=1000, update=False, sfw=False, nsfw=False,
+                 title_contain=None, regex=None, skip_albums=False,
+                 filename_format='reddit', mirror_gfycat=False, annotate=True,
+                 site=None, search=False, incremental=False, watermark=None,
+                 jobs=1, bandwidth=None, host_bandwidth=None, negative_cache=None,
+                 thumbnails=None, layout='flat', archive=None, replay=False, hints=True,
+                 max_resolution=None, metrics=None, tracer=None, events=None):
+        self.reddit = reddit
+        self.target_dir = target_dir
+        self.multireddit = multireddit
+        self.last = last
+        self.sort_type = sort_type.lower() if sort_type else None
+        self.score = score
+        self.num = num
+        self.update = update
+        self.sfw = sfw
+        self.nsfw = nsfw
+        self.title_contain = title_contain
+        self.skip_albums = skip_albums
+        self.site = site
+        self.filter_plan = FilterPlan(
+            reddit, score=score, sfw=sfw, nsfw=nsfw, title_contain=title_contain,
+            regex=regex, skip_albums=skip_albums, site=site)
+        # push the filters down into a reddit search query
+        self.search = search
+        # stop the listing at the watermark, kept in the target dir
+        self.incremental = incremental
+        self.watermarks = WatermarkStore(target_dir) if incremental else None
+        self.watermark_key = watermark_key(reddit, self.sort_type)
+        if watermark is None and incremental:
+            watermark = self.watermarks.get(self.watermark_key)
+        self.watermark = watermark
+        self.listing_done = False
+        # `listarchive.ListingArchive` the fetched pages go to, or (with
+        # `replay`) the listing is read from
+        self.archive = archive
+        self.replay = replay
+        self._posts = {}  # id -> [created_utc, fullname, failed]
+        # id -> [open 'post' trace span, results still to come]
+        self._post_spans = {}
+        self.filename_format = filename_format
+        # see `layout.LAYOUTS`
+        self.layout = layout
+        self.mirror_gfycat = mirror_gfycat
+        # resolve from the preview / oembed data where possible
+        self.hints = hints
+        # (width, height): download the smallest variants big enough for it
+        self.max_resolution = max_resolution
+        self._variants = {}  # variant url -> `variants.pick_variant` info
+        self.annotate = annotate
+        # parallel downloads with per-host adaptive limits and bandwidth caps
+        self.jobs = jobs
+        self.scheduler = None
+        if jobs > 1 or bandwidth or host_bandwidth:
+            self.scheduler = HostScheduler(
+                initial=min(_HOST_CONCURRENCY, jobs), max_limit=jobs,
+                bandwidth=bandwidth, host_bandwidth=host_bandwidth)
+        # `negcache.NegativeCache` of the dead urls (can be shared)
+        self.negative_cache = negative_cache
+        # `thumbs.ThumbnailPool` for the downloaded images (can be shared)
+        self.thumbnails = thumbnails
+        self._thumbnail_jobs = []
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.tracer = tracer if tracer is not None else NullTracer()
+        self.events = events
+        self.on_attempt = []
+        self.on_result = []
+        self.stats = dict(processed=0, downloaded=0, skipped=0, errors=0, failed=0)
+        # media urls put in the manifest by `plan`
+        self.planned = 0
+        self.finished = False
+
+    @classmethod
+    def from_args(cls, args, **kwa):
+        """Crawler for the `parse_args` result"""
+        params = dict(
+            multireddit=args.multireddit, last=args.last, sort_type=args.sort_type,
+            score=args.score, num=args.num, update=args.update, sfw=args.sfw, nsfw=args.nsfw,
+            title_contain=args.title_contain, regex=args.regex, skip_albums=args.skipAlbums,
+            filename_format=args.filename_format, mirror_gfycat=args.mirror_gfycat,
+            annotate=not args.no_annotate, site=args.site, search=args.search_filters,
+            incremental=args.incremental, jobs=args.jobs or 1,
+            bandwidth=args.bandwidth, host_bandwidth=args.host_bandwidth,
+            layout=resolve_layout(args.dir, args.layout), hints=not args.no_preview_hints,
+            max_resolution=args.max_resolution)
+        if args.fetch:
+            # The manifest is the whole work: no limit, no stop at the first
+            # downloaded file.
+            params.update(num=0, update=False, jobs=args.jobs or _FETCH_JOBS)
+        if args.thumbnails and 'thumbnails' not in kwa:
+            params['thumbnails'] = ThumbnailPool(workers=args.thumbnail_workers,
+                                                 size=args.thumbnails)
+        if (args.archive is not None or args.replay) and 'archive' not in kwa:
+            params['archive'] = ListingArchive(
+                args.archive or pathjoin(args.dir, ARCHIVE_DIRNAME))
+            params['replay'] = args.replay
+        if args.negative_cache is not None and 'negative_cache' not in kwa:
+            params['negative_cache'] = NegativeCache(
+                args.negative_cache or pathjoin(args.dir, NEGCACHE_FILENAME))
+        params.update(kwa)
+        return cls(args.reddit, args.dir, **params)
+
+    @contextmanager
+    def stage(self, name, labels=None, **trace_args):
+        """Time the block (as a metric and as a trace span)"""
+        with self.metrics.timer(name, **(labels or {})), \
+                self.tracer.span(name, **trace_args) as span_args:
+            yield span_args
+
+    # Stages
+
+    def listing(self):
+        """Listing items, page by page (throttled; read from the archive
+        with `replay`)"""
+        start_time = None
+        pages = None
+        query = self.filter_plan.query if self.search else None
+        if self.replay:
+            pages = self.archive.pages(self.reddit, self.sort_type, query=query)
+        while not self.finished:
+            if pages is not None:
+                with self.stage('listing', after=self.last, replay=True):
+                    items = next(pages, None)
+            else:
+                with self.stage('listing', after=self.last):
+                    items = getitems(
+                        self.reddit, multireddit=self.multireddit, previd=self.last,
+                        reddit_sort=self.sort_type, query=query)
+                if self.archive is not None:
+                    self.archive.add_page(self.reddit, self.sort_type, items,
+                                          after=self.last, query=query)
+            self.metrics.inc('listing_pages')
+            self.metrics.inc('posts', len(items or ()))
+
+            # measure time and set the program to wait between requests
+            end_time = time.perf_counter()
+            if start_time is not None and pages is None:
+                elapsed_time = end_time - start_time
+                if elapsed_time <= _LISTING_THROTTLE:  # throttling
+                    with self.stage('throttle'):
+                        time.sleep(_LISTING_THROTTLE - elapsed_time)
+            start_time = time.perf_counter()
+
+            if not items:
+                # No more items to process
+                self.listing_done = True
+                return
+            self.last = items[-1]['id']
+            if self.watermark:
+                new_items = [item for item in items if not is_seen(item, self.watermark)]
+                # 'new' is ordered by time, so one seen post is enough to stop
+                if (len(new_items) < len(items) if self.sort_type == 'new' else not new_items):
+                    self.listing_done = True
+                items = new_items
+            for item in items:
+                yield item
+            if self.listing_done:
+                return
+
+    def skip_reason(self, item):
+        """Why the item should not be downloaded (None if it should be)"""
+        return self.filter_plan.skip_reason(item)
+
+    def filter(self, items):
+        """items -> items to download and 'skipped' results"""
+        for item in items:
+            # NOTE: the span is closed by `_record`, on the last result of
+            # the post (which, with `jobs`, comes from a later iteration).
+            self._post_spans[item['id']] = [
+                self.tracer.begin('post', cat='post', id=item['id'], url=item['url']), 1]
+            self.stats['processed'] += 1
+            reason = self.skip_reason(item)
+            if reason is not None:
+                yield Result('skipped', item, url=item['url'], reason=reason)
+            else:
+                yield item
+
+    def resolve(self, stream):
+        """items -> (item, [media url, ...]) and 'extract_failed' results
+
+        The media in the listing data (galleries, reddit videos) is taken
+        from there, then (with `hints`) the preview / oembed copies of the
+        media of the hosts that need requests; the rest goes through
+        `extract_urls`.
+        """
+        for obj in stream:
+            if isinstance(obj, Result):
+                yield obj
+                continue
+            item = obj
+            urls, resolver = embedded_urls(item), 'embedded'
+            if urls is None and self.hints:
+                urls, resolver = hinted_urls(item), 'hint'
+            if urls is None:
+                resolver = url_resolver(item['url'])
+            # NOTE: the direct links (and the media urls) are looked up by
+            # `download_url`; here only the pages that take requests.
+            if urls is None and resolver != 'direct' and self.negative_cache is not None:
+                entry = self.negative_cache.get(item['url'])
+                if entry is not None:
+                    yield _known_dead(item, item['url'], entry)
+                    continue
+            try:
+                with self.stage('resolve', labels=dict(resolver=resolver),
+                                resolver=resolver, url=item['url']):
+                    if urls is None and self.max_resolution:
+                        urls = extract_urls(item['url'], max_resolution=self.max_resolution,
+                                            variants=self._variants)
+                    elif urls is None:
+                        urls = extract_urls(item['url'])
+            except CircuitOpenError as exc:
+                yield Result('deferred', item, url=item['url'], error=str(exc))
+                continue
+            except Exception as exc:
+                _log.exception("Failed to extract urls for %r", item['url'])
+                yield Result('extract_failed', item, url=item['url'], error=repr(exc),
+                             code=error_status(exc))
+                continue
+            if self.max_resolution:
+                urls = self.pick_variants(item, urls)
+            yield item, urls
+
+    def pick_variants(self, item, urls):
+        """The urls with the smallest variants big enough for
+        `max_resolution` (recorded for the results)"""
+        picked_urls = []
+        for url in urls:
+            picked = pick_variant(item, url, self.max_resolution, single=len(urls) == 1)
+            if picked is not None:
+                url, info = picked
+                self._variants[url] = info
+                self.metrics.inc('variants', variant=info['variant'])
+            picked_urls.append(url)
+        return picked_urls
+
+    def planned_entries(self, stream):
+        """(item, urls) -> 'planned' results, with the manifest entry in
+        `details['entry']`"""
+        for obj in stream:
+            if isinstance(obj, Result):
+                yield obj
+                continue
+            item, urls = obj
+            # Numbered by the url position, as by the parallel downloads.
+            paths = [self.relative_path(item, url, filecount, len(urls))
+                     for filecount, url in enumerate(urls)]
+            variants = [self._variants.pop(url, None) for url in urls]
+            yield Result('planned', item, url=item['url'],
+                         entry=manifest_entry(item, urls, paths, variants=variants))
+            self.planned += len(urls)
+            if self.num and self.planned >= self.num:
+                self.finished = True
+                return
+
+    def manifest_jobs(self, entries):
+        """manifest entries -> (item, urls, paths)"""
+        for entry in entries:
+            self.stats['processed'] += 1
+            item = dict(entry)
+            media = item.pop('media')
+            for medium in media:
+                if medium.get('variant'):
+                    self._variants[medium['url']] = medium['variant']
+            yield item, [medium['url'] for medium in media], [medium['path'] for medium in media]
+
+    def relative_path(self, item, url, filecount, total):
+        """The path of the file in the download dir (with the shard
+        subdirectories)"""
+        return layout_path('', self.filename_for(item, url, filecount, total), self.layout)
+
+    def filename_for(self, item, url, filecount, total):
+        FILEEXT = pathsplitext(url)[1]
+        # Trim any http query off end of file extension.
+        FILEEXT = re.sub(r'\?.*$', '', FILEEXT)
+        # e.g. reddit's mp4 copies of gifs are '<id>.gif?format=mp4'
+        FILEEXT = media_extension(url) or FILEEXT
+        if not FILEEXT:
+            # A more usable option that empty.
+            # The extension can be fixed after downloading, but then the 'already downloaded' check will be harder.
+            FILEEXT = '.jpg'
+
+        # Only append numbers if more than one file
+        FILENUM = ('_%d' % filecount if total > 1 else '')
+
+        # create filename based on given input from user
+        if self.filename_format == 'url':
+            basename = media_basename(url) or pathsplitext(pathbasename(url))[0]
+            FILENAME = '%s%s%s' % (basename, '', FILEEXT)
+        elif self.filename_format == 'title':
+            FILENAME = '%s%s%s' % (slugify(item['title']), FILENUM, FILEEXT)
+            if len(FILENAME) >= 256:
+                shortened_item_title = slugify(item['title'])[:256-len(FILENAME)]
+                FILENAME = '%s%s%s' % (shortened_item_title, FILENUM, FILEEXT)
+        else:
+            FILENAME = '%s%s%s' % (item['id'], FILENUM, FILEEXT)
+        return FILENAME
+
+    def download_url(self, item, url, filecount, total, throttle=None, path=None):
+        """Download one media url of the item (to `path`, relative to
+        the download dir, if given), return the `Result`"""
+        filename = filepath = None
+        variant = self._variants.pop(url, None)
+        try:
+            # Find gfycat if requested
+            if url.endswith('gif') and self.mirror_gfycat:
+                check = gfycat().check(url)
+                if check.get("urlKnown"):
+                    url = check.get('webmUrl')
+
+            if self.negative_cache is not None:
+                entry = self.negative_cache.get(url)
+                if entry is not None:
+                    return _known_dead(item, url, entry)
+
+            if path is None:
+                filename = self.filename_for(item, url, filecount, total)
+                # join file with directory (and the shard subdirectories)
+                filepath = layout_path(self.target_dir, filename, self.layout)
+            else:
+                filename = pathbasename(path)
+                filepath = pathjoin(self.target_dir, path)
+
+            # url may be wrong so skip that
+            if url == 'http://':
+                raise URLError('Url is empty')
+            if self.layout != 'flat' or path is not None:
+                # Might still be in the top dir (not migrated yet).
+                if path is None and existing_path(self.target_dir, filename, self.layout):
+                    raise FileExistsException('URL [%s] already downloaded.' % url)
+                os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            for callback in self.on_attempt:
+                callback(item, url, filename)
+
+            download_start = time.perf_counter()
+            with self.stage('download', url=url, host=urlsplit(url).netloc) as span_args:
+                if throttle is None:
+                    nbytes = download_from_url(url, filepath)
+                else:
+                    nbytes = download_from_url(url, filepath, throttle=throttle)
+                span_args['bytes'] = nbytes
+            self.metrics.observe_download(nbytes, time.perf_counter() - download_start)
+            if variant is not None:
+                return Result('downloaded', item, url, filepath, nbytes=nbytes, variant=variant)
+            return Result('downloaded', item, url, filepath, nbytes=nbytes)
+        except WrongFileTypeException as exc:
+            _log_wrongtype(url=url, target_dir=self.target_dir,
+                           filecount=filecount, _downloaded=self.stats['downloaded'],
+                           filename=filename)
+            return Result('wrong_type', item, url, filepath, error=str(exc))
+        except FileExistsException as exc:
+            if self.update:
+                self.finished = True
+            return Result('exists', item, url, filepath, error=str(exc))
+        except HTTPError as exc:
+            return Result('http_error', item, url, filepath, code=exc.code, error=str(exc))
+        except URLError as exc:
+            timeout = isinstance(exc.reason, _TIMEOUT_ERRORS)
+            return Result('url_error', item, url, filepath, error=str(exc), timeout=timeout)
+        except _TIMEOUT_ERRORS as exc:
+            # a read timeout (the connection was made)
+            return Result('url_error', item, url, filepath, error='timed out: %s' % (exc,),
+                          timeout=True)
+        except InvalidURL as exc:
+            return Result('invalid_url', item, url, filepath, error=str(exc))
+        except CircuitOpenError as exc:
+            # the host is down: left for a later run
+            return Result('deferred', item, url, filepath, error=str(exc))
+        except Exception as exc:
+            _log.exception("Problem with %r: %r", url, exc)
+            return Result('error', item, url, filepath, error=repr(exc))
+
+    def download(self, stream):
+        """(item, urls[, paths]) -> a result per media url"""
+        if self.scheduler is not None:
+            for result in self.download_parallel(stream):
+                yield result
+            return
+        for obj in stream:
+            if isinstance(obj, Result):
+                yield obj
+                continue
+            item, urls, paths = _unpack_job(obj)
+            self._expect_results(item, len(urls))
+            filecount = 0
+            for idx, url in enumerate(urls):
+                result = self.download_url(item, url, filecount, len(urls),
+                                           path=paths[idx] if paths else None)
+                if result.ok:
+                    filecount += 1
+                yield result
+                if self.finished:
+                    return
+
+    def _download_in_slot(self, slot, item, url, filecount, total, path):
+        try:
+            result = self.download_url(item, url, filecount, total, throttle=slot.throttle,
+                                       path=path)
+            slot.outcome = congestion_outcome(result)
+            if slot.outcome == 'congested':
+                self.metrics.inc('host_congestion', host=slot.host)
+            return result
+        finally:
+            self.scheduler.release(slot)
+
+    def download_parallel(self, stream):
+        """`download` in `jobs` threads, with the urls queued per host and
+        dispatched as the host limits of `scheduler` allow.
+
+        Results come in the completion order.  The files of a post are
+        numbered by the url position (not by the successful downloads).
+        """
+        queues = OrderedDict()  # host -> deque of (item, url, filecount, total, path)
+        queued = 0
+        futures = set()
+        exhausted = False
+        with ThreadPoolExecutor(self.jobs, thread_name_prefix='download') as pool:
+            while True:
+                # Resolve ahead, to have urls of several hosts to choose from.
+                while not exhausted and not self.finished and queued < 2 * self.jobs:
+                    obj = next(stream, None)
+                    if obj is None:
+                        exhausted = True
+                    elif isinstance(obj, Result):
+                        yield obj
+                    else:
+                        item, urls, paths = _unpack_job(obj)
+                        self._expect_results(item, len(urls))
+                        for filecount, url in enumerate(urls):
+                            queues.setdefault(url_host(url), deque()).append(
+                                (item, url, filecount, len(urls),
+                                 paths[filecount] if paths else None))
+                        queued += len(urls)
+
+                for host in list(queues):
+                    if self.finished or len(futures) >= self.jobs:
+                        break
+                    if self.num and self.stats['downloaded'] + len(futures) >= self.num:
+                        break
+                    slot = self.scheduler.try_acquire(host)
+                    if slot is None:
+                        continue
+                    futures.add(pool.submit(self._download_in_slot, slot, *queues[host].popleft()))
+                    queued -= 1
+                    if not queues[host]:
+                        del queues[host]
+
+                if not futures:
+                    if self.finished or (exhausted and not queued):
+                        return
+                    continue
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+    def annotate_result(self, result):
+        """Write the title and the first comment into the downloaded image.
+
+        Returns an 'annotate_failed' result on errors.
+        """
+        # NOTE: the annotation functions work with the bare filename.
+        filename = pathbasename(result.filename)
+        try:
+            with self.stage('annotate'):
+                writeTitleIntoImage(filename)
+            with self.stage('comment_fetch'):
+                comm = get_first_comment_from_post(result.item['id'])
+            with self.stage('annotate'):
+                writeCommentIntoImage(filename, comm)
+        except Exception as exc:
+            return Result('annotate_failed', result.item, result.url, result.filename,
+                          error=str(exc))
+        return None
+
+    def postprocess(self, stream):
+        """Annotate the downloaded files (if enabled) and queue their
+        thumbnails"""
+        for result in stream:
+            failure = None
+            if result.ok and self.annotate:
+                failure = self.annotate_result(result)
+            if result.ok and self.thumbnails is not None:
+                self._thumbnail_jobs.append(self.thumbnails.submit(result.filename))
+                self._thumbnail_jobs = [
+                    job for job in self._thumbnail_jobs if not self._thumbnail_done(job)]
+            yield result
+            if failure is not None:
+                yield failure
+
+    def _thumbnail_done(self, job):
+        if not job.done():
+            return False
+        path, status, error = job.result()
+        self.metrics.inc('thumbnails', status=status)
+        if error:
+            _log.warning("Failed to make the thumbnail of %r: %s", path, error)
+        return True
+
+    def wait_thumbnails(self):
+        for job in self._thumbnail_jobs:
+            job.result()
+            self._thumbnail_done(job)
+        self._thumbnail_jobs = []
+
+    # Running
+
+    def _emit(self, name, **fields):
+        self.tracer.instant(name, **fields)
+        if self.events is not None:
+            self.events.emit(name, subreddit=self.reddit, **fields)
+
+    def _expect_results(self, item, count):
+        """The post is to have `count` results (one per media url)"""
+        span = self._post_spans.get(item['id'])
+        if span is not None:
+            span[1] = count
+            if not count:
+                self._end_post_span(item['id'])
+
+    def _end_post_span(self, post_id):
+        span, _ = self._post_spans.pop(post_id)
+        self.tracer.end(span)
+
+    def _record(self, result):
+        span = self._post_spans.get(result.item['id'])
+        # (an 'annotate_failed' result follows the download one)
+        if span is not None and result.outcome != 'annotate_failed':
+            span[1] -= 1
+            if span[1] <= 0:
+                self._end_post_span(result.item['id'])
+        counter = _OUTCOME_COUNTERS.get(result.outcome)
+        if counter is not None and result.details.get('reason') != 'comments':
+            self.stats[counter] += 1
+        if self.num and self.stats['downloaded'] >= self.num:
+            self.finished = True
+        self.metrics.inc('outcomes', outcome=result.outcome)
+        if self.negative_cache is not None:
+            kind = dead_kind(result)
+            if kind is not None:
+                self.negative_cache.add(result.url, kind)
+        if self.incremental:
+            item = result.item
+            post = self._posts.setdefault(
+                item['id'], [item.get('created_utc'), item.get('name', 't3_' + item['id']), False])
+            if result.outcome in _RETRY_OUTCOMES:
+                post[2] = True
+        fields = result.as_dict()
+        self._emit(fields.pop('outcome'), **fields)
+        for callback in self.on_result:
+            callback(result)
+
+    def results(self, items=None):
+        """Run the pipeline over the listing (or over the given `items`),
+        yielding every `Result`"""
+        if items is None:
+            items = self.listing()
+        return self._run(self.postprocess(self.download(self.resolve(self.filter(items)))))
+
+    def plan(self, items=None):
+        """The listing (or the given `items`) filtered and resolved, but
+        not downloaded: 'planned' results (see `manifest.ManifestWriter`)
+        and the skipped / failed ones"""
+        if items is None:
+            items = self.listing()
+        return self._run(self.planned_entries(self.resolve(self.filter(items))))
+
+    def fetch(self, entries):
+        """Download the manifest entries (see `manifest.read_manifest`);
+        the files already downloaded are 'exists' results"""
+        return self._run(self.postprocess(self.download(self.manifest_jobs(entries))))
+
+    def _run(self, stream):
+        for result in stream:
+            self._record(result)
+            yield result
+        # the posts left unfinished (by `num`)
+        for post_id in list(self._post_spans):
+            self._end_post_span(post_id)
+        self.wait_thumbnails()
+        self._emit('finished', **self.stats)
+        if self.events is not None:
+            self.events.flush()
+        # Only a listing walked down to the old watermark (or to its end)
+        # has no gaps below the new one.
+        if self.incremental and self.listing_done:
+            self.save_watermark()
+
+    def new_watermark(self):
+        """The newest processed post older than every failed one (so the
+        failures are retried by the next incremental run), None if there
+        is no such post"""
+        posts = [post for post in self._posts.values() if post[0] is not None]
+        failed = [created for created, _, is_failed in posts if is_failed]
+        if failed:
+            oldest_failed = min(failed)
+            posts = [post for post in posts if post[0] < oldest_failed]
+        if not posts:
+            return None
+        created, name, _ = max(posts)
+        return dict(name=name, created_utc=created)
+
+    def save_watermark(self):
+        watermark = self.new_watermark()
+        if watermark is not None:
+            self.watermarks.set(self.watermark_key, watermark)
+            self.watermarks.save()
+
+    def run(self, items=None):
+        """Run the pipeline to the end, return the stats"""
+        for _ in self.results(items=items):
+            pass
+        return self.stats
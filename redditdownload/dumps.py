@@ -0,0 +1,200 @@
+"""Posts from reddit submission dumps (newline-delimited JSON, plain,
+`.gz` or `.zst`), e.g. for backfilling past the ~1000 posts a listing
+goes back to.
+
+A reader thread decompresses the dump in blocks of whole lines, a
+process pool parses and filters the blocks and the posts come out in
+the dump order.  The blocks in flight are bounded, so the memory use
+does not depend on the dump size.
+
+:Example:
+
+>>> reader = DumpReader(['RS_2019-01.zst'], subreddits=['wallpaper'], score=50)  # doctest: +SKIP
+>>> Crawler('wallpaper', 'wallpaper').run(items=reader)  # doctest: +SKIP
+"""
+
+import io
+import os
+import gzip
+import json
+import queue
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from .manifest import ITEM_FIELDS
+from .embedded import EMBEDDED_FIELDS
+from .reddit import unescape_url
+
+
+_log = logging.getLogger(__name__)
+
+# the post fields kept (the dumps have ~100 per post)
+POST_FIELDS = ITEM_FIELDS + ('domain', 'is_self') + EMBEDDED_FIELDS
+
+# bytes of lines parsed per job
+BLOCK_SIZE = 2 ** 20
+
+# pushshift's dumps are compressed with a long window
+_ZSTD_MAX_WINDOW = 2 ** 31
+
+
+def open_dump(path):
+    """Binary stream of the (decompressed) dump"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("Reading .zst dumps needs the zstandard package "
+                              "(pip install zstandard)")
+        fobj = open(path, 'rb')
+        reader = zstandard.ZstdDecompressor(max_window_size=_ZSTD_MAX_WINDOW).stream_reader(fobj)
+        return io.BufferedReader(reader, buffer_size=BLOCK_SIZE)
+    return open(path, 'rb')
+
+
+def iter_blocks(stream, block_size=BLOCK_SIZE):
+    """Blocks of whole lines of about `block_size` bytes"""
+    rest = b''
+    while True:
+        chunk = stream.read(block_size)
+        if not chunk:
+            break
+        chunk = rest + chunk
+        cut = chunk.rfind(b'\n') + 1
+        rest = chunk[cut:]
+        if cut:
+            yield chunk[:cut]
+    if rest.strip():
+        yield rest
+
+
+def post_matches(post, subreddits=None, score=0, sfw=False, nsfw=False):
+    """The streaming filter: subreddit (a set of lowercase names, None
+    for any), minimal score and NSFW"""
+    if subreddits is not None and (post.get('subreddit') or '').lower() not in subreddits:
+        return False
+    if (post.get('score') or 0) < score:
+        return False
+    if sfw and post.get('over_18'):
+        return False
+    if nsfw and not post.get('over_18'):
+        return False
+    return True
+
+
+def parse_block(block, filters):
+    """-> (the matching posts, lines, bad lines) of a block"""
+    posts = []
+    lines = bad = 0
+    for line in block.splitlines():
+        if not line.strip():
+            continue
+        lines += 1
+        try:
+            post = json.loads(line)
+        except ValueError:
+            bad += 1
+            continue
+        if not isinstance(post, dict) or 'id' not in post or 'url' not in post:
+            bad += 1
+            continue
+        if post_matches(post, **filters):
+            # as `getitems` gives them
+            posts.append(unescape_url({key: post[key] for key in POST_FIELDS if key in post}))
+    return posts, lines, bad
+
+
+class DumpReader(object):
+    """
+    The matching posts of the dumps, as listing-like items.
+
+    `workers` is the number of parsing processes (0 to parse in the
+    reading thread, e.g. for small dumps).
+    """
+
+    def __init__(self, paths, subreddits=None, score=0, sfw=False, nsfw=False,
+                 workers=None, block_size=BLOCK_SIZE):
+        self.paths = list(paths)
+        self.filters = dict(
+            subreddits=set(name.lower() for name in subreddits) if subreddits else None,
+            score=score, sfw=sfw, nsfw=nsfw)
+        self.workers = workers
+        self.block_size = block_size
+        self.stats = dict(lines=0, bad=0, posts=0)
+
+    @staticmethod
+    def _put(blocks, obj, stop):
+        """Queue the object unless the iteration stopped"""
+        while not stop.is_set():
+            try:
+                blocks.put(obj, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _read(self, blocks, stop):
+        try:
+            for path in self.paths:
+                _log.info("Reading %r", path)
+                with open_dump(path) as stream:
+                    for block in iter_blocks(stream, self.block_size):
+                        if not self._put(blocks, block, stop):
+                            return
+        except Exception as exc:
+            self._put(blocks, exc, stop)
+            return
+        self._put(blocks, None, stop)
+
+    def _count(self, parsed):
+        posts, lines, bad = parsed
+        self.stats['lines'] += lines
+        self.stats['bad'] += bad
+        self.stats['posts'] += len(posts)
+        return posts
+
+    def __iter__(self):
+        if self.workers == 0:
+            for path in self.paths:
+                with open_dump(path) as stream:
+                    for block in iter_blocks(stream, self.block_size):
+                        for post in self._count(parse_block(block, self.filters)):
+                            yield post
+            return
+
+        workers = self.workers or os.cpu_count() or 1
+        pool = ProcessPoolExecutor(workers)
+        in_flight = 2 * workers
+        blocks = queue.Queue(maxsize=in_flight)
+        stop = threading.Event()
+        reader = threading.Thread(target=self._read, args=(blocks, stop),
+                                  name='dump-reader', daemon=True)
+        reader.start()
+        futures = deque()
+        try:
+            exhausted = False
+            while True:
+                while not exhausted and len(futures) < in_flight:
+                    block = blocks.get()
+                    if isinstance(block, Exception):
+                        raise block
+                    if block is None:
+                        exhausted = True
+                    else:
+                        futures.append(pool.submit(parse_block, block, self.filters))
+                if not futures:
+                    break
+                for post in self._count(futures.popleft().result()):
+                    yield post
+        finally:
+            stop.set()
+            for future in futures:
+                future.cancel()
+            pool.shutdown()
+            reader.join()
+        if self.stats['bad']:
+            _log.warning("%d bad lines in %r", self.stats['bad'], self.paths)
@@ -0,0 +1,184 @@
+"""Media urls from the data embedded in the listing items (galleries,
+reddit-hosted videos), found without any request.
+
+The previews and oembed data are hints for the hosts whose resolvers
+make requests (imgur, gfycat, deviantart): reddit's copy of the asset
+is used instead.
+
+:Example:
+
+>>> embedded_urls(dict(
+...     url='https://www.reddit.com/gallery/abc123',
+...     gallery_data=dict(items=[dict(media_id='x1'), dict(media_id='x2')]),
+...     media_metadata=dict(
+...         x1=dict(status='valid', e='Image', m='image/jpg'),
+...         x2=dict(status='valid', e='Image', m='image/png'))))
+['https://i.redd.it/x1.jpg', 'https://i.redd.it/x2.png']
+>>> embedded_urls(dict(url='https://imgur.com/abc')) is None
+True
+"""
+
+import html
+import logging
+from urllib.parse import urlsplit, parse_qs
+
+
+_log = logging.getLogger(__name__)
+
+# the listing item fields used here
+EMBEDDED_FIELDS = ('is_gallery', 'gallery_data', 'media_metadata', 'secure_media', 'media',
+                   'is_video', 'crosspost_parent_list', 'preview')
+
+# hosts whose urls are resolved with requests (see `url_resolver`)
+HINTED_HOSTS = ('imgur.com', 'gfycat.com', 'deviantart.com', 'redgifs.com')
+_ANIMATED_HOSTS = ('gfycat.com', 'redgifs.com')
+_ANIMATED_EXTENSIONS = ('.gif', '.gifv')
+# direct links to the original images (no resolving needed)
+_STILL_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# `media_metadata` 'm' -> the i.redd.it file extension
+_MIME_EXTENSIONS = {
+    'image/jpg': 'jpg', 'image/jpeg': 'jpg', 'image/png': 'png', 'image/gif': 'gif'}
+
+
+def _unescape(url):
+    # the listing json has the urls html-escaped (as `reddit.getitems` notes)
+    return html.unescape(url) if url else url
+
+
+def media_url(meta):
+    """The url of a `media_metadata` entry (None if it is not usable:
+    failed, still processing, unknown kind)"""
+    if meta.get('status') != 'valid':
+        return None
+    ext = _MIME_EXTENSIONS.get(meta.get('m'))
+    if meta.get('e') in ('Image', 'AnimatedImage') and ext and meta.get('id'):
+        # the original, not the (possibly webp) preview
+        return 'https://i.redd.it/{}.{}'.format(meta['id'], ext)
+    source = meta.get('s') or {}
+    if meta.get('e') == 'AnimatedImage':
+        return _unescape(source.get('mp4') or source.get('gif'))
+    if meta.get('e') == 'Image':
+        return _unescape(source.get('u'))
+    return None
+
+
+def gallery_urls(item):
+    """The urls of a gallery post in the gallery order, None if the item
+    is not a gallery or none of its media is usable (so it goes to the
+    other resolvers)"""
+    gallery = item.get('gallery_data')
+    metadata = item.get('media_metadata')
+    if not gallery or not metadata:
+        return None
+    urls = []
+    for entry in gallery.get('items') or ():
+        meta = dict(metadata.get(entry['media_id']) or {})
+        meta.setdefault('id', entry['media_id'])
+        url = media_url(meta)
+        if url is None:
+            _log.info("Skipping the gallery media %r of %r (%s)",
+                      entry['media_id'], item.get('id'), meta.get('status'))
+            continue
+        urls.append(url)
+    return urls or None
+
+
+def reddit_video_url(item):
+    """The (no audio) mp4 of a reddit-hosted video, None if there is none"""
+    for key in ('secure_media', 'media'):
+        video = (item.get(key) or {}).get('reddit_video')
+        if video and video.get('fallback_url'):
+            return _unescape(video['fallback_url'])
+    return None
+
+
+def embedded_urls(item):
+    """The media urls of the item from its embedded data, None if it
+    has none (so the url has to be resolved)"""
+    urls = gallery_urls(item)
+    if urls is not None:
+        return urls
+    video = reddit_video_url(item)
+    if video is not None:
+        return [video]
+    # a crosspost carries the data of the original post
+    for parent in item.get('crosspost_parent_list') or ():
+        urls = embedded_urls(parent)
+        if urls is not None:
+            return urls
+    return None
+
+
+def _on_hosts(url, hosts):
+    host = (urlsplit(url).hostname or '').lower()
+    return any(host == name or host.endswith('.' + name) for name in hosts)
+
+
+def is_animated(url):
+    path = urlsplit(url).path.lower()
+    return path.endswith(_ANIMATED_EXTENSIONS) or _on_hosts(url, _ANIMATED_HOSTS)
+
+
+def media_extension(url):
+    """The file extension of the media at a reddit url when its path
+    tells otherwise (the `?format=mp4` renditions of gifs are mp4s), None
+    to go by the path"""
+    parts = urlsplit(url)
+    if (parts.hostname or '').endswith('redd.it') and \
+            'mp4' in parse_qs(parts.query).get('format', ()):
+        return '.mp4'
+    return None
+
+
+def media_basename(url):
+    """The file name (without the extension) of the media at a reddit
+    url when its path tells otherwise (a v.redd.it video is
+    `<id>/DASH_720.mp4`), None to go by the path"""
+    parts = urlsplit(url)
+    if (parts.hostname or '').lower() == 'v.redd.it':
+        video_id = parts.path.strip('/').split('/')[0]
+        if video_id:
+            return video_id
+    return None
+
+
+def preview_image(item):
+    """The first `preview.images` entry of the item (or an empty dict)"""
+    images = (item.get('preview') or {}).get('images') or ()
+    return images[0] if images else {}
+
+
+def hinted_urls(item):
+    """The media urls of the item from its preview / oembed data, None
+    if there is no hint or the url does not need one (direct links,
+    albums)"""
+    url = item['url']
+    if not _on_hosts(url, HINTED_HOSTS):
+        return None
+    path = urlsplit(url).path
+    if path.startswith(('/a/', '/gallery/')):
+        # albums: the preview is of the cover only
+        return None
+    if path.lower().endswith(_STILL_EXTENSIONS):
+        # the original itself, better than reddit's recompressed copy
+        return None
+    preview = item.get('preview') or {}
+    image = preview_image(item)
+    if is_animated(url):
+        video = preview.get('reddit_video_preview') or {}
+        if video.get('fallback_url'):
+            return [_unescape(video['fallback_url'])]
+        mp4 = (image.get('variants') or {}).get('mp4') or {}
+        if (mp4.get('source') or {}).get('url'):
+            return [_unescape(mp4['source']['url'])]
+        return None
+    # an oembed 'photo' is the image itself (by the oembed spec)
+    for key in ('secure_media', 'media'):
+        oembed = (item.get(key) or {}).get('oembed') or {}
+        if oembed.get('type') == 'photo' and oembed.get('url'):
+            return [_unescape(oembed['url'])]
+    source = image.get('source') or {}
+    if source.get('url'):
+        return [_unescape(source['url'])]
+    return None
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# coding: utf8
+""" Buffered JSON-lines event log with size-based rotation. """
+
+import os
+import gzip
+import json
+import time
+import atexit
+import shutil
+import logging
+import threading
+
+
+_log = logging.getLogger(__name__)
+
+
+class EventLog(object):
+    """ Collects records in memory and appends them to `path` as JSON
+    lines once `flush_every` records are buffered or `flush_interval`
+    seconds have passed (from a background thread).
+
+    With `max_bytes`, the file is rotated to `path.1` ... `path.<backups>`
+    before it would grow past that size; with `compress`, the rotated
+    files are gzipped (`path.1.gz`, ...).
+    """
+
+    def __init__(self, path, flush_every=100, flush_interval=5.0,
+                 max_bytes=None, backups=5, compress=False):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.compress = compress
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = None
+        if flush_interval:
+            self._flusher = threading.Thread(
+                target=self._flush_periodically, name='eventlog-flusher')
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def write(self, record):
+        """ Buffer a record as-is """
+        line = json.dumps(record, sort_keys=True) + '\n'
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) >= self.flush_every:
+                self._flush()
+
+    def emit(self, event, **fields):
+        """ Buffer an `event` record (with a timestamp) """
+        fields.update(event=event, ts=time.time())
+        self.write(fields)
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        """ (lock must be held) """
+        if not self._buffer:
+            return
+        data = ''.join(self._buffer)
+        del self._buffer[:]
+        if self.max_bytes:
+            try:
+                size = os.path.getsize(self.path)
+            except OSError:
+                size = 0
+            if size and size + len(data) > self.max_bytes:
+                self._rotate()
+        with open(self.path, 'a') as f:
+            f.write(data)
+
+    def _rotated_name(self, num):
+        return '%s.%d%s' % (self.path, num, '.gz' if self.compress else '')
+
+    def _rotate(self):
+        """ path -> path.1 -> path.2 ... (lock must be held) """
+        for num in range(self.backups - 1, 0, -1):
+            src = self._rotated_name(num)
+            if os.path.exists(src):
+                os.rename(src, self._rotated_name(num + 1))
+        target = self._rotated_name(1)
+        if self.compress:
+            with open(self.path, 'rb') as f_in, gzip.open(target, 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out)
+            os.remove(self.path)
+        else:
+            os.rename(self.path, target)
+        _log.debug("Rotated %r to %r", self.path, target)
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                _log.exception("Failed to flush the event log %r", self.path)
+
+    def close(self):
+        self._closed.set()
+        self.flush()
+
+
+_event_logs = {}
+_event_logs_lock = threading.Lock()
+
+
+def get_event_log(path, **kwa):
+    """ The common `EventLog` for the path (flushed at exit) """
+    key = os.path.abspath(path)
+    with _event_logs_lock:
+        try:
+            return _event_logs[key]
+        except KeyError:
+            event_log = EventLog(path, **kwa)
+            _event_logs[key] = event_log
+            return event_log
+
+
+@atexit.register
+def close_event_logs():
+    with _event_logs_lock:
+        event_logs = list(_event_logs.values())
+    for event_log in event_logs:
+        event_log.close()
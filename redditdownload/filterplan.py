@@ -0,0 +1,119 @@
+"""Planning of the post filters: the part that reddit search can do
+(as a query) and the local predicate for everything else.
+
+:Example:
+
+>>> plan = FilterPlan('pics', score=100, nsfw=True, title_contain='cat')
+>>> plan.query
+'nsfw:yes self:no title:"cat"'
+>>> plan.local
+['comments', 'score', 'nsfw', 'title']
+>>> plan.skip_reason(dict(url='http://i.redd.it/x.jpg', score=5, over_18=True, title='Cat'))
+'score'
+"""
+
+import re
+from urllib.parse import urlsplit
+
+
+# compile reddit comment url to check if url is one of them
+_REDDIT_COMMENT_RE = re.compile(r'.*reddit\.com\/r\/(.*?)\/comments')
+
+# `reddit_sort` prefixes with a search equivalent; the default listing
+# is 'hot', the rest ('rising', 'controversial', 'gilded') falls back to 'new'.
+_SEARCH_SORTS = ('hot', 'new', 'top', 'comments', 'relevance')
+
+
+def url_on_site(url, site):
+    """Whether the url host is `site` or its subdomain"""
+    host = (urlsplit(url).hostname or '').lower()
+    site = site.lower()
+    return host == site or host.endswith('.' + site)
+
+
+def search_params(query, reddit_sort=None):
+    """`search.json` query parameters for the `reddit_sort` (e.g. 'topweek')"""
+    params = [('q', query), ('restrict_sr', 'on'), ('include_over_18', 'on')]
+    sort, time_limit = 'hot' if not reddit_sort else 'new', None
+    if reddit_sort:
+        for name in _SEARCH_SORTS:
+            if reddit_sort.startswith(name):
+                sort, time_limit = name, reddit_sort[len(name):] or None
+                break
+    params.append(('sort', sort))
+    if time_limit:
+        params.append(('t', time_limit))
+    return params
+
+
+class FilterPlan(object):
+    """
+    The filters of a crawl, split into a reddit search query (`query`)
+    and a single predicate (`skip_reason`) built once from the active
+    checks.
+
+    Pushed-down filters are also kept locally when the search only
+    approximates them: the search tokenizes titles (so `title:` is
+    word-based, not a substring match) and only knows self posts, not
+    links to other comment pages.
+    """
+
+    def __init__(self, subreddit, score=0, sfw=False, nsfw=False, title_contain=None,
+                 regex=None, skip_albums=False, site=None):
+        self.subreddit = subreddit
+        self.score = score
+        self.sfw = sfw
+        self.nsfw = nsfw
+        self.title_contain = title_contain
+        self.re_rule = re.compile(regex) if regex else None
+        self.skip_albums = skip_albums
+        self.site = site
+        self.query = self._plan_query()
+        self._checks = self._plan_checks()
+        self.local = [reason for reason, _ in self._checks]
+
+    def _plan_query(self):
+        terms = []
+        if self.nsfw:
+            terms.append('nsfw:yes')
+        elif self.sfw:
+            terms.append('nsfw:no')
+        terms.append('self:no')
+        if self.site:
+            terms.append('site:{}'.format(self.site))
+        if self.title_contain:
+            title = self.title_contain.replace('"', ' ').strip()
+            if title:
+                terms.append('title:"{}"'.format(title))
+        return ' '.join(terms)
+
+    def _plan_checks(self):
+        """(reason, item -> bool) for the active filters, in the order of
+        the reported skip reasons"""
+        comments_marker = 'reddit.com/r/' + self.subreddit + '/comments/'
+        checks = [
+            ('comments', lambda item: (
+                comments_marker in item['url'] or _REDDIT_COMMENT_RE.match(item['url']) is not None)),
+            ('score', lambda item: item['score'] < self.score),
+        ]
+        if self.sfw:
+            checks.append(('sfw', lambda item: item['over_18']))
+        if self.nsfw:
+            checks.append(('nsfw', lambda item: not item['over_18']))
+        if self.re_rule is not None:
+            checks.append(('regex', lambda item: self.re_rule.match(item['title']) is None))
+        if self.skip_albums:
+            checks.append(('album', lambda item: 'imgur.com/a/' in item['url']))
+        if self.site:
+            checks.append(('site', lambda item: not url_on_site(item['url'], self.site)))
+        if self.title_contain:
+            title = self.title_contain.lower()
+            checks.append(('title', lambda item: title not in item['title'].lower()))
+        return checks
+
+    def skip_reason(self, item):
+        """Why the item should not be downloaded (None if it should be)"""
+        for reason, check in self._checks:
+            if check(item):
+                return reason
+        return None
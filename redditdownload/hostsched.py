@@ -0,0 +1,187 @@
+"""Per-host download concurrency (AIMD) and bandwidth caps.
+
+Each host gets its own concurrency limit: raised additively while its
+downloads succeed and cut multiplicatively on congestion signals (429,
+5xx, timeouts), the way TCP handles its congestion window.  Optional
+token buckets cap the bytes per second, globally and per host.
+"""
+
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+
+_log = logging.getLogger(__name__)
+
+_RATE_SUFFIXES = dict(k=2 ** 10, m=2 ** 20, g=2 ** 30)
+
+
+def parse_rate(value):
+    """'512k' / '2M' / '1000' -> bytes per second"""
+    value = value.strip().lower()
+    if value.endswith('/s'):
+        value = value[:-2]
+    if value.endswith('b'):
+        value = value[:-1]
+    if value and value[-1] in _RATE_SUFFIXES:
+        return float(value[:-1]) * _RATE_SUFFIXES[value[-1]]
+    return float(value)
+
+
+def url_host(url):
+    return (urlsplit(url).hostname or '').lower()
+
+
+class TokenBucket(object):
+    """
+    Bytes-per-second cap shared between threads.
+
+    `consume` takes the tokens right away (possibly going into debt) and
+    sleeps until the debt would have been refilled, so big chunks don't
+    starve behind small ones.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class _HostState(object):
+
+    def __init__(self, limit):
+        self.limit = float(limit)
+        self.active = 0
+        self.successes = 0
+        self.congestions = 0
+        self.last_cut = 0.0
+        self.bucket = None
+
+
+class Slot(object):
+    """A download slot of a host; set `outcome` to 'ok' or 'congested'
+    (anything else leaves the host limit as is)."""
+
+    def __init__(self, host, buckets):
+        self.host = host
+        self.outcome = None
+        self._buckets = buckets
+
+    def throttle(self, nbytes):
+        """Account for `nbytes` read, sleeping as needed for the bandwidth caps"""
+        for bucket in self._buckets:
+            bucket.consume(nbytes)
+
+
+class HostScheduler(object):
+    """
+    Per-host AIMD concurrency limits plus bandwidth caps.
+
+    A limit grows by `increase / limit` per successful download (i.e. by
+    `increase` per round of `limit` downloads), up to `max_limit`, and is
+    multiplied by `decrease` on congestion (at most once per `cooldown`
+    seconds, since the in-flight downloads of a host usually fail
+    together).
+
+    :Example:
+
+    >>> sched = HostScheduler(initial=2, max_limit=8)
+    >>> with sched.slot('i.redd.it') as slot:
+    ...     slot.outcome = 'ok'
+    >>> round(sched.limit('i.redd.it'), 2)
+    2.5
+    """
+
+    def __init__(self, initial=2, max_limit=16, min_limit=1, increase=1.0, decrease=0.5,
+                 cooldown=1.0, bandwidth=None, host_bandwidth=None):
+        self.initial = initial
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.bucket = TokenBucket(bandwidth) if bandwidth else None
+        self.host_bandwidth = host_bandwidth
+        self._hosts = {}
+        self._cond = threading.Condition()
+
+    def _state(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _HostState(min(self.initial, self.max_limit))
+            if self.host_bandwidth:
+                state.bucket = TokenBucket(self.host_bandwidth)
+        return state
+
+    def limit(self, host):
+        with self._cond:
+            return self._state(host).limit
+
+    def _take(self, state, host):
+        state.active += 1
+        buckets = [bucket for bucket in (state.bucket, self.bucket) if bucket is not None]
+        return Slot(host, buckets)
+
+    def acquire(self, host):
+        """Wait for a slot of the host"""
+        with self._cond:
+            state = self._state(host)
+            while state.active >= int(state.limit):
+                self._cond.wait()
+            return self._take(state, host)
+
+    def try_acquire(self, host):
+        """A slot of the host, None if it is at its limit"""
+        with self._cond:
+            state = self._state(host)
+            if state.active >= int(state.limit):
+                return None
+            return self._take(state, host)
+
+    def release(self, slot):
+        with self._cond:
+            state = self._state(slot.host)
+            state.active -= 1
+            if slot.outcome == 'ok':
+                state.successes += 1
+                state.limit = min(self.max_limit, state.limit + self.increase / state.limit)
+            elif slot.outcome == 'congested':
+                state.congestions += 1
+                now = time.monotonic()
+                if now - state.last_cut >= self.cooldown:
+                    state.last_cut = now
+                    state.limit = max(self.min_limit, state.limit * self.decrease)
+                    _log.info("%s: congestion, concurrency limit cut to %d",
+                              slot.host, int(state.limit))
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, host):
+        slot = self.acquire(host)
+        try:
+            yield slot
+        finally:
+            self.release(slot)
+
+    def stats(self):
+        """host -> limit, active, successes, congestions"""
+        with self._cond:
+            return {
+                host: dict(limit=round(state.limit, 2), active=state.active,
+                           successes=state.successes, congestions=state.congestions)
+                for host, state in self._hosts.items()}
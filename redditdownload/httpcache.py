@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# coding: utf8
+""" Content-addressed on-disk cache for fetched urls.
+
+Layout of the cache directory::
+
+    index.jsl          hash -> url log (one JSON object per line)
+    ab/abcdef0123...   the data, named by the sha1 of the url
+
+The in-memory LRU order is restored from the entry mtimes (which are
+bumped on every hit).  Kept py2-compatible as `img_scrap_stuff` uses it.
+"""
+
+import os
+import json
+import time
+import errno
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+_log = logging.getLogger(__name__)
+
+MiB = 2 ** 20
+
+
+def url_hash(url):
+    """ url -> hex digest used as the entry name """
+    if not isinstance(url, bytes):
+        url = url.encode('utf-8')
+    return hashlib.sha1(url).hexdigest()
+
+
+class HTTPCache(object):
+    """ url -> bytes cache with per-entry expiry and a total size bound.
+
+    >>> cache = HTTPCache('/tmp/some_cache_dir')  # doctest: +SKIP
+    >>> cache.put('http://example.com/', b'data', max_age=3600)  # doctest: +SKIP
+    >>> cache.get('http://example.com/')  # doctest: +SKIP
+    b'data'
+    >>> cache.put('http://example.com/x', b'text', meta=dict(encoding='cp1251'))  # doctest: +SKIP
+    >>> cache.lookup('http://example.com/x')  # doctest: +SKIP
+    (b'text', {'encoding': 'cp1251'})
+    """
+
+    index_filename = 'index.jsl'
+
+    def __init__(self, cache_dir, max_age=7 * 86400, max_size=1024 * MiB):
+        self.cache_dir = cache_dir
+        self.max_age = max_age  # default per-entry lifetime, seconds; None for 'forever'
+        self.max_size = max_size  # bytes; None for 'unbounded'
+        self.index_file = os.path.join(cache_dir, self.index_filename)
+        self.stats = dict(hits=0, misses=0, expired=0, stores=0, evictions=0)
+        self.size = 0
+        # urlhash -> dict(url=..., expires=..., size=..., meta=...); least recently used first.
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _path(self, urlhash):
+        return os.path.join(self.cache_dir, urlhash[:2], urlhash)
+
+    def _load(self):
+        """ Replay the index log; drop the entries without the data files """
+        try:
+            os.makedirs(self.cache_dir)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+        records = {}
+        lines = 0
+        try:
+            with open(self.index_file) as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        _log.error("Broken index line: %r", line)
+                        continue
+                    records[rec['hash']] = rec
+        except IOError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+        found = []
+        for urlhash, rec in records.items():
+            try:
+                stat = os.stat(self._path(urlhash))
+            except OSError:
+                continue
+            found.append((stat.st_mtime, urlhash, dict(
+                url=rec['url'], expires=rec.get('expires'), size=stat.st_size,
+                meta=rec.get('meta'))))
+        for _, urlhash, entry in sorted(found):
+            self._entries[urlhash] = entry
+            self.size += entry['size']
+        # Compact the log when it is mostly stale records.
+        if lines > 2 * len(self._entries) + 100:
+            self._rewrite_index()
+
+    def _index_record(self, urlhash, entry):
+        return json.dumps(dict(
+            hash=urlhash, url=entry['url'], expires=entry['expires'],
+            meta=entry['meta'])) + '\n'
+
+    def _rewrite_index(self):
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, prefix='.index.')
+        with os.fdopen(fd, 'w') as f:
+            for urlhash, entry in self._entries.items():
+                f.write(self._index_record(urlhash, entry))
+        os.rename(tmp, self.index_file)
+
+    def _drop(self, urlhash):
+        """ Remove an entry (lock must be held) """
+        entry = self._entries.pop(urlhash, None)
+        if entry is None:
+            return
+        self.size -= entry['size']
+        try:
+            os.remove(self._path(urlhash))
+        except OSError:
+            pass
+
+    def get(self, url):
+        """ Cached data for the url or None """
+        found = self.lookup(url)
+        return found[0] if found is not None else None
+
+    def lookup(self, url):
+        """ `(data, meta)` cached for the url or None """
+        urlhash = url_hash(url)
+        with self._lock:
+            entry = self._entries.get(urlhash)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            if entry['expires'] is not None and entry['expires'] < time.time():
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                self._drop(urlhash)
+                return None
+            # Mark as recently used (both in memory and for the next `_load`).
+            self._entries[urlhash] = self._entries.pop(urlhash)
+            path = self._path(urlhash)
+            try:
+                os.utime(path, None)
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except (IOError, OSError):
+                self.stats['misses'] += 1
+                self._drop(urlhash)
+                return None
+            self.stats['hits'] += 1
+            return data, entry['meta']
+
+    def put(self, url, data, max_age=None, meta=None):
+        """ Store the data for the url (`max_age` defaults to the cache's),
+        with a small JSON-able `meta` (e.g. the response encoding) """
+        if max_age is None:
+            max_age = self.max_age
+        if self.max_size is not None and len(data) > self.max_size:
+            return
+        urlhash = url_hash(url)
+        path = self._path(urlhash)
+        entry = dict(
+            url=url, size=len(data), meta=meta,
+            expires=(time.time() + max_age) if max_age is not None else None)
+        subdir = os.path.dirname(path)
+        if not os.path.isdir(subdir):
+            try:
+                os.makedirs(subdir)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+        fd, tmp = tempfile.mkstemp(dir=subdir, prefix='.tmp.')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            self._drop(urlhash)
+            os.rename(tmp, path)
+            self._entries[urlhash] = entry
+            self.size += entry['size']
+            self.stats['stores'] += 1
+            with open(self.index_file, 'a') as f:
+                f.write(self._index_record(urlhash, entry))
+            self._evict()
+
+    def _evict(self):
+        """ Drop the least recently used entries down to `max_size` (lock must be held) """
+        if self.max_size is None:
+            return
+        while self.size > self.max_size and self._entries:
+            urlhash = next(iter(self._entries))
+            _log.debug("Evicting %r", self._entries[urlhash]['url'])
+            self._drop(urlhash)
+            self.stats['evictions'] += 1
+
+    def __contains__(self, url):
+        return url_hash(url) in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_stats(self):
+        """ Counters plus the current size and hit ratio """
+        with self._lock:
+            res = dict(self.stats, entries=len(self._entries), size=self.size)
+        lookups = res['hits'] + res['misses']
+        res['hit_ratio'] = (float(res['hits']) / lookups) if lookups else None
+        return res
@@ -10,8 +10,12 @@ import sys
 import re
 import json
 import logging
+import time
 import urlparse
+import threading
 import traceback
+import contextlib
+from collections import OrderedDict
 
 from PIL import Image
 from cStringIO import StringIO
@@ -20,14 +24,29 @@ import html5lib  # Heavily recommended for bs4 (apparently)
 import bs4
 import requests
 import magic  # python-magic
+# NOTE: py2 needs the `futures` backport for this.
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 
 import pyaux
 
+from httpcache import HTTPCache
+from retry import RetryPolicy, CircuitOpenError, get_circuit_breaker
+
 
 # Config-ish
 _requests_params = dict(timeout=20, verify=False)  ## Also global-ish stuff
 _CACHE_GET = False
+# Per-url on-disk cache for `get` (see `get_http_cache`).
+_CACHE_DIR = os.environ.get('IMG_SCRAP_CACHE_DIR')
+_CACHE_MAX_AGE = 7 * 86400
+_CACHE_MAX_SIZE = 2048 * 2 ** 20
 _BS_PARSER = "html5lib"  # "lxml"  # "html5lib", "lxml", "xml", "html.parser"
+# Candidate-probing limits for `do_horrible_things` (process-wide, shared
+# by the concurrent calls).
+_DHT_WORKERS = 8
+_DHT_PER_HOST = 2
+_DHT_DEADLINE = 180  # seconds per page; None for no limit
 
 
 # A bit sillily extensive; still, imgur and gfycat are loved by the reddits.
@@ -39,6 +58,9 @@ _log = logging.getLogger(__name__)
 MiB = 2 ** 20
 
 _common_reqr = None
+_common_http_cache = None
+_common_probing = None
+_common_probing_lock = threading.Lock()
 
 
 def indexall(topstr, substr):
@@ -212,48 +234,125 @@ def get_get_get(url, **kwa):
         raise GetError("Error getting url %r" % (url,), exc)
 
 
-def get_get(*ar, **kwa):
+def get_get(url, **kwa):
+    """ `get_get_get` with the common retry policy (backoff with jitter,
+    Retry-After, retryable errors and statuses only) and the per-host
+    circuit breaker; see `retry` """
     retries = kwa.pop('_xretries', 5)
-    for retry in xrange(retries):
-        try:
-            return get_get_get(*ar, **kwa)
-        except Exception as exc:
-            traceback.print_exc()
-            ee = exc
-            print "On retry #%r   (%s)" % (retry, repr(exc)[:30])
-    raise GetError(ee)
+    policy = RetryPolicy(retries=retries)
+    try:
+        return policy.call(
+            lambda: get_get_get(url, **kwa), url, breaker=get_circuit_breaker())
+    except CircuitOpenError as exc:
+        raise GetError(str(exc), exc)
 
 
-def get(url, cache_file=None, req_params=None, bs=True, response=False, undecoded=False,
-        _max_len=30 * MiB):
-    # TODO!: cache_dir (for per-url cache files with expiration)
-    # (e.g. urlhash-named files with a hash->url logfile)
+def get_http_cache():
+    """ The common `HTTPCache` (if `_CACHE_DIR` is configured) """
+    global _common_http_cache
+    if _common_http_cache is not None or not _CACHE_DIR:
+        return _common_http_cache
+    _log.info("Using http cache at %r", _CACHE_DIR)
+    _common_http_cache = HTTPCache(
+        _CACHE_DIR, max_age=_CACHE_MAX_AGE, max_size=_CACHE_MAX_SIZE)
+    return _common_http_cache
+
+
+def set_http_cache(cache):
+    """ Set the common cache: an `HTTPCache`, a directory path or None """
+    global _common_http_cache, _CACHE_DIR
+    if cache is not None and not isinstance(cache, HTTPCache):
+        cache = HTTPCache(cache, max_age=_CACHE_MAX_AGE, max_size=_CACHE_MAX_SIZE)
+    _common_http_cache = cache
+    _CACHE_DIR = cache.cache_dir if cache is not None else None
+    return cache
+
+
+class CachedResponse(object):
+    """ The parts of a `requests` response kept in the `HTTPCache` (the
+    bytes as sent, the encoding, the content type) """
+
+    status_code = 200
+    ok = True
+
+    def __init__(self, url, content, meta=None):
+        meta = meta or {}
+        self.url = meta.get('url') or url
+        self.content = content
+        self.encoding = meta.get('encoding')
+        self.headers = {}
+        if meta.get('content_type'):
+            self.headers['content-type'] = meta['content_type']
 
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', 'replace')
+
+    def iter_content(self, chunk_size=1):
+        for pos in xrange(0, len(self.content), chunk_size):
+            yield self.content[pos:pos + chunk_size]
+
+
+def _cache_meta(resp, encoding):
+    return dict(encoding=encoding, url=resp.url,
+                content_type=resp.headers.get('content-type'))
+
+
+def get(url, cache_file=None, req_params=None, bs=True, response=False, undecoded=False,
+        _max_len=30 * MiB, cache=None):
+    """ Fetch the url (possibly through a cache); see the flags for the
+    return value options.
+
+    `cache`: an `HTTPCache` to use instead of the common one (`False`
+    to not use any).  It keeps the bytes as sent along with the
+    encoding; the response object is a `CachedResponse` for its hits
+    (and `None` for the `cache_file` ones).
+    """
     if undecoded:
         bs = False
+    if cache is None:
+        cache = get_http_cache()
+    elif cache is False:
+        cache = None
     resp = None
+    data_bytes = None
     if _CACHE_GET and cache_file is not None and os.path.isfile(cache_file):
         with open(cache_file) as f:
             data_bytes = f.read()
-            data = data_bytes if undecoded else data_bytes.decode('utf-8')
-    else:
+        data = data_bytes if undecoded else data_bytes.decode('utf-8')
+    # (an empty `HTTPCache` is falsy)
+    elif cache is not None and not req_params:
+        found = cache.lookup(url)
+        if found is not None:
+            resp = CachedResponse(url, *found)
+            data_bytes = resp.content
+            data = data_bytes if undecoded else resp.text
+
+    if data_bytes is None:
         resp = get_get(url, stream=True, **(req_params or {}))
         #if resp.status_code != 200: ...
+        truncated = False
         if undecoded:
             data = bytearray()
             for chunk in resp.iter_content(chunk_size=16384):
                 data += chunk
                 if len(data) > _max_len:
                     print "Too large"
+                    truncated = True
                     break
             data = bytes(data)  ## Have to, alas.
             data_bytes = data
+            encoding = resp.encoding
         else:
+            data_bytes = resp.content
+            # (as `resp.text` decodes it)
+            encoding = resp.encoding or resp.apparent_encoding
             data = resp.text
-            data_bytes = data.encode('utf-8')
         if cache_file is not None:
             with open(cache_file, 'w') as f:
-                f.write(data_bytes)
+                f.write(data if undecoded else data.encode('utf-8'))
+        if cache is not None and not req_params and resp.ok and not truncated:
+            cache.put(url, data_bytes, meta=_cache_meta(resp, encoding))
     if not bs:  ## ... should've done a dict.
         if response:
             return data, resp
@@ -317,6 +416,33 @@ url4 = example_flickr_url_page
 flickr_page_re = re.compile(r'flickr\.com/photos.*[0-9]{9}')
 flickr_sizes = 'o k h l c'.split()  # 'z m n s t q sq'
 flickr_url_re = r'("(?:http|\\/\\/)[^"]+")'
+# All the sizes in one matcher; the matched size is ranked by its
+# position in `flickr_sizes` (the first is the best).
+flickr_size_re = re.compile(r'_(%s)\.[a-zA-Z0-9]{1,7}$' % ('|'.join(flickr_sizes),))
+flickr_size_rank = dict((size, rank) for rank, size in enumerate(flickr_sizes))
+
+_FLICKR_WORKERS = 8
+# Amount of the most recently used flickr page results to keep.
+_FLICKR_MEMO_SIZE = 4096
+# page url -> (is_complete_success, [candidate_link, ...]), least recently used first.
+_flickr_page_memo = OrderedDict()
+_flickr_page_memo_lock = threading.Lock()
+
+
+def _flickr_memo_get(url):
+    with _flickr_page_memo_lock:
+        result = _flickr_page_memo.pop(url, None)
+        if result is not None:
+            _flickr_page_memo[url] = result  # now the most recent
+        return result
+
+
+def _flickr_memo_put(url, result):
+    with _flickr_page_memo_lock:
+        _flickr_page_memo.pop(url, None)
+        _flickr_page_memo[url] = result
+        while len(_flickr_page_memo) > _FLICKR_MEMO_SIZE:
+            _flickr_page_memo.popitem(last=False)
 
 
 def flickr_album_to_pages(bs):
@@ -326,27 +452,56 @@ def flickr_album_to_pages(bs):
     return page_links
 
 
+def flickr_best_size_links(links):
+    """ The links of the best available size (sorted; empty if none) """
+    best_rank, best_links = None, set()
+    for lnk in links:
+        match = flickr_size_re.search(lnk)
+        if match is None:
+            continue
+        rank = flickr_size_rank[match.group(1)]
+        if best_rank is None or rank < best_rank:
+            best_rank, best_links = rank, set([lnk])
+        elif rank == best_rank:
+            best_links.add(lnk)
+    return sorted(best_links)
+
+
 def do_flickr_things(url, bs=None, html=None, maybe_album=True, **kwa):
     """ ...
 
+    Album pages are processed concurrently; the per-page results are
+    memoized in `_flickr_page_memo` (the last `_FLICKR_MEMO_SIZE` ones).
+
     returns (is_complete_success, [candidate_link, ...])
     """
     log = _log.getChild('do_flickr_things').info
     if maybe_album:
         log("Processing flickr maybe_album %r", url)
     else:
+        memoized = _flickr_memo_get(url)
+        if memoized is not None:
+            log("Already processed flickr page %r", url)
+            return memoized
         log("Processing flickr page %r", url)
 
     if bs is None:
         html, bs = get(url, bs=True)
 
     if maybe_album:
-        page_urls = flickr_album_to_pages(bs)
-        # Add the self-link in case it is not an album
-        page_urls = list(page_urls) + [url]
+        page_urls = [page_url for page_url in flickr_album_to_pages(bs) if page_url != url]
+
+        def _do_page(page_url):
+            return do_flickr_things(page_url, maybe_album=False, **kwa)
+
         # TODO?: exception handling? Probably don't want (yet) though.
-        results = [do_flickr_things(page_url, maybe_album=False, **kwa)
-                   for page_url in page_urls]
+        pool = ThreadPoolExecutor(max_workers=_FLICKR_WORKERS)
+        try:
+            results = list(pool.map(_do_page, page_urls))
+        finally:
+            pool.shutdown(wait=False)
+        # Add the self-link in case it is not an album (already fetched, so in-thread).
+        results.append(do_flickr_things(url, bs=bs, html=html, maybe_album=False, **kwa))
 
         result_links = [
             res_link
@@ -366,23 +521,15 @@ def do_flickr_things(url, bs=None, html=None, maybe_album=True, **kwa):
     links_by_re = [try_loads(lnk) for lnk in links_by_re]
     page_links = sorted(set(links_by_bs) | set(links_by_re))
 
-    # Links by extension
-    img_ext_links = [lnk for lnk in page_links if re.search(img_ext_re, lnk)]
-    img_ext_links = sorted(set(img_ext_links))
-
-    links_for_sizes = []
-    for size in flickr_sizes:
-        size_url_re = r'_%s\.[a-zA-Z0-9]{1,7}$' % (size,)
-        size_links = [lnk for lnk in page_links if re.search(size_url_re, lnk)]
-        size_links = sorted(set(size_links))
-        if size_links:
-            links_for_sizes.append((size, size_links))  # Save all for debug
-
-    if links_for_sizes:
-        _, target_links = links_for_sizes[0]
-        return True, target_links
+    target_links = flickr_best_size_links(page_links)
+    if target_links:
+        result = (True, target_links)
     else:
-        return False, img_ext_links
+        # Links by extension
+        img_ext_links = [lnk for lnk in page_links if re.search(img_ext_re, lnk)]
+        result = (False, sorted(set(img_ext_links)))
+    _flickr_memo_put(url, result)
+    return result
 
 
 def do_horrible_thing(url, base_url=None):
@@ -402,7 +549,65 @@ def do_horrible_thing(url, base_url=None):
     return data, resp
 
 
-def do_horrible_things(url=url2, do_horrible_thing_func=do_horrible_thing, urls_to_skip=None):
+def url_host(url):
+    """ Lowercased netloc of the url (for per-host bookkeeping) """
+    return urlparse.urlparse(url).netloc.lower()
+
+
+class HostLimiter(object):
+    """ A semaphore per host: at most `per_host` concurrent users of
+    each host.
+
+    >>> limiter = HostLimiter(per_host=2)
+    >>> with limiter('http://example.com/a.jpg'):
+    ...     pass
+    """
+
+    def __init__(self, per_host=_DHT_PER_HOST):
+        self.per_host = per_host
+        self._lock = threading.Lock()
+        self._sems = {}
+
+    def _get_sem(self, host):
+        with self._lock:
+            try:
+                return self._sems[host]
+            except KeyError:
+                sem = threading.BoundedSemaphore(self.per_host)
+                self._sems[host] = sem
+                return sem
+
+    @contextlib.contextmanager
+    def __call__(self, url):
+        sem = self._get_sem(url_host(url))
+        with sem:
+            yield
+
+
+def get_probing():
+    """ The process-wide `(pool, limiter)` for probing the candidates:
+    `_DHT_WORKERS` threads, `_DHT_PER_HOST` requests per host, across
+    all the `do_horrible_things` calls """
+    global _common_probing
+    with _common_probing_lock:
+        if _common_probing is None:
+            _common_probing = (ThreadPoolExecutor(max_workers=_DHT_WORKERS),
+                               HostLimiter(per_host=_DHT_PER_HOST))
+        return _common_probing
+
+
+def do_horrible_things(url=url2, do_horrible_thing_func=do_horrible_thing, urls_to_skip=None,
+                       probing=None, deadline=_DHT_DEADLINE, enough=None):
+    """ Check all the links on the page at `url` for being large images.
+
+    The candidates are probed on the `probing` `(pool, limiter)`
+    (default: `get_probing()`).  Probing stops (and the outstanding
+    probes are cancelled) after `deadline` seconds or once `enough`
+    images are found.
+
+    returns ([probed_url, ...], [(image_url, image_data, {'resp': ...}), ...], complete),
+    `complete` being False when the deadline left candidates unprobed.
+    """
     html, bs = get(url, cache_file='tmpf5_do_horrible_things.html', bs=True)
 
     def _pp(lst):
@@ -434,17 +639,59 @@ def do_horrible_things(url=url2, do_horrible_thing_func=do_horrible_thing, urls_
     # Synopsis: check each url on the page for being a notably large image and download all such
     # TODO?: grab all-all URLs (including plaintext)?
     _log.debug("dhts: %r (of %r) urls to check", len(to_check), to_check_baselen)
-    res = []
-    for turl in to_check:
+
+    deadline_at = (time.time() + deadline) if deadline else None
+    stop = threading.Event()
+    pool, limiter = probing or get_probing()
+    probed = set()
+    probed_lock = threading.Lock()
+
+    def _check(turl):
+        with limiter(turl):
+            # Might have waited on the host for quite a while.
+            if stop.is_set() or (deadline_at is not None and time.time() > deadline_at):
+                return None
+            try:
+                return do_horrible_thing_func(turl, base_url=url)
+            finally:
+                with probed_lock:
+                    probed.add(turl)
+
+    found = {}  # turl -> (turl, data, extras)
+    complete = True
+    futures = {}
+    try:
+        futures = dict((pool.submit(_check, turl), turl) for turl in to_check)
+        timeout = (max(0, deadline_at - time.time())
+                   if deadline_at is not None else None)
         try:
-            stuff = do_horrible_thing_func(turl, base_url=url)
-        except GetError:
-            continue  ## ... will be logged anyway.
-        if stuff:
-            data, resp = stuff[:2]
-            res.append((turl, data, dict(resp=resp)))
-    _log.debug("dhts: %r images found", len(res))
-    return to_check, res
+            for fut in as_completed(futures, timeout=timeout):
+                turl = futures[fut]
+                try:
+                    stuff = fut.result()
+                except GetError:
+                    continue  ## ... will be logged anyway.
+                if stuff:
+                    data, resp = stuff[:2]
+                    found[turl] = (turl, data, dict(resp=resp))
+                    if enough and len(found) >= enough:
+                        _log.debug("dhts: got enough (%r) images, stopping", len(found))
+                        break
+        except FuturesTimeoutError:
+            _log.warning("dhts: deadline (%rs) reached at %r", deadline, url)
+            complete = False
+    finally:
+        stop.set()
+        for fut in futures:
+            fut.cancel()
+        # The running probes finish in the background; their results are dropped.
+    # Keep the (url-sorted) page order regardless of the completion order.
+    res = [found[turl] for turl in to_check if turl in found]
+    with probed_lock:
+        checked = [turl for turl in to_check if turl in probed]
+    _log.debug("dhts: %r images found, %r of %r urls probed", len(res), len(checked),
+               len(to_check))
+    return checked, res, complete
 
 
 if __name__ == '__main__':
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# coding: utf8
+""" Streaming JSON-lines ('.jsl') logs: reading from a byte offset,
+sidecar offset checkpoints and an on-disk index of seen urls.
+
+Kept py2-compatible as `scrap_wrongies` uses it.
+"""
+
+import os
+import json
+import errno
+import hashlib
+import logging
+import sqlite3
+import tempfile
+import threading
+
+
+_log = logging.getLogger(__name__)
+
+
+def iter_jsl(fn, offset=0):
+    """ Stream (line_start, line_end, obj) from the file, starting at the
+    byte `offset`.
+
+    An incomplete last line (e.g. still being written) is not consumed.
+    """
+    log = _log.getChild('iter_jsl(%r)' % (fn,))
+    with open(fn, 'rb') as f:
+        f.seek(offset)
+        pos = offset
+        while True:
+            line = f.readline()
+            if not line.endswith(b'\n'):
+                return
+            start, pos = pos, pos + len(line)
+            try:
+                obj = json.loads(line.decode('utf-8'))
+            except ValueError:
+                log.error("JSON fail at %r: %r", start, line)
+                continue
+            yield start, pos, obj
+
+
+def iter_jsl_or_empty(fn, offset=0):
+    """ `iter_jsl` with a missing file being empty """
+    try:
+        for item in iter_jsl(fn, offset=offset):
+            yield item
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+class JSLWriter(object):
+    """ Appender of objects as json lines; lines from different threads
+    never interleave. """
+
+    def __init__(self, fn):
+        self.fn = fn
+        self._lock = threading.Lock()
+
+    def __call__(self, data):
+        line = json.dumps(data) + '\n'
+        with self._lock:
+            with open(self.fn, 'a', 1) as f:
+                f.write(line)
+
+
+class Checkpoint(object):
+    """ Byte offset into a log file stored in a sidecar file next to it
+    (`<fn>.offset`) """
+
+    def __init__(self, fn, suffix='.offset'):
+        self.fn = fn
+        self.checkpoint_fn = fn + suffix
+
+    def load(self):
+        """ The saved offset; 0 when there's none or the log got shorter
+        (i.e. was truncated or replaced) """
+        try:
+            with open(self.checkpoint_fn) as f:
+                offset = int(f.read().strip() or 0)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return 0
+        try:
+            size = os.path.getsize(self.fn)
+        except OSError:
+            size = 0
+        if offset > size:
+            _log.warning("Checkpoint %r is past the end of %r, starting over",
+                         offset, self.fn)
+            return 0
+        return offset
+
+    def save(self, offset):
+        dirname = os.path.dirname(os.path.abspath(self.checkpoint_fn))
+        fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.offset.')
+        with os.fdopen(fd, 'w') as f:
+            f.write('%d\n' % (offset,))
+        os.rename(tmp, self.checkpoint_fn)
+
+    def reset(self):
+        try:
+            os.remove(self.checkpoint_fn)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+def _url_key(url):
+    if not isinstance(url, bytes):
+        url = url.encode('utf-8')
+    return sqlite3.Binary(hashlib.md5(url).digest())
+
+
+class URLIndex(object):
+    """ Compact on-disk set of urls (16-byte hashes in an sqlite file).
+
+    Can follow a jsl log of records with an 'url' key (see `sync_from_jsl`).
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(fn, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'create table if not exists urls (hash blob primary key)')
+            self._db.execute(
+                'create table if not exists synced (log text primary key, offset integer)')
+
+    def __contains__(self, url):
+        with self._lock:
+            cur = self._db.execute('select 1 from urls where hash = ?', (_url_key(url),))
+            return cur.fetchone() is not None
+
+    def add(self, url):
+        with self._lock, self._db:
+            self._db.execute('insert or ignore into urls values (?)', (_url_key(url),))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('select count(*) from urls').fetchone()[0]
+
+    def sync_from_jsl(self, log_fn, batch=10000):
+        """ Add the urls from the part of the log not seen yet """
+        with self._lock:
+            row = self._db.execute(
+                'select offset from synced where log = ?', (log_fn,)).fetchone()
+        offset = row[0] if row else 0
+        try:
+            if offset > os.path.getsize(log_fn):
+                offset = 0
+        except OSError:
+            return
+        pending = []
+
+        def _flush(upto):
+            with self._lock, self._db:
+                self._db.executemany(
+                    'insert or ignore into urls values (?)',
+                    [(_url_key(url),) for url in pending])
+                self._db.execute(
+                    'insert or replace into synced values (?, ?)', (log_fn, upto))
+            del pending[:]
+
+        for _, offset, obj in iter_jsl_or_empty(log_fn, offset=offset):
+            if isinstance(obj, dict) and obj.get('url'):
+                pending.append(obj['url'])
+            if len(pending) >= batch:
+                _flush(offset)
+        _flush(offset)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
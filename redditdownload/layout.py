@@ -0,0 +1,173 @@
+"""Directory layouts of the downloaded files.
+
+- 'flat': every file right in the download dir (the default);
+- 'hash': `ab/cd/<filename>`, from the md5 of the filename (even spread);
+- 'id': `ab/cd/<filename>`, from the start of the filename (e.g. the
+  post id; reddit ids are sequential, so recent posts share a shard).
+
+The layout of a dir is kept in its `.redditdl-layout` file.  A flat dir
+is sharded in place (in parallel, resumable) with
+
+    python -m redditdownload.layout migrate wallpaper --layout hash --workers 8
+"""
+
+import os
+import sys
+import json
+import hashlib
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from .thumbs import variant_path, thumb_variants
+
+
+_log = logging.getLogger(__name__)
+
+LAYOUTS = ('flat', 'hash', 'id')
+LAYOUT_FILENAME = '.redditdl-layout'
+SHARD_DEPTH = 2
+SHARD_WIDTH = 2
+
+
+def shard_parts(filename, layout):
+    """The subdirectory names of the file in the layout"""
+    if layout == 'flat':
+        return ()
+    if layout == 'hash':
+        key = hashlib.md5(filename.encode('utf-8')).hexdigest()
+    elif layout == 'id':
+        key = os.path.splitext(filename)[0].lower().ljust(SHARD_DEPTH * SHARD_WIDTH, '_')
+    else:
+        raise ValueError("Unknown layout %r" % (layout,))
+    return tuple(key[idx * SHARD_WIDTH:(idx + 1) * SHARD_WIDTH] for idx in range(SHARD_DEPTH))
+
+
+def layout_path(dirname, filename, layout):
+    """Where the file goes in the layout"""
+    return os.path.join(dirname, *(shard_parts(filename, layout) + (filename,)))
+
+
+def existing_path(dirname, filename, layout):
+    """The path of the file if it is downloaded already: in the layout,
+    or still in the top dir (e.g. not migrated yet); None otherwise"""
+    path = layout_path(dirname, filename, layout)
+    if os.path.exists(path):
+        return path
+    flat = os.path.join(dirname, filename)
+    if layout != 'flat' and os.path.isfile(flat):
+        return flat
+    return None
+
+
+def read_layout(dirname):
+    """The layout recorded for the dir, None if there is none"""
+    try:
+        with open(os.path.join(dirname, LAYOUT_FILENAME)) as f:
+            return json.load(f)['layout']
+    except (IOError, OSError):
+        return None
+
+
+def write_layout(dirname, layout):
+    path = os.path.join(dirname, LAYOUT_FILENAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(dict(layout=layout), f)
+    os.replace(path + '.tmp', path)
+
+
+def resolve_layout(dirname, requested=None):
+    """The layout to use for the dir: the recorded one, else `requested`
+    (recorded for the next runs) or 'flat'"""
+    recorded = read_layout(dirname)
+    if recorded is None:
+        if requested and requested != 'flat':
+            write_layout(dirname, requested)
+        return requested or 'flat'
+    if requested and requested != recorded:
+        raise ValueError(
+            "%r uses the %r layout (see `python -m redditdownload.layout migrate`)" % (
+                dirname, recorded))
+    return recorded
+
+
+def _move(dirname, filename, layout, thumbs=()):
+    src = os.path.join(dirname, filename)
+    dest = layout_path(dirname, filename, layout)
+    if os.path.exists(dest):
+        return 'conflict'
+    # the thumbnails first: a rerun still finds the image in the top dir
+    for variant in thumbs:
+        thumb = variant_path(src, variant)
+        if os.path.exists(thumb):
+            os.makedirs(os.path.dirname(variant_path(dest, variant)), exist_ok=True)
+            os.rename(thumb, variant_path(dest, variant))
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    os.rename(src, dest)
+    return 'moved'
+
+
+def migrate(dirname, layout, workers=8, batch=10000):
+    """Move the files of the top dir into the layout, return the counts.
+
+    The layout is recorded first, so concurrent crawls use it right away
+    (their existing-file checks look at the top dir too).  The thumbnails
+    (`.thumbs/<variant>/<filename>.jpg`) move along with their images.
+    Every move is a rename, so an interrupted migration is resumed by
+    running it again.
+    """
+    recorded = read_layout(dirname)
+    if recorded not in (None, 'flat', layout):
+        raise ValueError("%r is in the %r layout already" % (dirname, recorded))
+    write_layout(dirname, layout)
+    counts = dict(moved=0, conflict=0, failed=0)
+    if layout == 'flat':
+        return counts
+    thumbs = thumb_variants(dirname)
+
+    def _move_safe(filename):
+        try:
+            return _move(dirname, filename, layout, thumbs)
+        except OSError as exc:
+            _log.warning("Failed to move %r: %r", filename, exc)
+            return 'failed'
+
+    with ThreadPoolExecutor(workers) as pool:
+        names = []
+        with os.scandir(dirname) as entries:
+            for entry in entries:
+                # the dotfiles are the downloader's own (watermarks, caches, ...)
+                if entry.name.startswith('.') or not entry.is_file(follow_symlinks=False):
+                    continue
+                names.append(entry.name)
+                if len(names) >= batch:
+                    for status in pool.map(_move_safe, names):
+                        counts[status] += 1
+                    names = []
+        for status in pool.map(_move_safe, names):
+            counts[status] += 1
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Download dir layouts.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    migrate_parser = commands.add_parser('migrate', help='Shard a flat dir in place.')
+    migrate_parser.add_argument('dir')
+    migrate_parser.add_argument('--layout', choices=LAYOUTS[1:], default='hash')
+    migrate_parser.add_argument('--workers', type=int, default=8)
+    show_parser = commands.add_parser('show', help='Print the layout of the dir.')
+    show_parser.add_argument('dir')
+    args = parser.parse_args(sys.argv[1:])
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'show':
+        print(read_layout(args.dir) or 'flat')
+        return
+    counts = migrate(args.dir, args.layout, workers=args.workers)
+    print('{}: {moved} moved, {conflict} left in place (already in the layout), '
+          '{failed} failed'.format(args.dir, **counts))
+
+
+if __name__ == '__main__':
+    main()
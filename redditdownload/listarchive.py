@@ -0,0 +1,131 @@
+"""Local archive of the fetched listing pages, to run the pipeline again
+(e.g. with other filters) without the network.
+
+Every run appends its pages to a gzipped JSON-lines segment,
+`<archive>/<subreddit>/<sort>/<run>.jsonl.gz` (a gzip member per page,
+so an interrupted run leaves a readable segment), and a line per page
+to `<archive>/index.jsonl`: subreddit, sort, query, run, segment, time.
+The pages of a search query go to their own segments
+(`<sort>/q-<hash>/<run>.jsonl.gz`) and are only replayed for that query.
+
+:Example:
+
+>>> archive = ListingArchive('wallpaper/.redditdl-listings')  # doctest: +SKIP
+>>> for items in archive.pages('wallpaper', 'new'):  # doctest: +SKIP
+...     print(len(items))
+"""
+
+import os
+import re
+import gzip
+import json
+import time
+import hashlib
+import zlib
+import logging
+import threading
+
+from .jsl import iter_jsl_or_empty, JSLWriter
+
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_DIRNAME = '.redditdl-listings'
+INDEX_FILENAME = 'index.jsonl'
+
+
+def _safe_name(name):
+    """Subreddit / multireddit name -> a directory name (reddit names
+    are case-insensitive)"""
+    return re.sub(r'[^\w.+-]', '_', name.strip('/')).lower() or '_'
+
+
+def sort_name(sort_type):
+    return (sort_type or 'hot').lower()
+
+
+class ListingArchive(object):
+    """
+    Listing pages by subreddit, sort and run time.
+
+    Replaying (`pages`) goes through the runs from the newest one and
+    skips the posts seen in a newer run, so each post comes once, as
+    last fetched.
+    """
+
+    def __init__(self, dirname, clock=time.time):
+        self.dirname = dirname
+        self.clock = clock
+        self.index_path = os.path.join(dirname, INDEX_FILENAME)
+        self.run = '{}-{}'.format(time.strftime('%Y%m%dT%H%M%S', time.gmtime(clock())),
+                                  os.getpid())
+        self._index = JSLWriter(self.index_path)
+        self._lock = threading.Lock()
+
+    def segment(self, subreddit, sort_type=None, query=None):
+        """The segment of this run, relative to the archive dir"""
+        parts = [_safe_name(subreddit), sort_name(sort_type)]
+        if query is not None:
+            parts.append('q-' + hashlib.md5(query.encode('utf-8')).hexdigest()[:12])
+        return os.path.join(*(parts + [self.run + '.jsonl.gz']))
+
+    def add_page(self, subreddit, sort_type, items, after=None, query=None):
+        """Archive a listing page (empty pages are not kept)"""
+        if not items:
+            return
+        segment = self.segment(subreddit, sort_type, query=query)
+        path = os.path.join(self.dirname, segment)
+        line = json.dumps(dict(after=after, items=items)) + '\n'
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with gzip.open(path, 'ab') as f:
+                f.write(line.encode('utf-8'))
+            self._index(dict(
+                subreddit=subreddit, sort=sort_name(sort_type), query=query, run=self.run,
+                segment=segment, after=after, posts=len(items), fetched_at=self.clock()))
+
+    def index(self, subreddit=None, sort=None, since=None):
+        """The index lines (of the subreddit / sort / fetched since the
+        time; any if None)"""
+        for _, _, entry in iter_jsl_or_empty(self.index_path):
+            if subreddit is not None and _safe_name(entry['subreddit']) != _safe_name(subreddit):
+                continue
+            if sort is not None and entry['sort'] != sort:
+                continue
+            if since is not None and entry['fetched_at'] < since:
+                continue
+            yield entry
+
+    def segments(self, subreddit, sort_type=None, since=None, query=None):
+        """The segments of the subreddit, sort and search query (None:
+        the plain listing), newest run first"""
+        started = {}
+        for entry in self.index(subreddit, sort_name(sort_type), since=since):
+            if entry.get('query') != query:
+                continue
+            started.setdefault(entry['segment'], entry['fetched_at'])
+        return sorted(started, key=started.get, reverse=True)
+
+    def read_segment(self, segment):
+        """The pages (lists of items) of the segment"""
+        path = os.path.join(self.dirname, segment)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    yield json.loads(line)['items']
+        except (EOFError, zlib.error, ValueError) as exc:
+            # the last page of an interrupted run
+            _log.warning("Truncated listing segment %r: %r", path, exc)
+        except (IOError, OSError) as exc:
+            _log.warning("Unreadable listing segment %r: %r", path, exc)
+
+    def pages(self, subreddit, sort_type=None, since=None, query=None):
+        """The archived pages of the subreddit, sort and search query
+        (each post once)"""
+        seen = set()
+        for segment in self.segments(subreddit, sort_type, since=since, query=query):
+            for items in self.read_segment(segment):
+                items = [item for item in items if item['id'] not in seen]
+                seen.update(item['id'] for item in items)
+                if items:
+                    yield items
@@ -0,0 +1,123 @@
+"""Download manifests: the posts to download, already filtered and
+resolved, as JSON lines.
+
+`redditdl.py ... --plan FILE` walks the listings and writes a manifest
+line per post::
+
+    {"id": "abc123", "subreddit": "wallpaper", "title": "...", "url": "...",
+     "media": [{"url": "https://i.imgur.com/x.jpg", "path": "abc123_0.jpg",
+                "type": "image/jpeg"}, ...]}
+
+and `redditdl.py ... --fetch FILE` downloads it, any number of times
+(downloaded files are skipped) and optionally split between machines
+with `--shard I/N`.
+"""
+
+import os
+import hashlib
+import logging
+from urllib.parse import urlsplit
+
+from .jsl import iter_jsl, JSLWriter
+from .embedded import media_extension
+
+
+_log = logging.getLogger(__name__)
+
+# the post fields kept in the manifest (the ones the download stages use)
+ITEM_FIELDS = ('id', 'name', 'subreddit', 'title', 'url', 'score', 'over_18',
+               'created_utc', 'permalink')
+
+# the types `download_from_url` accepts, by the url extension
+_EXTENSION_TYPES = {
+    '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png',
+    '.gif': 'image/gif', '.mp4': 'video/mp4', '.webm': 'video/webm'}
+
+
+def expected_type(url):
+    """The content type the url should have (from its extension), None
+    if it can't be told"""
+    extension = media_extension(url) or os.path.splitext(urlsplit(url).path)[1]
+    return _EXTENSION_TYPES.get(extension.lower())
+
+
+def manifest_entry(item, urls, paths, variants=None):
+    """The manifest line of the post: its fields plus the media urls
+    with their paths (relative to the download dir) and the chosen
+    variants (see `variants.pick_variant`), if any"""
+    entry = {key: item[key] for key in ITEM_FIELDS if key in item}
+    entry['media'] = [
+        dict(url=url, path=path, type=expected_type(url)) for url, path in zip(urls, paths)]
+    for medium, variant in zip(entry['media'], variants or ()):
+        if variant is not None:
+            medium['variant'] = variant
+    return entry
+
+
+def parse_shard(value):
+    """'1/4' -> (1, 4): the second of four shards"""
+    index, count = (int(part) for part in value.split('/'))
+    if not 0 <= index < count:
+        raise ValueError("Shard index out of range: %r" % (value,))
+    return index, count
+
+
+def in_shard(post_id, shard):
+    """Whether the post belongs to the `(index, count)` shard; the
+    split is by a hash of the id, so it is the same on every machine"""
+    if shard is None:
+        return True
+    index, count = shard
+    return int(hashlib.md5(post_id.encode('utf-8')).hexdigest()[:8], 16) % count == index
+
+
+def read_manifest(path, shard=None):
+    """The entries of the manifest (of the shard only, if given)"""
+    for _, _, entry in iter_jsl(path):
+        if in_shard(entry['id'], shard):
+            yield entry
+
+
+class ManifestWriter(object):
+    """
+    Writes a manifest to a temporary file, moved into place when the
+    plan is complete (so a fetch never sees half of a plan).
+
+    :Example:
+
+    >>> with ManifestWriter('wallpaper.jsonl') as manifest:  # doctest: +SKIP
+    ...     for result in crawler.plan():
+    ...         if result.outcome == 'planned':
+    ...             manifest.write(result.details['entry'])
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        self.count = 0
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        self._writer = JSLWriter(self.tmp_path)
+
+    def write(self, entry):
+        self._writer(entry)
+        self.count += 1
+
+    def close(self):
+        if not os.path.exists(self.tmp_path):
+            # an empty plan
+            open(self.tmp_path, 'w').close()
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
@@ -0,0 +1,168 @@
+"""Counters and histograms for the downloader, exportable as a
+Prometheus textfile or a JSON snapshot."""
+
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+
+_log = logging.getLogger(__name__)
+
+# seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# bytes per second
+THROUGHPUT_BUCKETS = tuple(2 ** power for power in range(12, 28, 2))
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels_key, extra=()):
+    items = list(labels_key) + list(extra)
+    if not items:
+        return ''
+    escaped = (
+        '{}="{}"'.format(key, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for key, value in items)
+    return '{' + ','.join(escaped) + '}'
+
+
+class _Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[idx] += 1
+
+    def snapshot(self):
+        return dict(count=self.count, sum=self.sum,
+                    buckets=dict(zip(map(str, self.buckets), self.counts)))
+
+
+class Metrics(object):
+    """
+    Thread-safe registry of labelled counters and histograms.
+
+    :Example:
+
+    >>> metrics = Metrics()
+    >>> with metrics.timer('listing'):
+    ...     pass
+    >>> metrics.inc('downloaded_bytes', 1024)
+    >>> 'redditdl_downloaded_bytes_total 1024' in metrics.to_prometheus()
+    True
+    """
+
+    def __init__(self, prefix='redditdl'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = {}  # name -> {labels_key -> value}
+        self._histograms = {}  # name -> {labels_key -> _Histogram}
+        self._buckets = {'download_throughput_bytes_per_second': THROUGHPUT_BUCKETS}
+        self._writer = None
+        self._writer_stop = threading.Event()
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            key = _labels_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            key = _labels_key(labels)
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = _Histogram(self._buckets.get(name, DEFAULT_BUCKETS))
+            hist.observe(value)
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        """Observe the duration of the block as `stage_seconds{stage=...}`"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('stage_seconds', time.perf_counter() - start, stage=stage, **labels)
+
+    def observe_download(self, nbytes, seconds, **labels):
+        self.inc('downloaded_bytes', nbytes, **labels)
+        if seconds > 0:
+            self.observe('download_throughput_bytes_per_second', nbytes / seconds, **labels)
+
+    def snapshot(self):
+        """Everything as a JSON-serializable dict"""
+        with self._lock:
+            return dict(
+                ts=time.time(),
+                counters={
+                    name: [dict(labels=dict(key), value=value) for key, value in sorted(series.items())]
+                    for name, series in self._counters.items()},
+                histograms={
+                    name: [dict(labels=dict(key), **hist.snapshot()) for key, hist in sorted(series.items())]
+                    for name, series in self._histograms.items()})
+
+    def to_prometheus(self):
+        """Everything in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                full_name = '{}_{}_total'.format(self.prefix, name)
+                lines.append('# TYPE {} counter'.format(full_name))
+                for key, value in sorted(series.items()):
+                    lines.append('{}{} {}'.format(full_name, _format_labels(key), value))
+            for name, series in sorted(self._histograms.items()):
+                full_name = '{}_{}'.format(self.prefix, name)
+                lines.append('# TYPE {} histogram'.format(full_name))
+                for key, hist in sorted(series.items()):
+                    for bound, count in zip(hist.buckets, hist.counts):
+                        lines.append('{}_bucket{} {}'.format(
+                            full_name, _format_labels(key, [('le', bound)]), count))
+                    lines.append('{}_bucket{} {}'.format(
+                        full_name, _format_labels(key, [('le', '+Inf')]), hist.count))
+                    lines.append('{}_sum{} {}'.format(full_name, _format_labels(key), hist.sum))
+                    lines.append('{}_count{} {}'.format(full_name, _format_labels(key), hist.count))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path, fmt='prometheus'):
+        """Atomically (re)write the file at `path` ('prometheus' or 'json' format)"""
+        if fmt == 'json':
+            data = json.dumps(self.snapshot(), sort_keys=True)
+        else:
+            data = self.to_prometheus()
+        dirname = os.path.dirname(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.metrics.')
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+
+    def start_writer(self, path, fmt='prometheus', interval=15):
+        """Rewrite the file every `interval` seconds (in a daemon thread)"""
+        def _write_periodically():
+            while not self._writer_stop.wait(interval):
+                try:
+                    self.write(path, fmt=fmt)
+                except Exception:
+                    _log.exception("Failed to write the metrics to %r", path)
+
+        self._writer = threading.Thread(target=_write_periodically, name='metrics-writer')
+        self._writer.daemon = True
+        self._writer.start()
+
+    def stop_writer(self):
+        self._writer_stop.set()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# coding: utf8
+""" In-memory per-directory file name indexes for picking non-colliding
+filenames without probing the filesystem for each candidate.
+
+Kept py2-compatible as `scrap_wrongies` uses it.
+"""
+
+import os
+import errno
+import logging
+import threading
+
+
+_log = logging.getLogger(__name__)
+
+
+def _listdir(dirname):
+    scandir = getattr(os, 'scandir', None)
+    if scandir is None:
+        return os.listdir(dirname)
+    return [entry.name for entry in scandir(dirname)]
+
+
+def split_name(name):
+    """ 'name.ext' -> ('name', '.ext'); 'name' -> ('name', '') """
+    parts = name.rsplit('.', 1)
+    if len(parts) == 1:
+        return name, ''
+    return parts[0], '.' + parts[1]
+
+
+class DirNameIndex(object):
+    """ The names in a directory (listed once, then kept up to date by
+    the `add` / `reserve` calls), plus the per-name next free
+    `__NN` suffix. """
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        try:
+            self._names = set(_listdir(dirname))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            self._names = set()
+        self._next_suffix = {}  # (base, ext) -> int
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, name):
+        with self._lock:
+            self._names.add(name)
+
+    def discard(self, name):
+        with self._lock:
+            self._names.discard(name)
+
+    def _candidates(self, name):
+        """ 'name.ext', 'name__01.ext', 'name__02.ext', ... (lock must be held) """
+        if name not in self._names:
+            yield name
+        base, ext = split_name(name)
+        key = (base, ext)
+        while True:
+            num = self._next_suffix.get(key, 1)
+            self._next_suffix[key] = num + 1
+            yield '%s__%02d%s' % (base, num, ext)
+
+    def reserve(self, name):
+        """ Create an empty file with the first free name among `name`,
+        `name__01`, ... (with the extension kept at the end) and return
+        its full path.
+
+        The file is created exclusively (O_EXCL), so the name is not
+        handed out twice even with other processes writing into the
+        directory; the caller is expected to overwrite it.
+        """
+        with self._lock:
+            for candidate in self._candidates(name):
+                if candidate in self._names:
+                    continue
+                path = os.path.join(self.dirname, candidate)
+                try:
+                    fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+                    # Created behind our back.
+                    self._names.add(candidate)
+                    continue
+                os.close(fd)
+                self._names.add(candidate)
+                return path
+
+
+_dir_indexes = {}
+_dir_indexes_lock = threading.Lock()
+
+
+def get_dir_index(dirname):
+    """ The common `DirNameIndex` for the directory (listed on first use) """
+    key = os.path.abspath(dirname)
+    with _dir_indexes_lock:
+        try:
+            return _dir_indexes[key]
+        except KeyError:
+            _log.debug("Indexing %r", key)
+            index = DirNameIndex(key)
+            _dir_indexes[key] = index
+            return index
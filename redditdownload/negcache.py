@@ -0,0 +1,92 @@
+"""Persistent negative cache of dead media urls (404s, removed images,
+wrong content types, invalid urls), so they are not requested again on
+every run."""
+
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_FILENAME = '.redditdl-negative.db'
+DAY = 86400
+
+# HTTP statuses that mean the media is gone (and not a transient error)
+DEAD_STATUSES = frozenset((404, 410))
+
+
+def _url_key(url):
+    return hashlib.md5(url.encode('utf-8')).digest()
+
+
+class NegativeCache(object):
+    """
+    url -> (failure kind, expiry), in an sqlite file.
+
+    The entry of an url that keeps failing lives longer each time:
+    `base_ttl * 2 ** (failures - 1)`, up to `max_ttl`.
+
+    :Example:
+
+    >>> cache = NegativeCache(':memory:')
+    >>> cache.add('http://i.imgur.com/gone.jpg', 'removed')
+    >>> cache.get('http://i.imgur.com/gone.jpg')['kind']
+    'removed'
+    """
+
+    def __init__(self, path, base_ttl=DAY, max_ttl=90 * DAY, clock=time.time):
+        self.path = path
+        self.base_ttl = base_ttl
+        self.max_ttl = max_ttl
+        self.clock = clock
+        self.stats = dict(hits=0, misses=0, added=0)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'create table if not exists dead ('
+                ' hash blob primary key, url text, kind text, failures integer,'
+                ' last_failed real, expires real)')
+            # long-expired entries (whose failure count is not worth keeping)
+            self._db.execute('delete from dead where expires < ?', (clock() - max_ttl,))
+
+    def get(self, url):
+        """The unexpired entry of the url (a dict of kind, failures,
+        last_failed, expires) or None"""
+        with self._lock:
+            row = self._db.execute(
+                'select kind, failures, last_failed, expires from dead where hash = ?',
+                (_url_key(url),)).fetchone()
+            if row is None or row[3] <= self.clock():
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+        return dict(zip(('kind', 'failures', 'last_failed', 'expires'), row))
+
+    def __contains__(self, url):
+        return self.get(url) is not None
+
+    def add(self, url, kind):
+        """Record a failure of the url"""
+        now = self.clock()
+        with self._lock, self._db:
+            row = self._db.execute(
+                'select failures from dead where hash = ?', (_url_key(url),)).fetchone()
+            failures = (row[0] if row else 0) + 1
+            ttl = min(self.max_ttl, self.base_ttl * 2 ** (failures - 1))
+            self._db.execute(
+                'insert or replace into dead values (?, ?, ?, ?, ?, ?)',
+                (_url_key(url), url, kind, failures, now, now + ttl))
+            self.stats['added'] += 1
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute(
+                'select count(*) from dead where expires > ?', (self.clock(),)).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -2,19 +2,23 @@
 """Return list of items from a sub-reddit of reddit.com."""
 
 import sys
-from html.parser import HTMLParser
 import html
 from urllib.request import urlopen, Request, HTTPError
+from urllib.parse import urlencode
 from json import JSONDecoder
 
+from .filterplan import search_params
 
-def getitems(subreddit, multireddit=False, previd='', reddit_sort=None):
+
+def getitems(subreddit, multireddit=False, previd='', reddit_sort=None, query=None):
     """Return list of items from a subreddit.
 
     :param subreddit: subreddit to load the post
     :param multireddit: multireddit if given instead subreddit
     :param previd: previous post id, to get more post
     :param reddit_sort: type of sorting post
+    :param query: reddit search query (see `filterplan.FilterPlan`), to
+        list the matching posts only
     :returns: list -- list of post url
 
     :Example:
@@ -56,6 +60,18 @@ def getitems(subreddit, multireddit=False, previd='', reddit_sort=None):
         else:
             url = 'http://www.reddit.com/r/{}/{}.json'.format(subreddit, reddit_sort)
 
+    if query:
+        # search within the subreddit (or multireddit) instead of its listing
+        if multireddit:
+            url = 'http://www.reddit.com/user/%s/search.json' % subreddit
+        else:
+            url = 'http://www.reddit.com/r/{}/search.json'.format(subreddit)
+        params = search_params(query, reddit_sort)
+        if previd:
+            params.append(('after', 't3_%s' % previd))
+        url = '%s?%s' % (url, urlencode(params))
+        previd = reddit_sort = None
+
     # Get items after item with 'id' of previd.
 
     hdr = {'User-Agent': 'RedditImageGrab script.'}
@@ -117,13 +133,18 @@ def getitems(subreddit, multireddit=False, previd='', reddit_sort=None):
         error_message = '\tKeyboardInterrupt: url:{}.'.format(url)
         sys.exit(error_message)
 
+    for item in items:
+        unescape_url(item)
+
+    return items
+
+
+def unescape_url(item):
+    """Unescape the `url` of the item in place (and return the item)"""
     # This is weird but apparently necessary: reddit's json data
     # returns `url` values html-escaped, whereas we normally need them
     # in the way they are meant to be downloaded (i.e. urlquoted at
     # most).
-    htmlparser = HTMLParser()#.HTMLParser()
-    for item in items:
-        if item.get('url'):
-            item['url'] = html.unescape(item['url'])
-
-    return items
+    if item.get('url'):
+        item['url'] = html.unescape(item['url'])
+    return item
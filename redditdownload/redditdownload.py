@@ -18,6 +18,7 @@ from os.path import (
     splitext as pathsplitext)
 from os import mkdir, getcwd
 import time
+import threading
 import pdb
 import nltk
 import textwrap
@@ -25,30 +26,38 @@ import textwrap
 # nltk.download('averaged_perceptron_tagger')
 
 from .gfycat import gfycat
-from .reddit import getitems
 from .deviantart import process_deviant_url
+from .eventlog import get_event_log
+from .metrics import Metrics
+from .hostsched import parse_rate
+from .thumbs import parse_size
+from .variants import pick_gfycat
+from .layout import LAYOUTS, read_layout
+from .manifest import parse_shard, read_manifest, ManifestWriter
+from .dumps import DumpReader
+from .retry import RetryPolicy, get_circuit_breaker
+from .trace import Tracer, NullTracer
 from PIL import Image, ImageDraw, ImageFont, ImageColor
 
 
 _log = logging.getLogger('redditdownload')
 
+# seconds
+_REQUEST_TIMEOUT = 60
+
 
 def request(url, *ar, **kwa):
+    """`urlopen` with the retry policy (backoff, Retry-After, retryable
+    errors only) and the per-host circuit breaker (see `retry`)."""
     _retries = kwa.pop('_retries', 4)
-    _retry_pause = kwa.pop('_retry_pause', 0)
-    res = None
-    for _try in range(_retries):
-        try:
-            res = urlopen(url, *ar, **kwa)
-        except Exception as exc:
-            if _try == _retries - 1:
-                raise
-            print("Try %r err %r  (%r)" % (
-                _try, exc, url))
-        else:
-            break
-    return res
+    _retry_pause = kwa.pop('_retry_pause', 0.5)
+    kwa.setdefault('timeout', _REQUEST_TIMEOUT)
+    policy = RetryPolicy(retries=_retries, base=_retry_pause)
+    return policy.call(lambda: urlopen(url, *ar, **kwa), url, breaker=get_circuit_breaker())
+
 
+# bytes per read when the download is throttled
+_DOWNLOAD_CHUNK = 64 * 1024
 
 # '.wrong_type_pages.jsl'
 _WRONGDATA_LOGFILE = os.environ.get('WRONGDATA_LOGFILE')
@@ -57,10 +66,9 @@ _WRONGDATA_LOGFILE = os.environ.get('WRONGDATA_LOGFILE')
 def _log_wrongtype(_logfile=_WRONGDATA_LOGFILE, **kwa):
     if not _logfile:
         return
-    import json
-    data = json.dumps(kwa) + "\n"
-    with open(_logfile, 'a', 1) as f:
-        f.write(data)
+    # Written out per record: it is the input of `scrap_wrongies` (and
+    # low volume), so a crash must not lose any.
+    get_event_log(_logfile, flush_every=1, flush_interval=None).write(kwa)
 
 
 class WrongFileTypeException(Exception):
@@ -108,10 +116,13 @@ def extract_imgur_album_urls(album_url):
 
 
 
-def download_from_url(url, dest_file):
+def download_from_url(url, dest_file, throttle=None):
     """
     Attempt to download file specified by url to 'dest_file'
 
+    `throttle`, if given, is called with the size of each chunk read
+    (e.g. `hostsched.Slot.throttle`, for the bandwidth caps).
+
     Raises:
 
         WrongFileTypeException
@@ -127,6 +138,9 @@ def download_from_url(url, dest_file):
         HTTPError
 
             ...
+
+    Returns:
+        the amount of bytes written.
     """
     # Don't download files multiple times!
     if pathexists(dest_file):
@@ -158,10 +172,21 @@ def download_from_url(url, dest_file):
     if filetype not in ['image/jpeg', 'image/png', 'image/gif', 'video/webm', 'video/mp4']:
         raise WrongFileTypeException('WRONG FILE TYPE: %s has type: %s!' % (url, filetype))
 
-    filedata = response.read()
+    if throttle is None:
+        filedata = response.read()
+    else:
+        chunks = []
+        while True:
+            chunk = response.read(_DOWNLOAD_CHUNK)
+            if not chunk:
+                break
+            throttle(len(chunk))
+            chunks.append(chunk)
+        filedata = b''.join(chunks)
     filehandle = open(dest_file, 'wb')
     filehandle.write(filedata)
     filehandle.close()
+    return len(filedata)
 
 
 def process_imgur_url(url):
@@ -205,24 +230,48 @@ def process_imgur_url(url):
     return [url]
 
 
-def extract_urls(url):
+def url_resolver(url):
+    """
+    Name of the resolver `extract_urls` uses for the URL: one of 'imgur',
+    'deviantart', 'gfycat' and 'direct'.
+    """
+    if 'imgur.com' in url:
+        return 'imgur'
+    elif 'deviantart.com' in url:
+        return 'deviantart'
+    elif 'gfycat.com' in url:
+        return 'gfycat'
+    return 'direct'
+
+
+def extract_urls(url, max_resolution=None, variants=None):
     """
     Given an URL checks to see if its an imgur.com URL, handles imgur hosted
     images if present as single image or image album.
 
+    With `max_resolution` (width, height) the smallest gfycat video big
+    enough for it is chosen, and its `variants.pick_gfycat` info is put
+    into the `variants` dict (by url).
+
     Returns:
         list of image urls.
     """
     urls = []
+    resolver = url_resolver(url)
 
-    if 'imgur.com' in url:
+    if resolver == 'imgur':
         urls = process_imgur_url(url)
-    elif 'deviantart.com' in url:
+    elif resolver == 'deviantart':
         urls = process_deviant_url(url)
-    elif 'gfycat.com' in url:
+    elif resolver == 'gfycat':
         # choose the smallest file on gfycat
         gfycat_json = gfycat().more(url.split("gfycat.com/")[-1]).json()
-        if gfycat_json["mp4Size"] < gfycat_json["webmSize"]:
+        picked = pick_gfycat(gfycat_json, max_resolution) if max_resolution else None
+        if picked is not None:
+            urls = [picked[0]]
+            if variants is not None:
+                variants[picked[0]] = picked[1]
+        elif gfycat_json["mp4Size"] < gfycat_json["webmSize"]:
             urls = [gfycat_json["mp4Url"]]
         else:
             urls = [gfycat_json["webmUrl"]]
@@ -278,6 +327,12 @@ def parse_args(args):
                         help='Download only if title contain text (case insensitive)')
     PARSER.add_argument('--regex', default=None, action='store', required=False,
                         help='Use Python regex to filter based on title.')
+    PARSER.add_argument('--site', metavar='DOMAIN', default=None, required=False,
+                        help='Download only links to DOMAIN (or its subdomains).')
+    PARSER.add_argument('--search-filters', default=False, action='store_true', required=False,
+                        help='List the posts through reddit search with the NSFW, self post, '
+                             'site and title filters in the query (fewer pages for selective '
+                             'filters; the search matches title words, not substrings).')
     PARSER.add_argument('--verbose', default=False, action='store_true',
                         required=False, help='Enable verbose output.')
     PARSER.add_argument('--skipAlbums', default=False, action='store_true',
@@ -285,11 +340,100 @@ def parse_args(args):
     PARSER.add_argument('--mirror-gfycat', default=False, action='store_true', required=False,
                         help='Download available mirror in gfycat.com.')
     PARSER.add_argument('--sort-type', default=None, help='Sort the subreddit.')
+    PARSER.add_argument('--incremental', default=False, action='store_true', required=False,
+                        help='Stop at the newest post of the previous complete run (kept per '
+                             'subreddit and sort type in the download directory).')
+    PARSER.add_argument('--jobs', '-j', metavar='N', default=None, type=int, required=False,
+                        help='Download up to N files at once (default: 1, 16 with --fetch); '
+                             'the per-host limits adapt to the 429/5xx responses and timeouts.')
+    PARSER.add_argument('--bandwidth', metavar='RATE', default=None, type=parse_rate,
+                        required=False, help='Cap the total download rate (e.g. 2M bytes/s).')
+    PARSER.add_argument('--host-bandwidth', metavar='RATE', default=None, type=parse_rate,
+                        required=False, help='Cap the download rate per host (e.g. 512k).')
+    PARSER.add_argument('--negative-cache', metavar='FILE', nargs='?', const='', default=None,
+                        required=False,
+                        help='Remember the dead urls (404s, removed images, wrong types, '
+                             'invalid urls) and do not request them again for a while '
+                             '(in FILE, or in the download directory).')
+    PARSER.add_argument('--layout', choices=LAYOUTS, default=None, required=False,
+                        help='Put the files into subdirectories: "hash" (ab/cd/<file> from '
+                             'the filename hash) or "id" (from the filename start). Kept for '
+                             'the dir once set; see `python -m redditdownload.layout migrate`.')
+    PARSER.add_argument('--thumbnails', metavar='WxH', nargs='?', const='256x256', default=None,
+                        type=parse_size, required=False,
+                        help='Make thumbnails (256x256 by default) of the downloaded images '
+                             'in DIR/.thumbs/WxH/, in a process pool.')
+    PARSER.add_argument('--thumbnail-workers', metavar='N', default=None, type=int,
+                        required=False, help='Processes for the thumbnails (default: cpu count).')
+    PARSER.add_argument('--plan', metavar='MANIFEST', default=None, required=False,
+                        help='Only list, filter and resolve the posts; write what to '
+                             'download to MANIFEST (JSON lines) for --fetch.')
+    PARSER.add_argument('--fetch', metavar='MANIFEST', default=None, required=False,
+                        help='Download the posts of MANIFEST (made with --plan) instead of '
+                             'listing the subreddit; already downloaded files are skipped, '
+                             '--num and --update do not apply.')
+    PARSER.add_argument('--shard', metavar='I/N', default=None, type=parse_shard,
+                        required=False,
+                        help='With --fetch, only download the I-th of N parts of the '
+                             'manifest (0-based, split by post id), e.g. one per machine.')
+    PARSER.add_argument('--dump', metavar='FILE', action='append', default=None, required=False,
+                        help='Take the posts from a submission dump (JSON lines, plain, .gz '
+                             'or .zst) instead of the listing; the subreddit ("all" for any), '
+                             '--score and the NSFW options are applied while reading. '
+                             'Can be repeated.')
+    PARSER.add_argument('--dump-workers', metavar='N', default=None, type=int, required=False,
+                        help='Processes parsing the dumps (default: the cpu count).')
+    PARSER.add_argument('--archive', metavar='DIR', nargs='?', const='', default=None,
+                        required=False,
+                        help='Keep every fetched listing page in a compressed archive (in '
+                             'DIR, or in the download directory) for --replay.')
+    PARSER.add_argument('--replay', default=False, action='store_true', required=False,
+                        help='Read the listing from the --archive instead of reddit (e.g. to '
+                             'try other filters): no requests, no throttling.')
+    PARSER.add_argument('--no-preview-hints', default=False, action='store_true',
+                        required=False,
+                        help="Always resolve the imgur / gfycat / deviantart links with their "
+                             "hosts, instead of taking reddit's preview copy of the media.")
+    PARSER.add_argument('--max-resolution', metavar='WxH', default=None, type=parse_size,
+                        required=False,
+                        help='Download the smallest variant (reddit preview, imgur size, '
+                             'gfycat video) still big enough to fill WxH, instead of the '
+                             'original; the choice is in the event log.')
+    PARSER.add_argument('--no-annotate', default=False, action='store_true', required=False,
+                        help='Do not write the title and the first comment into the images.')
+    PARSER.add_argument('--event-log', metavar='FILE', default=None, required=False,
+                        help='Write every download outcome to FILE as JSON lines.')
+    PARSER.add_argument('--event-log-max-bytes', metavar='N', default=None, type=int,
+                        required=False, help='Rotate the event log when it reaches N bytes.')
+    PARSER.add_argument('--event-log-compress', default=False, action='store_true',
+                        required=False, help='Gzip the rotated event logs.')
+    PARSER.add_argument('--metrics-file', metavar='FILE', default=None, required=False,
+                        help='Periodically write per-stage timings and counters to FILE.')
+    PARSER.add_argument('--metrics-format', default='prometheus', choices=['prometheus', 'json'],
+                        required=False, help='Format of the metrics file (prometheus textfile or json).')
+    PARSER.add_argument('--metrics-interval', metavar='SECONDS', default=15, type=float,
+                        required=False, help='How often to rewrite the metrics file.')
+    PARSER.add_argument('--trace', metavar='FILE', default=None, required=False,
+                        help='Write per-post and per-stage spans to FILE (Chrome trace format).')
 
     # TODO fix if regex, title contain activated
 
     parsed_argument = PARSER.parse_args(args)
 
+    if parsed_argument.plan and parsed_argument.fetch:
+        PARSER.error('--plan and --fetch are separate runs')
+    if parsed_argument.shard and not parsed_argument.fetch:
+        PARSER.error('--shard needs --fetch')
+    if parsed_argument.dump and parsed_argument.fetch:
+        PARSER.error('--fetch takes the posts from the manifest, not from --dump')
+    if parsed_argument.replay and (parsed_argument.dump or parsed_argument.fetch):
+        PARSER.error('--replay takes the posts from the listing archive')
+    if parsed_argument.layout:
+        recorded_layout = read_layout(parsed_argument.dir)
+        if recorded_layout not in (None, parsed_argument.layout):
+            PARSER.error('%s uses the %s layout (see `python -m redditdownload.layout migrate`)' % (
+                parsed_argument.dir, recorded_layout))
+
     if parsed_argument.sfw is True and parsed_argument.nsfw is True:
         # negate both argument if both argument exist
         parsed_argument.sfw = parsed_argument.nsfw = False
@@ -401,209 +545,133 @@ def writeCommentIntoImage(filename, url):
     img.save(filename)  # Write to the same file!
 
 
+# `print_attempt` is called from the download threads with `--jobs`.
+_PRINT_LOCK = threading.Lock()
+
+
+def print_attempt(item, url, filename):
+    # Improve debuggability list URL before download too.
+    text_templ = '    Attempting to download URL[{}] as [{}].'
+    with _PRINT_LOCK:
+        print(text_templ.format(url.encode('utf-8'), filename.encode('utf-8')))
+
+
+def print_result(result, crawler, verbose=False):
+    """Print a `crawler.Result` the way the command line tool does"""
+    item, outcome, details = result.item, result.outcome, result.details
+    if outcome == 'skipped':
+        reason = details['reason']
+        if reason == 'comments':
+            print('    Skip:[{}]'.format(item['url']))
+        elif not verbose:
+            pass
+        elif reason == 'score':
+            print('    SCORE: {} has score of {}'.format(item['id'], item['score']),
+                  'which is lower than required score of {}.'.format(crawler.score))
+        elif reason == 'sfw':
+            print('    NSFW: %s is marked as NSFW.' % (item['id']))
+        elif reason == 'nsfw':
+            print('    Not NSFW, skipping %s' % (item['id']))
+        elif reason == 'regex':
+            print('    Regex not matched')
+        elif reason == 'album':
+            print('    Album found, skipping %s' % (item['id']))
+        elif reason == 'site':
+            print('    Not on {}, skipping {}'.format(crawler.site, item['id']))
+        elif reason == 'title':
+            print('    Title does not contain "{}",'.format(crawler.title_contain),
+                  'skipping {}'.format(item['id']))
+    elif outcome == 'downloaded':
+        print('    Sucessfully downloaded URL [%s] as [%s].' % (
+            result.url, pathbasename(result.filename)))
+    elif outcome in ('wrong_type', 'annotate_failed'):
+        print('    %s' % (details['error'],))
+    elif outcome == 'exists':
+        print('    %s' % (details['error'],))
+        if crawler.update:
+            print('    Update complete, exiting.')
+    elif outcome == 'http_error':
+        print('    HTTP ERROR: Code %s for %s.' % (details['code'], result.url))
+    elif outcome == 'url_error':
+        print('    URL ERROR: %s!' % (result.url,))
+    elif outcome == 'invalid_url':
+        print('    Invalid URL: %s!' % (result.url,))
+    elif outcome == 'known_dead':
+        if verbose:
+            print('    Known dead link ({}), skipping {}'.format(details['kind'], result.url))
+    elif outcome == 'deferred':
+        print('    Host is down, skipping %s for now.' % (result.url,))
+    elif outcome == 'planned':
+        if verbose:
+            print('    Planned {} ({} files)'.format(item['id'], len(details['entry']['media'])))
+    # 'error' and 'extract_failed' are logged with the traceback already.
+
+
 def main():
+    # NOTE: `crawler` imports this module.
+    from .crawler import Crawler
+
     # configure()
     ARGS = parse_args(sys.argv[1:])
 
     logging.basicConfig(level=logging.INFO)
     print(parse_reddit_argument(ARGS.reddit))
 
-    TOTAL = DOWNLOADED = ERRORS = SKIPPED = FAILED = 0
-    FINISHED = False
-
     # Create the specified directory if it doesn't already exist.
     if not pathexists(ARGS.dir):
         mkdir(ARGS.dir)
 
-    # If a regex has been specified, compile the rule (once)
-    RE_RULE = None
-    if ARGS.regex:
-        RE_RULE = re.compile(ARGS.regex)
-
-    # compile reddit comment url to check if url is one of them
-    reddit_comment_regex = re.compile(r'.*reddit\.com\/r\/(.*?)\/comments')
-
-    LAST = ARGS.last
-
-    start_time = None
-    ITEM = None
-
-    sort_type = ARGS.sort_type
-    if sort_type:
-        sort_type = sort_type.lower()
-
-    while not FINISHED:
-        ITEMS = getitems(
-            ARGS.reddit, multireddit=ARGS.multireddit, previd=LAST,
-            reddit_sort=sort_type)
-
-        # measure time and set the program to wait 4 second between request
-        # as per reddit api guidelines
-        end_time = time.perf_counter()
-
-        if start_time is not None:
-            elapsed_time = end_time - start_time
-
-            if elapsed_time <= 4:  # throttling
-                time.sleep(4 - elapsed_time)
-
-        start_time = time.perf_counter()
-
-        if not ITEMS:
-            # No more items to process
-            break
-
-        for ITEM in ITEMS:
-            TOTAL += 1
-            # data = json.loads(ITEM)
-            comment_url = ITEM["id"]
-
-            # not downloading if url is reddit comment
-            if ('reddit.com/r/' + ARGS.reddit + '/comments/' in ITEM['url'] or
-                    re.match(reddit_comment_regex, ITEM['url']) is not None):
-                print('    Skip:[{}]'.format(ITEM['url']))
-                continue
-
-            if ITEM['score'] < ARGS.score:
-                if ARGS.verbose:
-                    print('    SCORE: {} has score of {}'.format(ITEM['id'], ITEM['score']),
-                          'which is lower than required score of {}.'.format(ARGS.score))
-
-                SKIPPED += 1
-                continue
-            elif ARGS.sfw and ITEM['over_18']:
-                if ARGS.verbose:
-                    print('    NSFW: %s is marked as NSFW.' % (ITEM['id']))
-
-                SKIPPED += 1
-                continue
-            elif ARGS.nsfw and not ITEM['over_18']:
-                if ARGS.verbose:
-                    print('    Not NSFW, skipping %s' % (ITEM['id']))
-
-                SKIPPED += 1
-                continue
-            elif ARGS.regex and not re.match(RE_RULE, ITEM['title']):
-                if ARGS.verbose:
-                    print('    Regex not matched')
-
-                SKIPPED += 1
-                continue
-            elif ARGS.skipAlbums and 'imgur.com/a/' in ITEM['url']:
-                if ARGS.verbose:
-                    print('    Album found, skipping %s' % (ITEM['id']))
-
-                SKIPPED += 1
-                continue
-
-            if ARGS.title_contain and ARGS.title_contain.lower() not in ITEM['title'].lower():
-                if ARGS.verbose:
-                    print('    Title does not contain "{}",'.format(ARGS.title_contain),
-                          'skipping {}'.format(ITEM['id']))
-
-                SKIPPED += 1
-                continue
-
-            FILECOUNT = 0
-            try:
-                URLS = extract_urls(ITEM['url'])
-            except Exception:
-                _log.exception("Failed to extract urls for %r", URLS)
-                continue
-            for URL in URLS:
-                try:
-                    # Find gfycat if requested
-                    if URL.endswith('gif') and ARGS.mirror_gfycat:
-                        check = gfycat().check(URL)
-                        if check.get("urlKnown"):
-                            URL = check.get('webmUrl')
-
-                    FILEEXT = pathsplitext(URL)[1]
-                    # Trim any http query off end of file extension.
-                    FILEEXT = re.sub(r'\?.*$', '', FILEEXT)
-                    if not FILEEXT:
-                        # A more usable option that empty.
-                        # The extension can be fixed after downloading, but then the 'already downloaded' check will be harder.
-                        FILEEXT = '.jpg'
-
-                    # Only append numbers if more than one file
-                    FILENUM = ('_%d' % FILECOUNT if len(URLS) > 1 else '')
-
-                    # create filename based on given input from user
-                    if ARGS.filename_format == 'url':
-                        FILENAME = '%s%s%s' % (pathsplitext(pathbasename(URL))[0], '', FILEEXT)
-                    elif ARGS.filename_format == 'title':
-                        FILENAME = '%s%s%s' % (slugify(ITEM['title']), FILENUM, FILEEXT)
-                        if len(FILENAME) >= 256:
-                            shortened_item_title = slugify(ITEM['title'])[:256-len(FILENAME)]
-                            FILENAME = '%s%s%s' % (shortened_item_title, FILENUM, FILEEXT)
-                    else:
-                        FILENAME = '%s%s%s' % (ITEM['id'], FILENUM, FILEEXT)
-                    # join file with directory
-                    FILEPATH = pathjoin(ARGS.dir, FILENAME)
-
-                    # Improve debuggability list URL before download too.
-                    # url may be wrong so skip that
-                    if URL.encode('utf-8') == 'http://':
-                        raise URLError('Url is empty')
-                    else:
-                        text_templ = '    Attempting to download URL[{}] as [{}].'
-                        #pdb.set_trace()
-                        print(text_templ.format(URL.encode('utf-8'), FILENAME.encode('utf-8')))
-
-                    # Download the image
-                    try:
-                        download_from_url(URL, FILEPATH)
-                        # Image downloaded successfully!
-                        print('    Sucessfully downloaded URL [%s] as [%s].' % (URL, FILENAME))
-                        DOWNLOADED += 1
-                        FILECOUNT += 1
-                        #DOwnload successful. Now write the file name INTO the IMAGE.
-                        #If an exception is thrown, it is caught and we move on to next picture/gif
-                        writeTitleIntoImage(FILENAME)
-                        comm = get_first_comment_from_post(comment_url)
-                        writeCommentIntoImage(FILENAME, comm)
-
-                    except Exception as exc:
-                        print('    %s' % (exc,))
-                        ERRORS += 1
-
-                    if ARGS.num and DOWNLOADED >= ARGS.num:
-                        FINISHED = True
-                        break
-                except WrongFileTypeException as ERROR:
-                    print('    %s' % (ERROR,))
-                    _log_wrongtype(url=URL, target_dir=ARGS.dir,
-                                   filecount=FILECOUNT, _downloaded=DOWNLOADED,
-                                   filename=FILENAME)
-                    SKIPPED += 1
-                except FileExistsException as ERROR:
-                    print('    %s' % (ERROR,))
-                    ERRORS += 1
-                    if ARGS.update:
-                        print('    Update complete, exiting.')
-                        FINISHED = True
-                        break
-                except HTTPError as ERROR:
-                    print('    HTTP ERROR: Code %s for %s.' % (ERROR.code, URL))
-                    FAILED += 1
-                except URLError as ERROR:
-                    print('    URL ERROR: %s!' % (URL,))
-                    FAILED += 1
-                except InvalidURL as ERROR:
-                    print('    Invalid URL: %s!' % (URL,))
-                    FAILED += 1
-                except Exception as exc:
-                    _log.exception("Problem with %r: %r", URL, exc)
-                    FAILED += 1
-
-            if FINISHED:
-                break
-
-        LAST = ITEM['id'] if ITEM is not None else None
-
-    print('Downloaded {} files'.format(DOWNLOADED),
-          '(Processed {}, Skipped {}, Exists {})'.format(TOTAL, SKIPPED, ERRORS))
+    EVENTS = None
+    if ARGS.event_log:
+        EVENTS = get_event_log(ARGS.event_log, max_bytes=ARGS.event_log_max_bytes,
+                               compress=ARGS.event_log_compress)
+
+    METRICS = Metrics()
+    if ARGS.metrics_file:
+        METRICS.start_writer(ARGS.metrics_file, fmt=ARGS.metrics_format,
+                             interval=ARGS.metrics_interval)
+
+    TRACER = Tracer() if ARGS.trace else NullTracer()
+
+    CRAWLER = Crawler.from_args(ARGS, metrics=METRICS, tracer=TRACER, events=EVENTS)
+    CRAWLER.on_attempt.append(print_attempt)
+    ITEMS = None
+    if ARGS.dump:
+        SUBREDDITS = None
+        if not ARGS.multireddit and ARGS.reddit.lower() != 'all':
+            SUBREDDITS = ARGS.reddit.split('+')
+        ITEMS = DumpReader(ARGS.dump, subreddits=SUBREDDITS, score=ARGS.score,
+                           sfw=ARGS.sfw, nsfw=ARGS.nsfw, workers=ARGS.dump_workers)
+    try:
+        if ARGS.plan:
+            with ManifestWriter(ARGS.plan) as MANIFEST:
+                for RESULT in CRAWLER.plan(items=ITEMS):
+                    if RESULT.outcome == 'planned':
+                        MANIFEST.write(RESULT.details['entry'])
+                    print_result(RESULT, CRAWLER, verbose=ARGS.verbose)
+            print('Planned {} files of {} posts into {}'.format(
+                CRAWLER.planned, MANIFEST.count, ARGS.plan))
+            return
+        if ARGS.fetch:
+            RESULTS = CRAWLER.fetch(read_manifest(ARGS.fetch, shard=ARGS.shard))
+        else:
+            RESULTS = CRAWLER.results(items=ITEMS)
+        for RESULT in RESULTS:
+            with _PRINT_LOCK:
+                print_result(RESULT, CRAWLER, verbose=ARGS.verbose)
+    finally:
+        if CRAWLER.thumbnails is not None:
+            CRAWLER.thumbnails.close()
+        if ARGS.metrics_file:
+            METRICS.stop_writer()
+            METRICS.write(ARGS.metrics_file, fmt=ARGS.metrics_format)
+        if ARGS.trace:
+            TRACER.write(ARGS.trace)
+
+    STATS = CRAWLER.stats
+    print('Downloaded {} files'.format(STATS['downloaded']),
+          '(Processed {}, Skipped {}, Exists {})'.format(
+              STATS['processed'], STATS['skipped'], STATS['errors']))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,274 @@
+""" Retry policy (exponential backoff with jitter, Retry-After) and
+per-host circuit breakers, shared by the http helpers.
+
+Works for both `urllib` (errors with a `code`) and `requests` (responses
+with a `status_code`).
+"""
+
+import time
+import errno
+import random
+import socket
+import logging
+import threading
+from email.utils import parsedate_tz, mktime_tz
+
+try:
+    from urllib.parse import urlsplit
+    from urllib.error import URLError
+except ImportError:  # py2
+    from urlparse import urlsplit
+    from urllib2 import URLError
+
+try:
+    _CONNECTION_ERRORS = (socket.timeout, ConnectionError)
+except NameError:  # py2
+    _CONNECTION_ERRORS = (socket.timeout,)
+
+
+_log = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = frozenset((408, 425, 429, 500, 502, 503, 504))
+
+# errnos of the connection problems that can go away
+_TRANSIENT_ERRNOS = frozenset(
+    getattr(errno, name) for name in (
+        'ECONNRESET', 'ECONNREFUSED', 'ECONNABORTED', 'ETIMEDOUT', 'EHOSTUNREACH',
+        'ENETUNREACH', 'ENETDOWN', 'EPIPE', 'EAGAIN')
+    if hasattr(errno, name))
+
+# errors that no retry fixes (by name, not to import `requests` here)
+_PERMANENT_ERROR_NAMES = frozenset(('TooManyRedirects',))
+
+
+class CircuitOpenError(Exception):
+    """ The host failed too much recently; its requests are deferred """
+
+    def __init__(self, host, retry_in):
+        super(CircuitOpenError, self).__init__(
+            "Circuit open for %r (retry in %.0fs)" % (host, retry_in))
+        self.host = host
+        self.retry_in = retry_in
+
+
+def url_host(url):
+    return (urlsplit(url).hostname or '').lower()
+
+
+def parse_retry_after(value, now=None):
+    """ Seconds to wait from a Retry-After value (seconds or an http
+    date), None if it can't be parsed """
+    if value is None:
+        return None
+    value = str(value).strip()
+    if value.isdigit():
+        return float(value)
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0.0, mktime_tz(parsed) - (now if now is not None else time.time()))
+
+
+def error_status(exc):
+    """ The http status of an `urllib` / `requests` error (or None) """
+    code = getattr(exc, 'code', None)
+    if isinstance(code, int):
+        return code
+    response = getattr(exc, 'response', None)
+    return getattr(response, 'status_code', None)
+
+
+def _headers_of(obj):
+    headers = getattr(obj, 'headers', None)
+    if headers is None:
+        headers = getattr(getattr(obj, 'response', None), 'headers', None)
+    return headers
+
+
+def is_retryable(exc):
+    """ Whether the error is worth retrying: connection problems,
+    timeouts and the 408/429/5xx statuses (not 404s, bad urls, redirect
+    loops, local file errors, etc.).
+
+    Wrapping errors (such as `img_scrap_stuff.GetError`) are classified
+    by the original error in their args, `URLError`s by their reason.
+    """
+    status = error_status(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUSES
+    # bad urls (`requests`' `InvalidURL`, `MissingSchema`, ... are `ValueError`s too)
+    if isinstance(exc, ValueError) or type(exc).__name__ in _PERMANENT_ERROR_NAMES:
+        return False
+    if isinstance(exc, URLError):
+        # a socket error, or a message such as 'unknown url type: foo'
+        return isinstance(exc.reason, Exception) and is_retryable(exc.reason)
+    if isinstance(exc, _CONNECTION_ERRORS):
+        return True
+    if isinstance(exc, socket.gaierror):
+        # a failed lookup is only worth retrying when it is temporary
+        return exc.errno == getattr(socket, 'EAI_AGAIN', None)
+    if isinstance(exc, (IOError, OSError, socket.error)):
+        if exc.errno is not None:
+            return exc.errno in _TRANSIENT_ERRNOS
+        # the `requests` connection errors and timeouts have no errno
+        return type(exc).__module__.split('.')[0] == 'requests'
+    return any(is_retryable(arg) for arg in exc.args if isinstance(arg, Exception))
+
+
+class CircuitBreaker(object):
+    """ Per-host circuit breakers.
+
+    After `threshold` consecutive retryable failures a host's circuit
+    opens for `reset_timeout` seconds: its requests fail right away with
+    `CircuitOpenError`.  Then a single probe request is let through
+    (half-open); its success closes the circuit, its failure reopens it
+    for twice as long (up to `max_timeout`).  A probe that tells nothing
+    about the host (e.g. a bad url) is ended with `end_probe`, so the
+    next request probes again.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30.0, max_timeout=600.0, clock=time.time):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.max_timeout = max_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._hosts = {}  # host -> dict(failures, opened_at, timeout, probing)
+
+    def _state(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = dict(
+                failures=0, opened_at=None, timeout=self.reset_timeout, probing=False)
+        return state
+
+    def check(self, host):
+        """ Raise `CircuitOpenError` if the host's requests should not be
+        made now; True when the request is the half-open probe """
+        with self._lock:
+            state = self._state(host)
+            if state['opened_at'] is None:
+                return False
+            retry_in = state['opened_at'] + state['timeout'] - self.clock()
+            if retry_in > 0 or state['probing']:
+                raise CircuitOpenError(host, max(retry_in, 0))
+            state['probing'] = True
+            return True
+
+    def end_probe(self, host):
+        """ The probe is over (no-op when it was recorded already) """
+        with self._lock:
+            self._state(host)['probing'] = False
+
+    def is_open(self, host):
+        with self._lock:
+            return self._hosts.get(host, {}).get('opened_at') is not None
+
+    def record_success(self, host):
+        with self._lock:
+            state = self._state(host)
+            state.update(failures=0, opened_at=None, timeout=self.reset_timeout, probing=False)
+
+    def record_failure(self, host):
+        with self._lock:
+            state = self._state(host)
+            state['failures'] += 1
+            if state['probing']:
+                state['timeout'] = min(self.max_timeout, state['timeout'] * 2)
+            elif state['opened_at'] is not None or state['failures'] < self.threshold:
+                return
+            state['opened_at'] = self.clock()
+            state['probing'] = False
+            _log.warning("%r failed %d times, pausing its requests for %.0fs",
+                         host, state['failures'], state['timeout'])
+
+
+_common_breaker = CircuitBreaker()
+
+
+def get_circuit_breaker():
+    """ The process-wide `CircuitBreaker` """
+    return _common_breaker
+
+
+class RetryPolicy(object):
+    """ Exponential backoff with full jitter, honoring Retry-After.
+
+    The delay before retry N (from 0) is uniform in
+    [0, min(cap, base * 2 ** N)]; a Retry-After from the server is used
+    instead when it is longer (and the request is given up if it is
+    longer than `max_retry_after`).
+
+    :Example:
+
+    >>> policy = RetryPolicy(retries=3, base=0.5, sleep=lambda delay: None)
+    >>> policy.call(lambda: 'ok', 'http://i.redd.it/x.jpg')
+    'ok'
+    """
+
+    def __init__(self, retries=4, base=0.5, cap=30.0, max_retry_after=120.0,
+                 sleep=time.sleep):
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+        self.max_retry_after = max_retry_after
+        self.sleep = sleep
+
+    def delay(self, attempt, retry_after=None):
+        """ Seconds before the retry number `attempt`, None to give up """
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                return None
+            delay = max(delay, retry_after)
+        return delay
+
+    def call(self, func, url, breaker=None):
+        """ `func()` (which fetches the `url`) with retries.
+
+        Responses with a `status_code` (as of `requests`) are retried on
+        the retryable statuses too; the last one is returned as is.
+        No more retries are made once the host's circuit is open.
+        """
+        host = url_host(url)
+        for attempt in range(self.retries):
+            probe = breaker is not None and breaker.check(host)
+            error = res = None
+            try:
+                try:
+                    res = func()
+                except Exception as exc:
+                    error, status, headers = exc, error_status(exc), _headers_of(exc)
+                    retryable = is_retryable(exc)
+                else:
+                    status = getattr(res, 'status_code', None)
+                    headers = getattr(res, 'headers', None)
+                    retryable = status in RETRYABLE_STATUSES
+
+                if breaker is not None:
+                    if retryable:
+                        breaker.record_failure(host)
+                    elif error is None or status is not None:
+                        # a response (even a 404): the host itself is fine
+                        breaker.record_success(host)
+            finally:
+                # e.g. a bad url, or an interrupt: no verdict on the host
+                if probe:
+                    breaker.end_probe(host)
+
+            delay = None
+            if retryable and attempt < self.retries - 1 and not (
+                    breaker is not None and breaker.is_open(host)):
+                retry_after = None
+                if status in (429, 503) and headers is not None:
+                    retry_after = parse_retry_after(headers.get('Retry-After'))
+                delay = self.delay(attempt, retry_after)
+                if delay is None:
+                    _log.warning("Giving up on %r: Retry-After %r is too long", url, retry_after)
+            if delay is None:
+                if error is not None:
+                    raise error
+                return res
+            _log.info("Retry #%d of %r in %.1fs after %r",
+                      attempt + 1, url, delay, error or 'status %s' % (status,))
+            self.sleep(delay)
@@ -22,16 +22,21 @@ import errno
 import sys
 import re
 import json
-import functools
 import logging
 import mimetypes
 import hashlib
+import argparse
+import threading
 
 from atomicfile import AtomicFile
 import magic
 
 import img_scrap_stuff
 from img_scrap_stuff import GetError
+from jsl import iter_jsl, Checkpoint, URLIndex, JSLWriter
+from nameindex import get_dir_index
+# NOTE: py2 needs the `futures` backport for this.
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 
 _log = logging.getLogger(__name__)
@@ -58,13 +63,7 @@ def make_filename(url, imgdata, resp=None):
 def unjsl_g(fn):
     """ un-json-lines: filename -> streamed generator of deserialized
     objects """
-    log = _log.getChild('unjsl(%r)' % (fn,))
-    with open(fn) as f:
-        for l in f.readlines():
-            try:
-                yield json.loads(l)
-            except ValueError:
-                log.error("JSON fail: %r", l)
+    return (obj for _, _, obj in iter_jsl(fn))
 
 
 def unjsl(fn):
@@ -100,21 +99,11 @@ def mkdirs(d):
 
 
 def consecutive_filename(filename):
-    """ Find first non-existing filename.  (NOTE: Not atomic.)  """
-    if not os.path.exists(filename):
-        return filename
-    fileparts = filename.rsplit('.', 1)
-    if len(fileparts) == 1:
-        filebase, fileext = fileparts[0], None
-    else:
-        filebase, fileext = fileparts
-    for i in xrange(1, 9000):
-        filetry = '%s__%02d' % (filebase, i)
-        if fileext is not None:
-            filetry = '%s.%s' % (filetry, fileext)
-            if not os.path.exists(filetry):
-                return filetry
-    raise Exception("Either I'm insane or there's already over 9000 such files.")
+    """ Find first non-existing filename (`name.ext`, `name__01.ext`, ...)
+    and create it (empty, exclusively, so the name is taken even with
+    concurrent writers); the caller is expected to overwrite it. """
+    dirname, name = os.path.split(filename)
+    return get_dir_index(dirname).reserve(name)
 
 
 def str2hash(s, hlen=8):
@@ -125,60 +114,127 @@ def str2hash(s, hlen=8):
     return res
 
 
+class _OffsetTracker(object):
+    """ The offset up to which all the (possibly concurrently processed)
+    log entries are done """
+
+    def __init__(self, offset):
+        self.offset = offset
+        self._pending = {}  # line_start -> line_end
+        self._done = set()
+        self._failed = None  # the first entry to do again
+        self._lock = threading.Lock()
+
+    def started(self, start, end):
+        with self._lock:
+            self._pending[start] = end
+
+    def finished(self, start, checkpoint=None):
+        """ returns the new done-up-to offset; saves it into the
+        `checkpoint` under the lock, so the saves don't go backwards """
+        with self._lock:
+            if self._failed is not None and start > self._failed:
+                # the offset can't get past the failed entry anyway
+                self._pending.pop(start, None)
+                return self.offset
+            self._done.add(start)
+            while self._pending:
+                first = min(self._pending)
+                if first not in self._done:
+                    break
+                self.offset = self._pending.pop(first)
+                self._done.discard(first)
+            if checkpoint is not None:
+                checkpoint.save(self.offset)
+            return self.offset
+
+    def failed(self, start):
+        """ An entry to do again (on the next run): the offset stays
+        before it """
+        with self._lock:
+            if self._failed is None or start < self._failed:
+                self._failed = start
+            return self.offset
+
+    def skipped(self, start, end):
+        """ An entry that was handled right away """
+        self.started(start, end)
+        return self.finished(start)
+
+
 def do_scrap_wrongies(
         data_in=_WRONGDATA_LOGFILE,
         debug_out=_OUTDATA_LOGFILE, dirmeta=_DIRDATA_LOGFILE,
-        dirsubdir=_DIRSUBDIR):
+        dirsubdir=_DIRSUBDIR, resume=True, jobs=1):
+    """ Process the wrong-type log `data_in`, streaming it.
+
+    With `resume`, start right after the last entry handled by the
+    previous run (see the `<data_in>.offset` checkpoint file).  The urls
+    already written to `debug_out` are skipped either way (as tracked by
+    the `<debug_out>.idx` index file).
+
+    `jobs`: amount of wrongies to process concurrently.
+    """
     # ###  Per wrongdata-logfile (with dl-continuing support)  ###
     log = _log.getChild("do_scrap_wrongies")
-    # Assuming the files are not too giant (reasonably enough):
-    in_data = unjsl(data_in)
-    debug_data_base = unjsl_or_empty(debug_out)
-    debug_data = {d['url']: d for d in debug_data_base}
-    to_debug = functools.partial(onjsl, debug_out)  # lambda data: onjsl(debug_out, data)
+    checkpoint = Checkpoint(data_in)
+    in_offset = checkpoint.load() if resume else 0
+    if in_offset:
+        log.info("Resuming %r at offset %r", data_in, in_offset)
+    in_data = iter_jsl(data_in, offset=in_offset)
+    offsets = _OffsetTracker(in_offset)
+    # Catch up with whatever was written to the debug log (e.g. by the
+    # previous versions or after a crash).
+    processed_urls = URLIndex(debug_out + '.idx')
+    processed_urls.sync_from_jsl(debug_out)
+    to_debug = JSLWriter(debug_out)
     all_checked_urls = {}
-    # to_meta = lambda target_dir, data: onjsl(os.path.join(target_dir, dirmeta), data)
+    all_checked_lock = threading.Lock()
     # ...
     existing_cache = {}  # meta_file -> {url -> rmeta}
+    meta_writers = {}  # meta_file -> JSLWriter
+    state_lock = threading.Lock()
 
     def get_meta_existing(meta_file, cache=existing_cache):
-        try:
-            return cache[meta_file]
-        except KeyError:
-            log.debug("Loading meta_existing %r", meta_file)
-            meta_existing = {v['url']: v for v in unjsl_or_empty(meta_file)}
-            cache[meta_file] = meta_existing
-            return meta_existing
-
-    # ...
-    for wrongie in in_data:
+        with state_lock:
+            try:
+                return cache[meta_file], meta_writers[meta_file]
+            except KeyError:
+                log.debug("Loading meta_existing %r", meta_file)
+                meta_existing = {v['url']: v for v in unjsl_or_empty(meta_file)}
+                cache[meta_file] = meta_existing
+                meta_writers[meta_file] = JSLWriter(meta_file)
+                return meta_existing, meta_writers[meta_file]
+
+    def process_wrongie(wrongie):
         # ###  Per reddit link (basically) with possibly several images there  ###
         # Example `wrongie`: {"url": "http://500px.com/photo/29700163",
         #   "target_dir": "/home/hell/files/wp//reddit_earthporn",
         #   "_downloaded": 8, "_filecount": 0, "_filename": "1m90ui"}
         url = wrongie['url']
-        if url in debug_data:
-            log.log(15, "Already processed wrongie: %r", url)
-            continue  # Already processed, presumably.
         log.log(13, "Processing wrongie %r  (%r)", url, wrongie)
         # ...
         target_dir = os.path.join(wrongie['target_dir'], dirsubdir)
         mkdirs(target_dir)
         # ...
         meta_file = os.path.join(target_dir, dirmeta)
-        meta_existing = get_meta_existing(meta_file)  # url -> rmeta
+        meta_existing, to_meta = get_meta_existing(meta_file)  # url -> rmeta
         dmeta = dict(wrongie)  # debug-out data
         # ...
         # NOTE: long request-y process.
         try:
+            # NOTE: the other workers might be adding to `all_checked_urls`
+            # meanwhile; that only makes the skipping less thorough.
             stuff = img_scrap_stuff.do_horrible_things(url, urls_to_skip=all_checked_urls)
         except GetError:
-            log.error("Skipping wrongie %r", wrongie)
-            continue
-        # stuff = ([checked_url, ...], [(image_url, image_data, {'resp': ..., ...}), ...])
-        checked_urls, found_images = stuff
-        all_checked_urls.update({u: 1 for u in checked_urls})
-        dd_processed = debug_data.setdefault('processed', [])
+            log.error("Skipping wrongie %r (for now)", wrongie)
+            return False
+        # stuff = ([checked_url, ...], [(image_url, image_data, {'resp': ..., ...}), ...],
+        #          complete)
+        checked_urls, found_images, complete = stuff
+        with all_checked_lock:
+            all_checked_urls.update({u: 1 for u in checked_urls})
+        dd_processed = []
         for imgurl, imgdata, extras in found_images:
             # ###  Per image file (known to be large)  ###
             if imgurl in meta_existing:
@@ -201,20 +257,76 @@ def do_scrap_wrongies(
             with AtomicFile(filename_target) as f:
                 f.write(imgdata)
             # ...
-            onjsl(meta_file, rmeta)
-            meta_existing[imgurl] = rmeta  # make sure we don't try it again
+            to_meta(rmeta)
+            with state_lock:
+                meta_existing[imgurl] = rmeta  # make sure we don't try it again
             # Note: might be lost (as rmeta is written already but dmeta isn't yet)
             dd_processed.append(dict(_exdata))
         # Per reddit link again (after downloading all images is done)
+        if not complete:
+            # Some links were never probed: not done with the page yet.
+            log.warning("Not all of wrongie %r was checked, leaving it for later", url)
+            return False
         # Write it down so we don't pester it again
         dmeta.update(processed=dd_processed)
-        debug_data[url] = dmeta
         to_debug(dmeta)
+        processed_urls.add(url)
+        return True
+
+    def _process_entry(line_start, wrongie):
+        if process_wrongie(wrongie):
+            offsets.finished(line_start, checkpoint)
+        else:
+            # The checkpoint stays before this entry, so the next run
+            # retries it (the entries done meanwhile are in `debug_out`).
+            offsets.failed(line_start)
+
+    # ...
+    pool = ThreadPoolExecutor(max_workers=max(1, jobs)) if jobs > 1 else None
+    running = set()
+    try:
+        for line_start, line_end, wrongie in in_data:
+            if wrongie['url'] in processed_urls:
+                log.log(15, "Already processed wrongie: %r", wrongie['url'])
+                offsets.skipped(line_start, line_end)
+                continue  # Already processed, presumably.
+            offsets.started(line_start, line_end)
+            if pool is None:
+                _process_entry(line_start, wrongie)
+                continue
+            # Keep the amount of queued entries bounded (the log can be huge).
+            while len(running) >= 2 * jobs:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    fut.result()
+            running.add(pool.submit(_process_entry, line_start, wrongie))
+        for fut in running:
+            fut.result()
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True)
     # Per wrongdata-logfile again. Nothing to do here after all that.
+    checkpoint.save(offsets.offset)
+    processed_urls.close()
+    http_cache = img_scrap_stuff.get_http_cache()
+    if http_cache is not None:
+        log.info("HTTP cache stats: %r", http_cache.get_stats())
     log.info("Done, apparently")
     return locals()  # In case some post-debug is desired.
 
 
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description='Scrap large images from the "wrong data type" pages.')
+    parser.add_argument('data_in', nargs='?', default=_WRONGDATA_LOGFILE,
+                        help='The wrong-type pages log.')
+    parser.add_argument('--jobs', '-j', metavar='N', type=int, default=1,
+                        help='Amount of pages to process concurrently.')
+    parser.add_argument('--restart', default=False, action='store_true',
+                        help='Ignore the saved position in the log and start over.')
+    return parser.parse_args(args)
+
+
 def main():
     try:
         import pyaux.runlib
@@ -223,7 +335,8 @@ def main():
     except Exception:
         pass
     logging.getLogger('requests.packages.urllib3.connectionpool').setLevel(21)
-    res = do_scrap_wrongies()
+    args = parse_args(sys.argv[1:])
+    res = do_scrap_wrongies(data_in=args.data_in, resume=not args.restart, jobs=args.jobs)
     return
 
 
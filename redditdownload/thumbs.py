@@ -0,0 +1,199 @@
+"""Thumbnails of the downloaded images, made in a process pool.
+
+JPEGs are decoded at a reduced scale (1/2 to 1/8, see `Image.draft`),
+so a thumbnail costs a fraction of a full decode.  A thumbnail is kept
+as `<dir>/.thumbs/<W>x<H>/<filename>.jpg` (`<W>x<H>-q<Q>` for another
+quality than the default), so every size has its own, and remade only
+when the image is newer.
+
+    python -m redditdownload.thumbs wallpaper --size 320x320 --workers 8
+"""
+
+import os
+import sys
+import logging
+import argparse
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+
+_log = logging.getLogger(__name__)
+
+THUMBS_DIRNAME = '.thumbs'
+DEFAULT_SIZE = (256, 256)
+DEFAULT_QUALITY = 80
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp')
+
+
+def parse_size(value):
+    """'320x240' -> (320, 240)"""
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def variant_name(size=DEFAULT_SIZE, quality=DEFAULT_QUALITY):
+    """The `.thumbs` subdirectory of the size and quality: '256x256',
+    '256x256-q90'"""
+    name = '%dx%d' % tuple(size)
+    if quality != DEFAULT_QUALITY:
+        name += '-q%d' % quality
+    return name
+
+
+def variant_path(path, variant):
+    dirname, filename = os.path.split(path)
+    return os.path.join(dirname, THUMBS_DIRNAME, variant, filename + '.jpg')
+
+
+def thumb_path(path, size=DEFAULT_SIZE, quality=DEFAULT_QUALITY):
+    return variant_path(path, variant_name(size, quality))
+
+
+def thumb_variants(dirname):
+    """The thumbnail variants made in the dir so far"""
+    try:
+        with os.scandir(os.path.join(dirname, THUMBS_DIRNAME)) as entries:
+            return sorted(entry.name for entry in entries if entry.is_dir())
+    except OSError:
+        return []
+
+
+def is_up_to_date(path, thumb):
+    try:
+        return os.stat(thumb).st_mtime >= os.stat(path).st_mtime
+    except OSError:
+        return False
+
+
+def make_thumbnail(path, size=DEFAULT_SIZE, quality=DEFAULT_QUALITY, force=False):
+    """Make the thumbnail of the image at `path` (unless it is up to date).
+
+    Returns 'made', 'up_to_date' or 'skipped' (not an image).
+    """
+    from PIL import Image
+
+    if not path.lower().endswith(IMAGE_EXTENSIONS):
+        return 'skipped'
+    thumb = thumb_path(path, size, quality)
+    if not force and is_up_to_date(path, thumb):
+        return 'up_to_date'
+    img = Image.open(path)
+    # JPEG: decode at the smallest 1/2**n scale that still covers `size`
+    img.draft('RGB', size)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    img.thumbnail(size, Image.LANCZOS)
+    dirname = os.path.dirname(thumb)
+    if not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            # made by another worker
+            pass
+    tmp = '{}.{}.tmp'.format(thumb, os.getpid())
+    img.save(tmp, 'JPEG', quality=quality)
+    os.replace(tmp, thumb)
+    return 'made'
+
+
+def _thumbnail_job(path, size, quality, force):
+    try:
+        return path, make_thumbnail(path, size=size, quality=quality, force=force), None
+    except Exception as exc:
+        return path, 'failed', repr(exc)
+
+
+class ThumbnailPool(object):
+    """
+    Makes the thumbnails in `workers` processes.
+
+    :Example:
+
+    >>> pool = ThumbnailPool(workers=4, size=(320, 320))  # doctest: +SKIP
+    >>> future = pool.submit('wallpaper/abc123.jpg')  # doctest: +SKIP
+    >>> future.result()  # doctest: +SKIP
+    ('wallpaper/abc123.jpg', 'made', None)
+    """
+
+    def __init__(self, workers=None, size=DEFAULT_SIZE, quality=DEFAULT_QUALITY, force=False):
+        self.size = tuple(size)
+        self.quality = quality
+        self.force = force
+        self._pool = ProcessPoolExecutor(workers)
+
+    def submit(self, path):
+        """Future of `(path, status, error)`, status being 'made',
+        'up_to_date', 'skipped' or 'failed'"""
+        return self._pool.submit(_thumbnail_job, path, self.size, self.quality, self.force)
+
+    def map(self, paths, chunksize=16):
+        job = functools.partial(_thumbnail_job, size=self.size, quality=self.quality,
+                                force=self.force)
+        return self._pool.map(job, paths, chunksize=chunksize)
+
+    def close(self):
+        self._pool.shutdown()
+
+
+def iter_images(dirname):
+    """Paths of the images under `dirname` (not the thumbnails)"""
+    for entry in os.scandir(dirname):
+        if entry.is_dir(follow_symlinks=False):
+            if entry.name != THUMBS_DIRNAME:
+                for path in iter_images(entry.path):
+                    yield path
+        elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            yield entry.path
+
+
+def thumbnail_tree(dirname, workers=None, size=DEFAULT_SIZE, quality=DEFAULT_QUALITY,
+                   force=False, batch=1024):
+    """Make the missing and outdated thumbnails under `dirname`, return
+    the counts per status"""
+    counts = dict(made=0, up_to_date=0, skipped=0, failed=0)
+    pool = ThumbnailPool(workers=workers, size=size, quality=quality, force=force)
+    try:
+        paths = []
+        for path in iter_images(dirname):
+            if not force and is_up_to_date(path, thumb_path(path, size, quality)):
+                # cheaper than a job
+                counts['up_to_date'] += 1
+                continue
+            paths.append(path)
+            if len(paths) >= batch:
+                _count(pool.map(paths), counts)
+                paths = []
+        _count(pool.map(paths), counts)
+    finally:
+        pool.close()
+    return counts
+
+
+def _count(results, counts):
+    for path, status, error in results:
+        counts[status] += 1
+        if error:
+            _log.warning("Failed to make the thumbnail of %r: %s", path, error)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Make the thumbnails of the downloaded images.')
+    parser.add_argument('dirs', nargs='+', help='Download dirs.')
+    parser.add_argument('--size', type=parse_size, default=DEFAULT_SIZE,
+                        help='Bounding box, WxH (default: %dx%d).' % DEFAULT_SIZE)
+    parser.add_argument('--quality', type=int, default=DEFAULT_QUALITY, help='JPEG quality.')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Processes (default: the cpu count).')
+    parser.add_argument('--force', default=False, action='store_true',
+                        help='Remake the up to date thumbnails too.')
+    args = parser.parse_args(sys.argv[1:])
+    logging.basicConfig(level=logging.INFO)
+    for dirname in args.dirs:
+        counts = thumbnail_tree(dirname, workers=args.workers, size=args.size,
+                                quality=args.quality, force=args.force)
+        print('{}: {made} made, {up_to_date} up to date, {failed} failed'.format(
+            dirname, **counts))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Span recording in the Chrome trace-event format (viewable in
+Perfetto or chrome://tracing)."""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+class Tracer(object):
+    """
+    Records complete ('X') events with the thread ids.
+
+    :Example:
+
+    >>> tracer = Tracer()
+    >>> with tracer.span('post', id='abc'):
+    ...     with tracer.span('download', url='http://i.redd.it/abc.jpg'):
+    ...         pass
+    >>> [event['name'] for event in tracer.events]
+    ['download', 'post']
+
+    Spans that don't fit a block go with `begin` and `end`.
+    """
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._threads = {}  # tid -> thread name
+        self._origin = time.perf_counter()
+
+    def _now_us(self):
+        return (time.perf_counter() - self._origin) * 1e6
+
+    def _tid(self):
+        tid = threading.get_ident()
+        with self._lock:
+            if tid not in self._threads:
+                self._threads[tid] = threading.current_thread().name
+        return tid
+
+    def begin(self, name, cat='stage', **args):
+        """Start a span, to be recorded by `end` (from any thread; it
+        goes to the thread that started it)"""
+        return dict(name=name, cat=cat, ph='X', ts=self._now_us(), pid=self._pid,
+                    tid=self._tid(), args=args)
+
+    def end(self, event):
+        event['dur'] = round(self._now_us() - event['ts'], 1)
+        event['ts'] = round(event['ts'], 1)
+        with self._lock:
+            self.events.append(event)
+
+    @contextmanager
+    def span(self, name, cat='stage', **args):
+        event = self.begin(name, cat=cat, **args)
+        try:
+            yield event['args']  # can be updated with results (e.g. bytes) within the block
+        finally:
+            self.end(event)
+
+    def instant(self, name, cat='event', **args):
+        event = dict(name=name, cat=cat, ph='i', s='t', ts=round(self._now_us(), 1),
+                     pid=self._pid, tid=self._tid(), args=args)
+        with self._lock:
+            self.events.append(event)
+
+    def to_json(self):
+        with self._lock:
+            events = list(self.events)
+            threads = dict(self._threads)
+        meta = [dict(name='thread_name', ph='M', pid=self._pid, tid=tid, args=dict(name=name))
+                for tid, name in sorted(threads.items())]
+        return dict(traceEvents=meta + events, displayTimeUnit='ms')
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_json(), f)
+
+
+class NullTracer(object):
+    """Tracer that records nothing"""
+
+    events = ()
+
+    @contextmanager
+    def span(self, name, cat='stage', **args):
+        yield args
+
+    def begin(self, name, cat='stage', **args):
+        return None
+
+    def end(self, event):
+        pass
+
+    def instant(self, name, cat='event', **args):
+        pass
+
+    def write(self, path):
+        pass
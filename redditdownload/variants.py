@@ -0,0 +1,158 @@
+"""Choice of the smallest variant of a media that is still big enough
+for a maximal resolution (`--max-resolution WxH`).
+
+The variants come from the listing data (`preview.images[].resolutions`,
+the gallery `media_metadata` previews), from imgur's size suffixes and
+from gfycat's `content_urls`.  A variant is big enough when it is at
+least the size of the original scaled down to fit the box.
+
+:Example:
+
+>>> box = (1280, 1280)
+>>> item = dict(url='https://i.redd.it/abc.jpg', preview=dict(images=[dict(
+...     source=dict(url='https://i.redd.it/abc.jpg', width=4000, height=3000),
+...     resolutions=[dict(url='https://preview.redd.it/abc.jpg?width=640', width=640, height=480),
+...                  dict(url='https://preview.redd.it/abc.jpg?width=1920', width=1920, height=1440)])]))
+>>> url, info = pick_preview(item, item['url'], box)
+>>> url, info['variant'], info['width'], info['original_width']
+('https://preview.redd.it/abc.jpg?width=1920', 'preview', 1920, 4000)
+"""
+
+import re
+import logging
+from urllib.parse import urlsplit
+
+from .embedded import preview_image, is_animated, _unescape
+
+
+_log = logging.getLogger(__name__)
+
+# imgur thumbnail suffixes -> the box they fit the image into (not the
+# square crops 's' and 'b'); imgur does not upscale
+IMGUR_SUFFIXES = (('t', 160), ('m', 320), ('l', 640), ('h', 1024))
+
+_IMGUR_IMAGE_RE = re.compile(r'^/(?P<id>[a-zA-Z0-9]{5,7})(?P<ext>\.(?:jpe?g|png))$')
+_GALLERY_MEDIA_RE = re.compile(r'^/(?P<id>[a-zA-Z0-9]+)\.[a-z0-9]+$')
+
+
+def fit_size(width, height, box):
+    """The size of the image scaled down (not up) to fit the box"""
+    scale = min(1.0, box[0] / float(width), box[1] / float(height))
+    return int(width * scale), int(height * scale)
+
+
+def is_sufficient(width, height, original, box):
+    target = fit_size(original[0], original[1], box)
+    # allow for the rounding of the scaled sizes
+    return width >= target[0] - 1 and height >= target[1] - 1
+
+
+def _variant_info(variant, width, height, original):
+    return dict(variant=variant, width=width, height=height,
+                original_width=original[0], original_height=original[1])
+
+
+def smallest_sufficient(candidates, original, box):
+    """The smallest `(url, width, height)` candidate that is big enough
+    and smaller than the original, None if there is none"""
+    good = [cand for cand in candidates
+            if is_sufficient(cand[1], cand[2], original, box)
+            and cand[1] * cand[2] < original[0] * original[1]]
+    if not good:
+        return None
+    return min(good, key=lambda cand: cand[1] * cand[2])
+
+
+def pick_preview(item, url, box):
+    """The preview variant for the (single, still) media of the item:
+    `(url, info)`, None to keep the url"""
+    if is_animated(url) or url.lower().split('?')[0].endswith(('.mp4', '.webm')):
+        return None
+    image = preview_image(item)
+    source = image.get('source') or {}
+    if not source.get('width') or not source.get('height'):
+        return None
+    original = (source['width'], source['height'])
+    best = smallest_sufficient(
+        [(_unescape(res['url']), res['width'], res['height'])
+         for res in image.get('resolutions') or () if res.get('url')], original, box)
+    if best is None:
+        return None
+    return best[0], _variant_info('preview', best[1], best[2], original)
+
+
+def pick_gallery(item, url, box):
+    """The `media_metadata` preview variant of a gallery media url"""
+    match = _GALLERY_MEDIA_RE.match(urlsplit(url).path)
+    if urlsplit(url).hostname != 'i.redd.it' or match is None:
+        return None
+    meta = (item.get('media_metadata') or {}).get(match.group('id')) or {}
+    source = meta.get('s') or {}
+    if meta.get('e') != 'Image' or not source.get('x') or not source.get('y'):
+        return None
+    original = (source['x'], source['y'])
+    best = smallest_sufficient(
+        [(_unescape(prev['u']), prev['x'], prev['y']) for prev in meta.get('p') or ()
+         if prev.get('u')], original, box)
+    if best is None:
+        return None
+    return best[0], _variant_info('gallery_preview', best[1], best[2], original)
+
+
+def pick_imgur(url, box, original=None):
+    """The smallest imgur size suffix that fits the box: `(url, info)`,
+    None to keep the url"""
+    parts = urlsplit(url)
+    match = _IMGUR_IMAGE_RE.match(parts.path)
+    if parts.hostname != 'i.imgur.com' or match is None:
+        return None
+    need = max(box)
+    for suffix, size in IMGUR_SUFFIXES:
+        if size >= need:
+            break
+    else:
+        return None
+    if original is not None and max(original) <= size:
+        # the thumbnail would be the original
+        return None
+    new_url = '{}://{}/{}{}{}'.format(parts.scheme, parts.hostname, match.group('id'), suffix,
+                                      match.group('ext'))
+    width, height = fit_size(original[0], original[1], (size, size)) if original else (None, None)
+    return new_url, _variant_info('imgur_' + suffix, width, height, original or (None, None))
+
+
+def pick_gfycat(gfycat_json, box):
+    """The smallest gfycat video (of `content_urls`) that is big enough,
+    `(url, info)` or None"""
+    original = (gfycat_json.get('width'), gfycat_json.get('height'))
+    if not original[0] or not original[1]:
+        return None
+    candidates = []
+    for name, content in (gfycat_json.get('content_urls') or {}).items():
+        if not content.get('url', '').endswith(('.mp4', '.webm')):
+            continue
+        if not content.get('width') or not content.get('height'):
+            continue
+        if is_sufficient(content['width'], content['height'], original, box):
+            candidates.append((content.get('size') or content['width'] * content['height'],
+                               name, content))
+    if not candidates:
+        return None
+    _, name, content = min(candidates, key=lambda cand: cand[0])
+    return content['url'], _variant_info(
+        'gfycat_' + name, content['width'], content['height'], original)
+
+
+def pick_variant(item, url, box, single=True):
+    """The variant of the media url of the item to download: `(url,
+    info)`, None to keep the url"""
+    picked = pick_gallery(item, url, box)
+    if picked is None and single:
+        picked = pick_preview(item, url, box)
+    if picked is None:
+        source = preview_image(item).get('source') or {}
+        original = None
+        if single and source.get('width') and source.get('height'):
+            original = (source['width'], source['height'])
+        picked = pick_imgur(url, box, original=original)
+    return picked
@@ -0,0 +1,67 @@
+"""Per-subreddit (and per-sort) high-watermarks for incremental runs,
+kept as a JSON file in the download directory."""
+
+import os
+import json
+import logging
+import tempfile
+
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_FILENAME = '.redditdl-watermarks.json'
+
+
+def watermark_key(subreddit, sort_type=None):
+    return '{}:{}'.format(subreddit, (sort_type or 'hot').lower())
+
+
+def is_seen(item, watermark):
+    """Whether the post is at or before the watermark"""
+    if not watermark:
+        return False
+    if item.get('name', 't3_' + item['id']) == watermark['name']:
+        return True
+    return item['created_utc'] <= watermark['created_utc']
+
+
+class WatermarkStore(object):
+    """
+    The newest fully-processed post (its fullname and `created_utc`) per
+    `watermark_key`.
+
+    :Example:
+
+    >>> store = WatermarkStore('wallpaper')  # doctest: +SKIP
+    >>> store.get('wallpaper:new')  # doctest: +SKIP
+    {'name': 't3_abc123', 'created_utc': 1500000000.0}
+    """
+
+    def __init__(self, dirname, filename=DEFAULT_FILENAME):
+        self.path = os.path.join(dirname, filename)
+        self.data = {}
+        try:
+            with open(self.path) as f:
+                self.data = json.load(f)
+        except (IOError, OSError):
+            pass
+        except ValueError:
+            _log.warning("Ignoring the corrupt watermarks file %r", self.path)
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, watermark):
+        """Set the watermark (never moving it back)"""
+        current = self.data.get(key)
+        if current and current['created_utc'] > watermark['created_utc']:
+            return
+        self.data[key] = dict(name=watermark['name'], created_utc=watermark['created_utc'])
+
+    def save(self):
+        """Atomically rewrite the file"""
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.watermarks.')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.data, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
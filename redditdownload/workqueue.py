@@ -0,0 +1,322 @@
+"""Work queue for crawling many subreddits from several machines.
+
+The queue is an SQLite file (on storage shared by the workers).  Each
+worker leases a task (a subreddit with its sort type and extra
+`redditdl.py` arguments), runs the normal crawl for it and marks it
+done.  A worker renews its lease while crawling; the lease of a dead
+worker expires and the task is handed out again.
+
+    python -m redditdownload.workqueue /shared/queue.db add wallpaper earthporn --sort-type new
+    python -m redditdownload.workqueue /shared/queue.db worker /shared/pics -- --incremental
+    python -m redditdownload.workqueue /shared/queue.db status
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import logging
+import argparse
+import threading
+
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_LEASE = 600  # seconds
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+class Task(object):
+
+    def __init__(self, task_id, subreddit, sort_type, args, attempts):
+        self.id = task_id
+        self.subreddit = subreddit
+        self.sort_type = sort_type
+        self.args = args
+        self.attempts = attempts
+
+    def __repr__(self):
+        return '<Task {} {}:{}>'.format(self.id, self.subreddit, self.sort_type or 'hot')
+
+
+class WorkQueue(object):
+    """
+    Lease-based task queue in an SQLite file.
+
+    Task states: 'pending', 'leased' (until `lease_until`), 'done' and
+    'failed' (after `max_attempts` failed or expired leases).
+
+    :Example:
+
+    >>> queue = WorkQueue('queue.db')  # doctest: +SKIP
+    >>> queue.add('wallpaper', sort_type='new')  # doctest: +SKIP
+    >>> task = queue.lease('node1')  # doctest: +SKIP
+    >>> queue.complete(task.id, 'node1', dict(downloaded=10))  # doctest: +SKIP
+    """
+
+    def __init__(self, path, lease_seconds=DEFAULT_LEASE, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # NOTE: the default (rollback journal) mode, WAL needs shared memory
+        # which network filesystems do not provide.
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None,
+                                   check_same_thread=False)
+        self._db.execute(
+            'create table if not exists tasks ('
+            ' id integer primary key,'
+            ' subreddit text not null,'
+            ' sort_type text not null,'
+            ' args text not null,'
+            ' state text not null default \'pending\','
+            ' worker text,'
+            ' lease_until real,'
+            ' attempts integer not null default 0,'
+            ' updated real,'
+            ' result text,'
+            ' unique (subreddit, sort_type, args))')
+        self._db.execute('create index if not exists tasks_state on tasks (state, lease_until)')
+
+    def _transaction(self, func, *args):
+        """Run `func(cursor, *args)` in an immediate (write-locked) transaction"""
+        with self._lock:
+            cur = self._db.cursor()
+            cur.execute('begin immediate')
+            try:
+                res = func(cur, *args)
+            except BaseException:
+                cur.execute('rollback')
+                raise
+            cur.execute('commit')
+            return res
+
+    def add(self, subreddit, sort_type=None, args=()):
+        """Add the task (unless it is queued already), return whether it was added"""
+        def _add(cur):
+            cur.execute(
+                'insert or ignore into tasks (subreddit, sort_type, args, updated)'
+                ' values (?, ?, ?, ?)',
+                (subreddit, (sort_type or '').lower(), json.dumps(list(args)), time.time()))
+            return cur.rowcount > 0
+        return self._transaction(_add)
+
+    def lease(self, worker):
+        """The next pending (or expired) task, leased to `worker`; None if
+        there is nothing to do right now"""
+        def _lease(cur):
+            now = time.time()
+            # expired leases that used all the attempts
+            cur.execute(
+                "update tasks set state = 'failed', worker = null, updated = ?,"
+                " result = '\"lease expired\"'"
+                " where state = 'leased' and lease_until < ? and attempts >= ?",
+                (now, now, self.max_attempts))
+            row = cur.execute(
+                "select id, subreddit, sort_type, args, attempts from tasks"
+                " where state = 'pending' or (state = 'leased' and lease_until < ?)"
+                " order by attempts, id limit 1", (now,)).fetchone()
+            if row is None:
+                return None
+            task_id, subreddit, sort_type, args, attempts = row
+            cur.execute(
+                "update tasks set state = 'leased', worker = ?, lease_until = ?,"
+                " attempts = attempts + 1, updated = ? where id = ?",
+                (worker, now + self.lease_seconds, now, task_id))
+            return Task(task_id, subreddit, sort_type or None, json.loads(args), attempts + 1)
+        return self._transaction(_lease)
+
+    def _update_own(self, task_id, worker, sql, params):
+        def _update(cur):
+            cur.execute(sql + " where id = ? and worker = ? and state = 'leased'",
+                        tuple(params) + (task_id, worker))
+            return cur.rowcount > 0
+        return self._transaction(_update)
+
+    def renew(self, task_id, worker):
+        """Extend the lease, return False if the worker has lost it"""
+        return self._update_own(task_id, worker, 'update tasks set lease_until = ?',
+                                (time.time() + self.lease_seconds,))
+
+    def complete(self, task_id, worker, result=None):
+        return self._update_own(
+            task_id, worker,
+            "update tasks set state = 'done', worker = null, lease_until = null,"
+            " updated = ?, result = ?", (time.time(), json.dumps(result)))
+
+    def fail(self, task_id, worker, error=None):
+        """Release the task for a retry (or mark it failed after `max_attempts`)"""
+        return self._update_own(
+            task_id, worker,
+            "update tasks set state = case when attempts >= ? then 'failed' else 'pending' end,"
+            " worker = null, lease_until = null, updated = ?, result = ?",
+            (self.max_attempts, time.time(), json.dumps(error)))
+
+    def requeue(self, states=('done', 'failed')):
+        """Make the finished tasks pending again (e.g. for the next
+        incremental round), return their count"""
+        def _requeue(cur):
+            cur.execute(
+                "update tasks set state = 'pending', attempts = 0, updated = ?"
+                " where state in ({})".format(', '.join('?' * len(states))),
+                (time.time(),) + tuple(states))
+            return cur.rowcount
+        return self._transaction(_requeue)
+
+    def counts(self):
+        """state -> number of tasks"""
+        with self._lock:
+            return dict(self._db.execute('select state, count(*) from tasks group by state'))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class LeaseKeeper(object):
+    """Renew the task lease in a daemon thread while the block runs.
+
+    `lost` is set if the lease was taken over (e.g. after a long stall),
+    and the `on_lost` callbacks are called (from the keeper thread).
+    """
+
+    def __init__(self, queue, task, worker):
+        self.queue = queue
+        self.task = task
+        self.worker = worker
+        self.lost = threading.Event()
+        self.on_lost = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def when_lost(self, callback):
+        """Call `callback()` once the lease is lost (right away if it is)"""
+        self.on_lost.append(callback)
+        if self.lost.is_set():
+            callback()
+
+    def _renew_periodically(self):
+        while not self._stop.wait(self.queue.lease_seconds / 3.0):
+            try:
+                if not self.queue.renew(self.task.id, self.worker):
+                    _log.warning("Lost the lease of %r", self.task)
+                    self.lost.set()
+                    for callback in list(self.on_lost):
+                        callback()
+                    return
+            except sqlite3.Error:
+                _log.exception("Failed to renew the lease of %r", self.task)
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._renew_periodically, name='lease-keeper')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def default_worker_id():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def crawl_task(task, target_dir, extra_args=(), keeper=None, **crawler_kwa):
+    """Run the normal crawl for the task into `<target_dir>/<subreddit>`,
+    return the crawler stats; the crawl stops once the `keeper`'s lease
+    is lost (another worker has the task then)"""
+    from .crawler import Crawler
+    from .redditdownload import parse_args
+
+    task_dir = os.path.join(target_dir, task.subreddit.replace('/', '_'))
+    if not os.path.exists(task_dir):
+        os.makedirs(task_dir)
+    argv = [task.subreddit, task_dir] + list(extra_args) + list(task.args)
+    if task.sort_type:
+        argv += ['--sort-type', task.sort_type]
+    crawler = Crawler.from_args(parse_args(argv), **crawler_kwa)
+    if keeper is not None:
+        keeper.when_lost(lambda: setattr(crawler, 'finished', True))
+    return crawler.run()
+
+
+def run_worker(queue, target_dir, extra_args=(), worker=None, wait=0, poll=30, **crawler_kwa):
+    """Lease and crawl tasks until there are none left (or, with `wait`,
+    until none showed up for that many seconds); return the tasks done"""
+    worker = worker or default_worker_id()
+    done = 0
+    idle_since = time.time()
+    while True:
+        task = queue.lease(worker)
+        if task is None:
+            if time.time() - idle_since >= wait:
+                return done
+            time.sleep(poll)
+            continue
+        _log.info("%s: crawling %r (attempt %d)", worker, task, task.attempts)
+        with LeaseKeeper(queue, task, worker) as keeper:
+            try:
+                stats = crawl_task(task, target_dir, extra_args, keeper=keeper, **crawler_kwa)
+            except (Exception, SystemExit) as exc:
+                # NOTE: `getitems` exits on HTTP errors.
+                _log.exception("%s: %r failed", worker, task)
+                queue.fail(task.id, worker, repr(exc))
+                continue
+            finally:
+                idle_since = time.time()
+        if keeper.lost.is_set():
+            _log.warning("%s: stopped %r after losing the lease", worker, task)
+        elif queue.complete(task.id, worker, stats):
+            done += 1
+        else:
+            _log.warning("%s: %r was taken over before it was completed", worker, task)
+
+
+def parse_args(args):
+    """(options, extra redditdl.py arguments given after '--')"""
+    extra_args = []
+    if '--' in args:
+        idx = args.index('--')
+        args, extra_args = args[:idx], args[idx + 1:]
+    parser = argparse.ArgumentParser(description='Shared work queue of subreddits to crawl.')
+    parser.add_argument('queue', help='SQLite file of the queue (on shared storage).')
+    parser.add_argument('--lease', type=float, default=DEFAULT_LEASE,
+                        help='Lease duration in seconds (renewed while crawling).')
+    parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS)
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    add = commands.add_parser('add', help='Queue subreddits.')
+    add.add_argument('subreddits', nargs='+')
+    add.add_argument('--sort-type', default=None)
+    worker = commands.add_parser('worker', help='Crawl the queued subreddits.')
+    worker.add_argument('dir', help='Download dir (a subdirectory per subreddit).')
+    worker.add_argument('--worker-id', default=None)
+    worker.add_argument('--wait', type=float, default=0,
+                        help='Keep polling for new tasks for that many idle seconds.')
+    commands.add_parser('requeue', help='Make the done and failed tasks pending again.')
+    commands.add_parser('status', help='Print the number of tasks per state.')
+    return parser.parse_args(args), extra_args
+
+
+def main():
+    args, extra_args = parse_args(sys.argv[1:])
+    logging.basicConfig(level=logging.INFO)
+    queue = WorkQueue(args.queue, lease_seconds=args.lease, max_attempts=args.max_attempts)
+    if args.command == 'add':
+        added = sum(queue.add(subreddit, args.sort_type, extra_args) for subreddit in args.subreddits)
+        print('Added {} tasks'.format(added))
+    elif args.command == 'worker':
+        done = run_worker(queue, args.dir, extra_args, worker=args.worker_id, wait=args.wait,
+                          poll=min(30, max(1, args.wait / 10.0)))
+        print('Crawled {} subreddits'.format(done))
+    elif args.command == 'requeue':
+        print('Requeued {} tasks'.format(queue.requeue()))
+    print(json.dumps(queue.counts(), sort_keys=True))
+    queue.close()
+
+
+if __name__ == '__main__':
+    main()
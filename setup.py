@@ -24,6 +24,9 @@ setup_kwargs = dict(
     entry_points={
         'console_scripts': [
             'redditdl.py = redditdownload.redditdownload:main',
+            'redditdl-queue = redditdownload.workqueue:main',
+            'redditdl-thumbs = redditdownload.thumbs:main',
+            'redditdl-layout = redditdownload.layout:main',
         ],
     },
     install_requires=[
@@ -39,7 +42,10 @@ setup_kwargs = dict(
             'requests',
             'Pillow', 'python-magic',
             'pyaux', 'yaml', 'ipython', 'atomicfile',
+            'futures; python_version < "3"',
         ],
+        'zstd': ['zstandard'],
+        'tests': ['pytest', 'zstandard'],
     }
 )
 
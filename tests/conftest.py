@@ -0,0 +1,78 @@
+"""shared fixtures of the crawler tests."""
+import os
+from unittest import mock
+
+import pytest
+
+from redditdownload import crawler
+from redditdownload.redditdownload import FileExistsException
+
+
+def make_item(post_id, url=None, **fields):
+    """A listing post, of the i.redd.it image `<post_id>.jpg` by default"""
+    item = dict(id=post_id, url=url or 'http://i.redd.it/%s.jpg' % post_id, score=100,
+                over_18=False, title='some title', subreddit='pics', created_utc=1500000000)
+    item.update(fields)
+    return item
+
+
+@pytest.fixture
+def item():
+    """The `make_item` factory"""
+    return make_item
+
+
+class StubbedPipeline(object):
+    """
+    Stands in for the crawler's `download_from_url` and `extract_urls`.
+
+    By default a download writes nothing and an url extracts to itself;
+    set `download` (e.g. to `touch`) / `extract` to change that, and put
+    the failing urls into `errors`.
+    """
+
+    def __init__(self):
+        # the `(url, filepath)` of the downloads, in order
+        self.downloads = []
+        # url -> the exception its download raises
+        self.errors = {}
+        self.download = self.nothing
+        self.extract = lambda url, **kwa: [url]
+
+    @staticmethod
+    def nothing(url, filepath, throttle=None):
+        """A download of 1024 bytes, writing nothing"""
+        if throttle is not None:
+            throttle(1024)
+        return 1024
+
+    @staticmethod
+    def touch(url, filepath, throttle=None):
+        """A download writing an empty file (not over an existing one,
+        like `download_from_url`)"""
+        if os.path.exists(filepath):
+            raise FileExistsException('URL [%s] already downloaded.' % url)
+        open(filepath, 'w').close()
+        return 1
+
+    @staticmethod
+    def unexpected(*args, **kwa):
+        raise AssertionError('unexpected call %r' % (args,))
+
+    def download_from_url(self, url, filepath, throttle=None):
+        self.downloads.append((url, filepath))
+        if url in self.errors:
+            raise self.errors[url]
+        return self.download(url, filepath, throttle=throttle)
+
+    def extract_urls(self, url, **kwa):
+        return self.extract(url, **kwa)
+
+
+@pytest.fixture
+def stubbed_pipeline():
+    """The crawler with `StubbedPipeline` for its downloads"""
+    stubs = StubbedPipeline()
+    with mock.patch.object(crawler, 'download_from_url', stubs.download_from_url), \
+            mock.patch.object(crawler, 'extract_urls', stubs.extract_urls):
+        yield stubs
@@ -0,0 +1,26 @@
+"""smoke test for the offline crawl benchmark."""
+from benchmarks import bench_crawl
+
+
+def test_bench_run(tmpdir):
+    """test a small crawl against the fake server."""
+    report = bench_crawl.run(posts=30, page_size=10, image_size=(64, 64),
+                             target_dir=str(tmpdir.join('out')))
+    assert report['posts'] == 30
+    assert report['outcomes']['downloaded'] > 0
+    assert report['bytes'] > 0
+    assert report['stages']['listing']['count'] == 4
+    assert report['server']['requests']['www.reddit.com'] == 4
+    assert len(tmpdir.join('out').listdir()) == report['outcomes']['downloaded']
+
+
+def test_bench_search_filters(tmpdir):
+    """test the pushed-down filters fetching fewer listing pages."""
+    args = ['--nsfw', '--site', 'i.redd.it']
+    local = bench_crawl.run(posts=200, page_size=10, image_size=(64, 64),
+                            target_dir=str(tmpdir.join('local')), main_args=args)
+    pushed = bench_crawl.run(posts=200, page_size=10, image_size=(64, 64),
+                             target_dir=str(tmpdir.join('pushed')),
+                             main_args=args + ['--search-filters'])
+    assert pushed['outcomes']['downloaded'] == local['outcomes']['downloaded']
+    assert pushed['pages'] * 4 < local['pages']
@@ -0,0 +1,42 @@
+"""test for the crawl pipeline."""
+from unittest import mock
+from urllib.error import HTTPError
+
+from redditdownload.crawler import Crawler
+
+
+def test_results(tmpdir, item, stubbed_pipeline):
+    """test the outcomes, the stats and the callbacks."""
+    items = [
+        item('a1'),
+        item('a2', score=1),
+        item('a3', 'http://i.redd.it/broken.jpg'),
+        item('a4', 'http://www.reddit.com/r/pics/comments/a4/x/'),
+        item('a5', 'http://imgur.com/a/album'),
+    ]
+    album = ['http://i.imgur.com/x.jpg', 'http://i.imgur.com/y.jpg']
+    stubbed_pipeline.extract = lambda url, **kwa: album if '/a/' in url else [url]
+    stubbed_pipeline.errors[items[2]['url']] = HTTPError(
+        items[2]['url'], 503, 'Service Unavailable', {}, None)
+    attempts = []
+    crawl = Crawler('pics', str(tmpdir), score=10, annotate=False)
+    crawl.on_attempt.append(lambda item, url, filename: attempts.append(filename))
+    results = list(crawl.results(items=items))
+    assert [(res.outcome, res.item['id']) for res in results] == [
+        ('downloaded', 'a1'), ('skipped', 'a2'), ('http_error', 'a3'),
+        ('skipped', 'a4'), ('downloaded', 'a5'), ('downloaded', 'a5')]
+    assert results[1].details['reason'] == 'score'
+    assert results[2].details['code'] == 503
+    assert attempts == ['a1.jpg', 'a3.jpg', 'a5_0.jpg', 'a5_1.jpg']
+    assert crawl.stats == dict(processed=5, downloaded=3, skipped=1, errors=0, failed=1)
+    assert results[0].as_dict()['filename'] == str(tmpdir.join('a1.jpg'))
+
+
+def test_num_limit(tmpdir, item, stubbed_pipeline):
+    """test stopping after `num` downloads."""
+    items = [item('b%d' % num) for num in range(10)]
+    crawl = Crawler('pics', str(tmpdir), num=3, annotate=False)
+    crawl.listing = mock.Mock(side_effect=AssertionError)
+    stats = crawl.run(items=iter(items))
+    assert stats['downloaded'] == 3
+    assert crawl.finished
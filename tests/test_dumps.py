@@ -0,0 +1,69 @@
+"""test for the submission dump reader."""
+import gzip
+import json
+
+import pytest
+import zstandard
+
+from redditdownload.dumps import DumpReader, iter_blocks, open_dump
+
+
+def _posts(count):
+    return [dict(id='p%d' % num, subreddit='Pics' if num % 2 else 'aww', score=num,
+                 over_18=num % 3 == 0, url='http://i.redd.it/p%d.jpg' % num,
+                 title='post %d' % num, selftext='x' * 100)
+            for num in range(count)]
+
+
+def _write(path, posts, opener=open):
+    with opener(str(path), 'wt') as f:
+        for post in posts:
+            f.write(json.dumps(post) + '\n')
+        f.write('{not json\n')
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_read_filtered(tmpdir, workers):
+    """test streaming, filtering and trimming the posts of plain and gzip dumps."""
+    posts = _posts(300)
+    _write(tmpdir.join('a.json'), posts[:150])
+    _write(tmpdir.join('b.json.gz'), posts[150:], opener=gzip.open)
+    reader = DumpReader([str(tmpdir.join('a.json')), str(tmpdir.join('b.json.gz'))],
+                        subreddits=['pics'], score=10, sfw=True, workers=workers,
+                        block_size=1024)
+    got = list(reader)
+    expected = [post['id'] for post in posts
+                if post['subreddit'] == 'Pics' and post['score'] >= 10 and not post['over_18']]
+    assert [post['id'] for post in got] == expected
+    assert 'selftext' not in got[0] and got[0]['url'] == 'http://i.redd.it/p11.jpg'
+    assert reader.stats == dict(lines=302, bad=2, posts=len(expected))
+
+
+def test_stop_early(tmpdir):
+    """test abandoning the iteration part way."""
+    _write(tmpdir.join('a.json'), _posts(2000))
+    items = iter(DumpReader([str(tmpdir.join('a.json'))], workers=2, block_size=512))
+    assert next(items)['id'] == 'p0'
+    items.close()
+
+
+def test_blocks(tmpdir):
+    """test that the blocks hold whole lines only."""
+    path = tmpdir.join('a.json')
+    _write(path, _posts(50))
+    with open_dump(str(path)) as stream:
+        blocks = list(iter_blocks(stream, block_size=100))
+    assert all(block.endswith(b'\n') for block in blocks)
+    assert b''.join(blocks) == path.read_binary()
+
+
+def test_zstd(tmpdir):
+    """test the zstd dumps, with the urls unescaped as in the listings."""
+    path = tmpdir.join('RS.zst')
+    posts = _posts(20)
+    posts[0]['url'] = 'https://preview.redd.it/p0.jpg?width=640&amp;s=abc'
+    data = b''.join(json.dumps(post).encode() + b'\n' for post in posts)
+    path.write_binary(zstandard.ZstdCompressor().compress(data))
+    got = list(DumpReader([str(path)], workers=0))
+    assert len(got) == 20
+    assert got[0]['url'] == 'https://preview.redd.it/p0.jpg?width=640&s=abc'
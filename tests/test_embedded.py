@@ -0,0 +1,116 @@
+"""test for the media urls from the listing data."""
+import os
+
+from redditdownload.crawler import Crawler
+from redditdownload.embedded import embedded_urls, hinted_urls, media_extension
+
+
+def _gallery(item, post_id='g1'):
+    return item(
+        post_id, 'https://www.reddit.com/gallery/%s' % post_id, title='a gallery', is_gallery=True,
+        gallery_data=dict(items=[dict(media_id='m3'), dict(media_id='m1'),
+                                 dict(media_id='m2'), dict(media_id='m4')]),
+        media_metadata=dict(
+            m1=dict(status='valid', e='Image', m='image/png', id='m1'),
+            m2=dict(status='failed'),
+            m3=dict(status='valid', e='AnimatedImage', m='image/gif', id='m3'),
+            m4=dict(status='valid', e='Image',
+                    s=dict(u='https://preview.redd.it/m4.jpg?width=640&amp;s=abc'))))
+
+
+def test_gallery(item):
+    """test the gallery order, the failed media and the unescaping."""
+    assert embedded_urls(_gallery(item)) == [
+        'https://i.redd.it/m3.gif', 'https://i.redd.it/m1.png',
+        'https://preview.redd.it/m4.jpg?width=640&s=abc']
+
+
+def test_video_and_crosspost():
+    """test the reddit videos, also of crossposts."""
+    video = dict(id='v1', url='https://v.redd.it/abc', secure_media=dict(reddit_video=dict(
+        fallback_url='https://v.redd.it/abc/DASH_720.mp4?source=fallback')))
+    assert embedded_urls(video) == ['https://v.redd.it/abc/DASH_720.mp4?source=fallback']
+    crosspost = dict(id='c1', url='https://v.redd.it/abc', secure_media=None,
+                     crosspost_parent_list=[video])
+    assert embedded_urls(crosspost) == embedded_urls(video)
+    assert embedded_urls(dict(id='i1', url='https://imgur.com/abc', media=None)) is None
+
+
+def test_video_filename(tmpdir, item, stubbed_pipeline):
+    """test that the reddit videos are named by their id with the url filename format."""
+    videos = [item(post_id, 'https://v.redd.it/%s' % video_id, secure_media=dict(reddit_video=dict(
+        fallback_url='https://v.redd.it/%s/DASH_720.mp4?source=fallback' % video_id)))
+        for post_id, video_id in (('v1', 'abc'), ('v2', 'def'))]
+    crawl = Crawler('pics', str(tmpdir), annotate=False, filename_format='url')
+    results = list(crawl.results(items=videos))
+    assert [(res.outcome, os.path.basename(res.filename)) for res in results] == [
+        ('downloaded', 'abc.mp4'), ('downloaded', 'def.mp4')]
+
+
+def test_failed_gallery(tmpdir, item, stubbed_pipeline):
+    """test that a gallery with no usable media goes to `extract_urls`."""
+    gallery = _gallery(item)
+    gallery['gallery_data']['items'] = [dict(media_id='m2')]
+    assert embedded_urls(gallery) is None
+    crawl = Crawler('pics', str(tmpdir), annotate=False)
+    results = list(crawl.results(items=[gallery]))
+    assert [(res.outcome, res.url) for res in results] == [
+        ('downloaded', 'https://www.reddit.com/gallery/g1')]
+
+
+def test_resolve_without_requests(tmpdir, item, stubbed_pipeline):
+    """test that the gallery posts are resolved without `extract_urls`."""
+    stubbed_pipeline.extract = stubbed_pipeline.unexpected
+    crawl = Crawler('pics', str(tmpdir), annotate=False)
+    results = list(crawl.results(items=[_gallery(item)]))
+    assert [os.path.basename(res.filename) for res in results] == [
+        'g1_0.gif', 'g1_1.png', 'g1_2.jpg']
+    resolves = [series for series in crawl.metrics.snapshot()['histograms']['stage_seconds']
+                if series['labels']['stage'] == 'resolve']
+    assert [series['labels']['resolver'] for series in resolves] == ['embedded']
+
+
+def _preview(item, post_id, url, **kwa):
+    preview = dict(images=[dict(
+        source=dict(url='https://external-preview.redd.it/%s.jpg?s=abc&amp;w=1' % post_id,
+                    width=4000, height=3000),
+        variants=dict(mp4=dict(source=dict(url='https://preview.redd.it/%s.gif?format=mp4' % post_id))))])
+    return item(post_id, url, preview=preview, **kwa)
+
+
+def test_hints(item):
+    """test the preview / oembed hints of the hosts needing requests."""
+    gifv = _preview(item, 'h1', 'https://i.imgur.com/abc.gifv')
+    assert hinted_urls(gifv) == ['https://preview.redd.it/h1.gif?format=mp4']
+    gifv['preview']['reddit_video_preview'] = dict(fallback_url='https://v.redd.it/h1/DASH_480.mp4')
+    assert hinted_urls(gifv) == ['https://v.redd.it/h1/DASH_480.mp4']
+    photo = _preview(item, 'h2', 'https://imgur.com/abc', media=dict(oembed=dict(
+        type='photo', url='https://i.imgur.com/abc.png')))
+    assert hinted_urls(photo) == ['https://i.imgur.com/abc.png']
+    still = _preview(item, 'h3', 'https://www.deviantart.com/x/art/y-123')
+    assert hinted_urls(still) == ['https://external-preview.redd.it/h3.jpg?s=abc&w=1']
+    assert hinted_urls(_preview(item, 'h4', 'https://imgur.com/a/album')) is None
+    assert hinted_urls(_preview(item, 'h5', 'https://i.redd.it/h5.jpg')) is None
+    assert hinted_urls(_preview(item, 'h7', 'https://i.imgur.com/AbCdE12.jpg')) is None
+    assert hinted_urls(_preview(item, 'h8', 'https://i.imgur.com/AbCdE12.PNG')) is None
+    assert hinted_urls(dict(id='h6', url='https://gfycat.com/SomeName')) is None
+
+
+def test_hinted_mp4_filename(tmpdir, item, stubbed_pipeline):
+    """test that reddit's mp4 copy of a gif is saved as an mp4."""
+    for filename_format, expected in (('reddit', 'h1.mp4'), ('url', 'h1.mp4')):
+        crawl = Crawler('pics', str(tmpdir.join(filename_format)), annotate=False,
+                        filename_format=filename_format)
+        results = list(crawl.results(items=[
+            _preview(item, 'h1', 'https://i.imgur.com/abc.gifv')]))
+        assert [os.path.basename(res.filename) for res in results] == [expected]
+    assert media_extension('https://preview.redd.it/h1.gif?format=mp4&s=abc') == '.mp4'
+    assert media_extension('https://i.redd.it/h1.gif') is None
+
+
+def test_hints_disabled(tmpdir, item, stubbed_pipeline):
+    """test resolving with the hosts when the hints are disabled."""
+    stubbed_pipeline.extract = lambda url, **kwa: ['https://i.imgur.com/abc.gif']
+    crawl = Crawler('pics', str(tmpdir), annotate=False, hints=False)
+    results = list(crawl.results(items=[_preview(item, 'h1', 'https://i.imgur.com/abc.gifv')]))
+    assert [res.url for res in results] == ['https://i.imgur.com/abc.gif']
@@ -0,0 +1,57 @@
+"""test for the buffered event log."""
+import gzip
+import json
+
+from redditdownload.eventlog import EventLog
+from redditdownload.redditdownload import _log_wrongtype
+
+
+def _read(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_buffered(tmpdir):
+    """test the records are written in batches."""
+    path = str(tmpdir.join('events.jsl'))
+    events = EventLog(path, flush_every=3, flush_interval=None)
+    events.emit('downloaded', url='http://a/')
+    events.emit('skipped', url='http://b/', reason='score')
+    assert not tmpdir.join('events.jsl').check()
+    events.write({'url': 'http://c/'})
+    records = _read(path)
+    assert [rec.get('event') for rec in records] == ['downloaded', 'skipped', None]
+    assert records[1]['reason'] == 'score'
+    assert 'ts' in records[0]
+
+
+def test_close_flushes(tmpdir):
+    """test closing writes out the buffer."""
+    path = str(tmpdir.join('events.jsl'))
+    events = EventLog(path, flush_interval=None)
+    events.emit('downloaded', url='http://a/')
+    events.close()
+    assert len(_read(path)) == 1
+
+
+def test_rotation_compressed(tmpdir):
+    """test size-based rotation with compression."""
+    path = str(tmpdir.join('events.jsl'))
+    events = EventLog(path, flush_every=1, flush_interval=None,
+                      max_bytes=100, backups=2, compress=True)
+    for num in range(10):
+        events.emit('downloaded', url='http://example.com/%d.jpg' % num)
+    assert tmpdir.join('events.jsl.1.gz').check()
+    assert tmpdir.join('events.jsl.2.gz').check()
+    assert not tmpdir.join('events.jsl.3.gz').check()
+    with gzip.open(str(tmpdir.join('events.jsl.1.gz')), 'rt') as f:
+        assert json.loads(f.readline())['event'] == 'downloaded'
+    assert _read(path)[-1]['url'] == 'http://example.com/9.jpg'
+
+
+def test_wrongtype_unbuffered(tmpdir):
+    """test that every wrong-type record is written right away."""
+    path = str(tmpdir.join('wrong.jsl'))
+    _log_wrongtype(_logfile=path, url='http://a/', filecount=0)
+    _log_wrongtype(_logfile=path, url='http://b/', filecount=0)
+    assert [rec['url'] for rec in _read(path)] == ['http://a/', 'http://b/']
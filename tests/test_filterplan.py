@@ -0,0 +1,38 @@
+"""test for the filter planner."""
+from functools import partial
+
+from redditdownload.filterplan import FilterPlan, search_params
+
+
+def test_query():
+    """test the filters pushed down into the search query."""
+    assert FilterPlan('pics').query == 'self:no'
+    assert FilterPlan('pics', sfw=True).query == 'nsfw:no self:no'
+    plan = FilterPlan('pics', nsfw=True, site='imgur.com', title_contain='say "cheese"',
+                      score=10, regex='^A')
+    assert plan.query == 'nsfw:yes self:no site:imgur.com title:"say  cheese"'
+    assert plan.local == ['comments', 'score', 'nsfw', 'regex', 'site', 'title']
+
+
+def test_skip_reason(item):
+    """test the local predicate and the order of the reasons."""
+    cat = partial(item, 'x', title='A cat picture')
+    plan = FilterPlan('pics', score=10, sfw=True, regex='^A', skip_albums=True,
+                      site='redd.it', title_contain='CAT')
+    assert plan.skip_reason(cat()) is None
+    assert plan.skip_reason(cat(url='https://www.reddit.com/r/other/comments/x/y/')) == 'comments'
+    assert plan.skip_reason(cat(score=1, over_18=True)) == 'score'
+    assert plan.skip_reason(cat(over_18=True)) == 'sfw'
+    assert plan.skip_reason(cat(title='The cat')) == 'regex'
+    assert plan.skip_reason(cat(url='http://imgur.com/a/xyz')) == 'album'
+    assert plan.skip_reason(cat(url='http://notredd.it/x.jpg')) == 'site'
+    assert plan.skip_reason(cat(title='A dog')) == 'title'
+    assert FilterPlan('pics').skip_reason(cat(score=-1)) == 'score'
+
+
+def test_search_params():
+    """test mapping the sort types to the search ones."""
+    assert dict(search_params('self:no'))['sort'] == 'hot'
+    params = dict(search_params('self:no', 'topweek'))
+    assert (params['sort'], params['t'], params['restrict_sr']) == ('top', 'week', 'on')
+    assert dict(search_params('self:no', 'rising'))['sort'] == 'new'
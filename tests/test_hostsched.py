@@ -0,0 +1,80 @@
+"""test for the per-host download scheduler."""
+import time
+import socket
+from urllib.error import HTTPError, URLError
+
+from redditdownload.crawler import Crawler, Result, congestion_outcome
+from redditdownload.hostsched import HostScheduler, TokenBucket, parse_rate
+
+
+def test_aimd():
+    """test the additive increase and the multiplicative decrease."""
+    sched = HostScheduler(initial=2, max_limit=4, cooldown=60)
+    first = sched.try_acquire('imgur.com')
+    second = sched.try_acquire('imgur.com')
+    assert sched.try_acquire('imgur.com') is None
+    other = sched.try_acquire('i.redd.it')
+    assert other is not None
+    for slot in (first, second, other):
+        slot.outcome = 'ok'
+        sched.release(slot)
+    assert round(sched.limit('imgur.com'), 2) == 2.9
+    for _ in range(20):
+        with sched.slot('imgur.com') as slot:
+            slot.outcome = 'ok'
+    assert sched.limit('imgur.com') == 4
+    for _ in range(3):
+        with sched.slot('imgur.com') as slot:
+            slot.outcome = 'congested'
+    # cut once per cooldown
+    assert sched.limit('imgur.com') == 2
+    assert sched.stats()['imgur.com']['congestions'] == 3
+
+
+def test_bandwidth():
+    """test the token bucket and the rate parsing."""
+    assert parse_rate('512k') == 512 * 1024
+    assert parse_rate('2MB/s') == 2 * 2 ** 20
+    assert parse_rate('1000') == 1000
+    bucket = TokenBucket(10000)
+    start = time.monotonic()
+    for _ in range(4):
+        bucket.consume(5000)
+    assert time.monotonic() - start >= 0.9
+
+
+def test_parallel_download(tmpdir, item, stubbed_pipeline):
+    """test the parallel downloads with a throttling host."""
+    items = [item('p%d' % num, 'http://%s/p%d.jpg' % ('imgur.com' if num % 2 else 'i.redd.it', num))
+             for num in range(40)]
+    stubbed_pipeline.errors.update(
+        (post['url'], HTTPError(post['url'], 429, 'Too Many Requests', {}, None))
+        for post in items if 'imgur' in post['url'] and post['url'].endswith(('1.jpg', '3.jpg')))
+    crawl = Crawler('pics', str(tmpdir), annotate=False, jobs=4, num=0)
+    results = list(crawl.results(items=items))
+    assert sorted(result.item['id'] for result in results) == sorted(post['id'] for post in items)
+    assert crawl.stats['downloaded'] == 32
+    stats = crawl.scheduler.stats()
+    assert stats['imgur.com']['congestions'] == 8
+    assert stats['i.redd.it'] == dict(limit=4, active=0, successes=20, congestions=0)
+
+
+def test_parallel_num_limit(tmpdir, item, stubbed_pipeline):
+    """test not downloading more than `num` files in parallel."""
+    items = [item('p%d' % num) for num in range(40)]
+    crawl = Crawler('pics', str(tmpdir), annotate=False, jobs=8, num=5)
+    stats = crawl.run(items=iter(items))
+    assert stats['downloaded'] == 5
+
+
+def test_timeouts_are_congestion(tmpdir, item, stubbed_pipeline):
+    """test that the connect and read timeouts back the host off."""
+    crawl = Crawler('pics', str(tmpdir), annotate=False)
+    post = item('t1', 'http://imgur.com/t1.jpg')
+    for exc in (socket.timeout('timed out'), URLError(socket.timeout('timed out'))):
+        stubbed_pipeline.errors[post['url']] = exc
+        result = crawl.download_url(post, post['url'], 0, 1)
+        assert result.outcome == 'url_error'
+        assert congestion_outcome(result) == 'congested'
+    result = Result('url_error', post, post['url'], error='Name or service not known')
+    assert congestion_outcome(result) is None
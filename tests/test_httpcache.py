@@ -0,0 +1,55 @@
+"""test for the on-disk http cache."""
+import os
+import time
+
+from redditdownload.httpcache import HTTPCache, url_hash
+
+
+def test_put_get(tmpdir):
+    """test storing and retrieving an entry."""
+    cache = HTTPCache(str(tmpdir))
+    url = 'http://example.com/a.jpg'
+    assert cache.get(url) is None
+    cache.put(url, b'data')
+    assert cache.get(url) == b'data'
+    assert os.path.isfile(os.path.join(str(tmpdir), url_hash(url)[:2], url_hash(url)))
+    stats = cache.get_stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['hit_ratio'] == 0.5
+
+
+def test_expiry(tmpdir):
+    """test expired entries are dropped."""
+    cache = HTTPCache(str(tmpdir))
+    url = 'http://example.com/'
+    cache.put(url, b'data', max_age=-1)
+    assert cache.get(url) is None
+    assert cache.stats['expired'] == 1
+    assert url not in cache
+
+
+def test_lru_eviction(tmpdir):
+    """test the least recently used entries go first."""
+    cache = HTTPCache(str(tmpdir), max_size=10)
+    cache.put('http://a/', b'aaaa')
+    cache.put('http://b/', b'bbbb')
+    cache.get('http://a/')
+    cache.put('http://c/', b'cccc')
+    assert 'http://a/' in cache
+    assert 'http://b/' not in cache
+    assert 'http://c/' in cache
+    assert cache.size == 8
+    assert cache.stats['evictions'] == 1
+
+
+def test_reload(tmpdir):
+    """test the index is restored from the disk."""
+    cache = HTTPCache(str(tmpdir))
+    cache.put('http://a/', b'aaaa', meta=dict(encoding='cp1251'))
+    cache.put('http://b/', b'bbbb')
+    os.remove(cache._path(url_hash('http://b/')))
+    time.sleep(0.01)
+    cache = HTTPCache(str(tmpdir))
+    assert len(cache) == 1
+    assert cache.lookup('http://a/') == (b'aaaa', dict(encoding='cp1251'))
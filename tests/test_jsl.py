@@ -0,0 +1,56 @@
+"""test for the streaming json-lines helpers."""
+import json
+
+from redditdownload.jsl import iter_jsl, Checkpoint, JSLWriter, URLIndex
+
+
+def _write(path, lines):
+    with open(path, 'a') as f:
+        f.write(''.join(lines))
+
+
+def test_iter_jsl_offsets(tmpdir):
+    """test resuming from a line end offset."""
+    path = str(tmpdir.join('log.jsl'))
+    _write(path, [json.dumps({'url': 'a'}) + '\n', 'garbage\n', json.dumps({'url': 'b'}) + '\n'])
+    items = list(iter_jsl(path))
+    assert [obj['url'] for _, _, obj in items] == ['a', 'b']
+    first_end = items[0][1]
+    assert [obj['url'] for _, _, obj in iter_jsl(path, offset=first_end)] == ['b']
+
+
+def test_iter_jsl_partial_line(tmpdir):
+    """test an unfinished last line is not consumed."""
+    path = str(tmpdir.join('log.jsl'))
+    _write(path, [json.dumps({'url': 'a'}) + '\n', '{"url": "b'])
+    assert [obj['url'] for _, _, obj in iter_jsl(path)] == ['a']
+
+
+def test_checkpoint(tmpdir):
+    """test saving and loading the offset."""
+    path = str(tmpdir.join('log.jsl'))
+    checkpoint = Checkpoint(path)
+    assert checkpoint.load() == 0
+    _write(path, ['{}\n'])
+    checkpoint.save(3)
+    assert Checkpoint(path).load() == 3
+    # log replaced with a shorter one
+    checkpoint.save(300)
+    assert checkpoint.load() == 0
+
+
+def test_url_index_sync(tmpdir):
+    """test the url index follows the log."""
+    path = str(tmpdir.join('out.jsl'))
+    writer = JSLWriter(path)
+    writer({'url': 'http://a/'})
+    index = URLIndex(str(tmpdir.join('out.jsl.idx')))
+    index.sync_from_jsl(path)
+    assert 'http://a/' in index
+    assert 'http://b/' not in index
+    writer({'url': 'http://b/'})
+    index.sync_from_jsl(path)
+    assert 'http://b/' in index
+    index.add(u'http://c/☃')
+    assert u'http://c/☃' in index
+    assert len(index) == 3
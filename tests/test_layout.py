@@ -0,0 +1,86 @@
+"""test for the sharded directory layouts."""
+import os
+from unittest import mock
+
+import pytest
+
+from redditdownload import redditdownload
+from redditdownload.crawler import Crawler
+from redditdownload.layout import (
+    layout_path, existing_path, resolve_layout, read_layout, migrate)
+from redditdownload.thumbs import thumb_path, variant_name
+
+
+def test_paths(tmpdir):
+    """test the shard paths and the existing-file checks."""
+    dirname = str(tmpdir)
+    assert layout_path(dirname, 'abc123.jpg', 'flat') == os.path.join(dirname, 'abc123.jpg')
+    assert layout_path(dirname, 'abc123.jpg', 'id') == os.path.join(dirname, 'ab', 'c1', 'abc123.jpg')
+    assert layout_path(dirname, 'x.jpg', 'id') == os.path.join(dirname, 'x_', '__', 'x.jpg')
+    sharded = layout_path(dirname, 'abc123.jpg', 'hash')
+    assert len(os.path.relpath(sharded, dirname).split(os.sep)) == 3
+    assert existing_path(dirname, 'abc123.jpg', 'hash') is None
+    tmpdir.join('abc123.jpg').write('x')
+    assert existing_path(dirname, 'abc123.jpg', 'hash') == str(tmpdir.join('abc123.jpg'))
+
+
+def test_resolve_layout(tmpdir):
+    """test recording the layout of a dir."""
+    dirname = str(tmpdir)
+    assert resolve_layout(dirname) == 'flat'
+    assert read_layout(dirname) is None
+    assert resolve_layout(dirname, 'hash') == 'hash'
+    assert resolve_layout(dirname) == 'hash'
+    with pytest.raises(ValueError):
+        resolve_layout(dirname, 'id')
+    # reported as a usage error, before the run starts
+    with pytest.raises(SystemExit):
+        redditdownload.parse_args(['pics', dirname, '--layout', 'id'])
+    assert redditdownload.parse_args(['pics', dirname, '--layout', 'hash']).layout == 'hash'
+
+
+def test_migrate(tmpdir):
+    """test the in-place migration, resumed after an interruption."""
+    names = ['p%d.jpg' % num for num in range(50)]
+    for name in names:
+        tmpdir.join(name).write(name)
+    tmpdir.join('.redditdl-watermarks.json').write('{}')
+    tmpdir.mkdir('.thumbs').mkdir('256x256').join('p3.jpg.jpg').write('thumb')
+    tmpdir.join('.thumbs').mkdir('64x64-q90').join('p3.jpg.jpg').write('small')
+    rename = os.rename
+    calls = []
+
+    def _flaky_rename(src, dst):
+        calls.append(src)
+        if len(calls) == 10:
+            raise OSError('interrupted')
+        rename(src, dst)
+
+    with mock.patch('os.rename', _flaky_rename):
+        counts = migrate(str(tmpdir), 'hash', workers=4)
+    assert counts == dict(moved=49, conflict=0, failed=1)
+    counts = migrate(str(tmpdir), 'hash', workers=4)
+    assert counts == dict(moved=1, conflict=0, failed=0)
+    for name in names:
+        path = layout_path(str(tmpdir), name, 'hash')
+        with open(path) as f:
+            assert f.read() == name
+    assert tmpdir.join('.redditdl-watermarks.json').check()
+    moved = layout_path(str(tmpdir), 'p3.jpg', 'hash')
+    for path, content in ((thumb_path(moved), 'thumb'),
+                          (thumb_path(moved, (64, 64), 90), 'small')):
+        with open(path) as f:
+            assert f.read() == content
+    assert not tmpdir.join('.thumbs', variant_name(), 'p3.jpg.jpg').check()
+
+
+def test_crawler_layout(tmpdir, item, stubbed_pipeline):
+    """test downloading into the shards and skipping the unmigrated files."""
+    tmpdir.join('p0.jpg').write('old')
+    stubbed_pipeline.download = stubbed_pipeline.touch
+    crawl = Crawler('pics', str(tmpdir), annotate=False, layout='id')
+    results = list(crawl.results(items=[item('p0'), item('p1')]))
+    assert [result.outcome for result in results] == ['exists', 'downloaded']
+    assert results[1].filename == str(tmpdir.join('p1', '__', 'p1.jpg'))
+    assert tmpdir.join('p1', '__', 'p1.jpg').check()
+    assert tmpdir.join('p0.jpg').read() == 'old'
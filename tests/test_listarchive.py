@@ -0,0 +1,64 @@
+"""test for the listing archive and the replay."""
+from unittest import mock
+
+from redditdownload import crawler
+from redditdownload.crawler import Crawler
+from redditdownload.listarchive import ListingArchive
+
+
+def test_record_and_replay(tmpdir, item, stubbed_pipeline):
+    """test archiving the listing and running the pipeline over it again."""
+    pages = [[item('a1'), item('a2', score=5)], [item('a3')], []]
+    archive = ListingArchive(str(tmpdir.join('archive')))
+    crawl = Crawler('pics', str(tmpdir), annotate=False, archive=archive)
+    with mock.patch.object(crawler, 'getitems', side_effect=pages), \
+            mock.patch.object(crawler, '_LISTING_THROTTLE', 0):
+        crawl.run()
+    assert crawl.stats['downloaded'] == 3
+    assert [entry['after'] for entry in archive.index('pics')] == ['', 'a2']
+
+    replay = Crawler('pics', str(tmpdir.join('replay')), score=10, annotate=False,
+                     archive=ListingArchive(str(tmpdir.join('archive'))), replay=True)
+    with mock.patch.object(crawler, 'getitems', side_effect=AssertionError):
+        results = list(replay.results())
+    assert [(res.outcome, res.item['id']) for res in results] == [
+        ('downloaded', 'a1'), ('skipped', 'a2'), ('downloaded', 'a3')]
+    assert replay.listing_done
+
+
+def test_newest_run_first(tmpdir, item):
+    """test that a post comes once, as of the newest run, across runs and sorts."""
+    dirname = str(tmpdir)
+    old = ListingArchive(dirname, clock=lambda: 1000)
+    old.add_page('pics', None, [item('a1', score=1), item('a2')])
+    old.add_page('pics', 'new', [item('n1')])
+    new = ListingArchive(dirname, clock=lambda: 2000)
+    new.run = 'later'
+    new.add_page('pics', 'hot', [item('a1', score=50)])
+    pages = list(ListingArchive(dirname).pages('pics'))
+    assert [[(item['id'], item['score']) for item in page] for page in pages] == [
+        [('a1', 50)], [('a2', 100)]]
+    assert list(ListingArchive(dirname).pages('pics', 'hot', since=1500)) == [
+        [item('a1', score=50)]]
+
+
+def test_truncated_segment(tmpdir, item):
+    """test reading the complete pages of an interrupted run."""
+    archive = ListingArchive(str(tmpdir))
+    archive.add_page('pics', None, [item('a1')])
+    archive.add_page('pics', None, [item('a2')])
+    path = tmpdir.join(archive.segment('pics'))
+    path.write_binary(path.read_binary()[:-10])
+    assert [[item['id'] for item in page] for page in archive.pages('pics')] == [['a1']]
+
+
+def test_query_and_case(tmpdir, item):
+    """test that search pages are replayed only for their query, whatever the subreddit case."""
+    archive = ListingArchive(str(tmpdir))
+    archive.add_page('Pics', None, [item('a1')])
+    archive.add_page('pics', None, [item('s1')], query='title:cat')
+    assert [[item['id'] for item in page] for page in archive.pages('PICS')] == [['a1']]
+    assert [[item['id'] for item in page] for page in archive.pages(
+        'pics', query='title:cat')] == [['s1']]
+    assert list(archive.pages('pics', query='title:dog')) == []
+    assert len(list(archive.index('pIcS'))) == 2
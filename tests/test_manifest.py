@@ -0,0 +1,72 @@
+"""test for the plan/fetch manifests."""
+import json
+from unittest import mock
+
+import pytest
+
+from redditdownload.crawler import Crawler
+from redditdownload.manifest import (
+    ManifestWriter, read_manifest, parse_shard, in_shard, expected_type)
+
+
+def _extract(url, **kwa):
+    if '/a/' in url:
+        return ['http://i.imgur.com/x.jpg', 'http://i.imgur.com/y.png']
+    return [url]
+
+
+def test_plan_and_fetch(tmpdir, item, stubbed_pipeline):
+    """test planning a manifest, fetching it and fetching it again."""
+    items = [
+        item('a1'),
+        item('a2', 'http://www.reddit.com/r/pics/comments/a2/x/'),
+        item('a3', 'http://imgur.com/a/album'),
+    ]
+    path = str(tmpdir.join('plan.jsonl'))
+    planner = Crawler('pics', str(tmpdir.join('dl')), annotate=False, layout='hash')
+    planner.listing = mock.Mock(side_effect=AssertionError)
+    stubbed_pipeline.download = stubbed_pipeline.unexpected
+    stubbed_pipeline.extract = _extract
+    with ManifestWriter(path) as manifest:
+        for result in planner.plan(items=items):
+            if result.outcome == 'planned':
+                manifest.write(result.details['entry'])
+    assert manifest.count == 2
+    assert planner.planned == 3
+    with open(path) as f:
+        entries = [json.loads(line) for line in f]
+    assert [entry['id'] for entry in entries] == ['a1', 'a3']
+    assert [(medium['type'], medium['path'].endswith('a3_1.png'))
+            for medium in entries[1]['media']] == [('image/jpeg', False), ('image/png', True)]
+
+    target_dir = tmpdir.join('dl')
+    stubbed_pipeline.download = stubbed_pipeline.touch
+    fetcher = Crawler('pics', str(target_dir), annotate=False, jobs=4)
+    results = list(fetcher.fetch(read_manifest(path)))
+    assert sorted(result.outcome for result in results) == ['downloaded'] * 3
+    assert sorted(filepath for _, filepath in stubbed_pipeline.downloads) == sorted(
+        str(target_dir.join(medium['path'])) for entry in entries for medium in entry['media'])
+
+    refetcher = Crawler('pics', str(target_dir), annotate=False)
+    results = list(refetcher.fetch(read_manifest(path)))
+    assert [result.outcome for result in results] == ['exists'] * 3
+    assert refetcher.stats['processed'] == 2
+
+
+def test_shards():
+    """test that the shards split the posts between them."""
+    ids = ['p%d' % num for num in range(200)]
+    shards = [[post_id for post_id in ids if in_shard(post_id, (idx, 3))] for idx in range(3)]
+    assert sorted(sum(shards, [])) == sorted(ids)
+    assert all(shard for shard in shards)
+    assert parse_shard('2/3') == (2, 3)
+    with pytest.raises(ValueError):
+        parse_shard('3/3')
+
+
+def test_expected_type():
+    """test the content type from the url."""
+    assert expected_type('http://i.redd.it/a.JPG?x=1') == 'image/jpeg'
+    assert expected_type('http://i.imgur.com/a.webm') == 'video/webm'
+    assert expected_type('https://preview.redd.it/a.gif?format=mp4') == 'video/mp4'
+    assert expected_type('http://imgur.com/a/album') is None
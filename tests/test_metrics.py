@@ -0,0 +1,46 @@
+"""test for the metrics registry."""
+import json
+
+from redditdownload.metrics import Metrics
+
+
+def test_prometheus_text():
+    """test counters and histograms in the exposition format."""
+    metrics = Metrics()
+    metrics.inc('outcomes', outcome='downloaded')
+    metrics.inc('outcomes', outcome='downloaded')
+    metrics.observe('stage_seconds', 0.3, stage='listing')
+    metrics.observe('stage_seconds', 3, stage='listing')
+    text = metrics.to_prometheus()
+    assert '# TYPE redditdl_outcomes_total counter' in text
+    assert 'redditdl_outcomes_total{outcome="downloaded"} 2' in text
+    assert 'redditdl_stage_seconds_bucket{stage="listing",le="0.5"} 1' in text
+    assert 'redditdl_stage_seconds_bucket{stage="listing",le="5"} 2' in text
+    assert 'redditdl_stage_seconds_bucket{stage="listing",le="+Inf"} 2' in text
+    assert 'redditdl_stage_seconds_count{stage="listing"} 2' in text
+
+
+def test_timer_and_download():
+    """test the stage timer and the download throughput."""
+    metrics = Metrics()
+    with metrics.timer('download'):
+        pass
+    metrics.observe_download(2 ** 20, 0.5)
+    snapshot = metrics.snapshot()
+    stages = snapshot['histograms']['stage_seconds']
+    assert stages[0]['labels'] == {'stage': 'download'}
+    assert stages[0]['count'] == 1
+    assert snapshot['counters']['downloaded_bytes'][0]['value'] == 2 ** 20
+    assert snapshot['histograms']['download_throughput_bytes_per_second'][0]['sum'] == 2 ** 21
+
+
+def test_write(tmpdir):
+    """test writing the textfile and the json snapshot."""
+    metrics = Metrics()
+    metrics.inc('posts', 3)
+    path = str(tmpdir.join('redditdl.prom'))
+    metrics.write(path)
+    assert 'redditdl_posts_total 3' in tmpdir.join('redditdl.prom').read()
+    path = str(tmpdir.join('redditdl.json'))
+    metrics.write(path, fmt='json')
+    assert json.loads(tmpdir.join('redditdl.json').read())['counters']['posts'][0]['value'] == 3
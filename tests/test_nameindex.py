@@ -0,0 +1,49 @@
+"""test for the directory name index."""
+import os
+import threading
+
+from redditdownload.nameindex import DirNameIndex, get_dir_index
+
+
+def test_reserve_consecutive(tmpdir):
+    """test the names get the consecutive suffixes."""
+    tmpdir.join('a.jpg').write('')
+    index = DirNameIndex(str(tmpdir))
+    assert 'a.jpg' in index
+    assert index.reserve('b.jpg') == str(tmpdir.join('b.jpg'))
+    assert index.reserve('a.jpg') == str(tmpdir.join('a__01.jpg'))
+    assert index.reserve('a.jpg') == str(tmpdir.join('a__02.jpg'))
+    assert os.path.isfile(str(tmpdir.join('a__02.jpg')))
+
+
+def test_reserve_no_extension(tmpdir):
+    """test the names without an extension."""
+    index = DirNameIndex(str(tmpdir))
+    assert index.reserve('a') == str(tmpdir.join('a'))
+    assert index.reserve('a') == str(tmpdir.join('a__01'))
+
+
+def test_reserve_created_behind(tmpdir):
+    """test the files created after the listing are not reused."""
+    index = DirNameIndex(str(tmpdir))
+    tmpdir.join('a.jpg').write('')
+    tmpdir.join('a__01.jpg').write('')
+    assert index.reserve('a.jpg') == str(tmpdir.join('a__02.jpg'))
+
+
+def test_reserve_concurrent(tmpdir):
+    """test concurrent reservations never collide."""
+    index = get_dir_index(str(tmpdir))
+    results = []
+
+    def _worker():
+        for _ in range(50):
+            results.append(index.reserve('x.png'))
+
+    threads = [threading.Thread(target=_worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(results)) == 200
+    assert len(os.listdir(str(tmpdir))) == 200
@@ -0,0 +1,57 @@
+"""test for the negative cache of dead urls."""
+from urllib.error import HTTPError
+
+from redditdownload.crawler import Crawler
+from redditdownload.negcache import NegativeCache, DAY
+from redditdownload.redditdownload import WrongFileTypeException
+
+
+def test_expiry(tmpdir):
+    """test the growing expiry and the persistence."""
+    now = [1000000.0]
+    path = str(tmpdir.join('neg.db'))
+    cache = NegativeCache(path, clock=lambda: now[0])
+    url = 'http://i.imgur.com/gone.jpg'
+    assert cache.get(url) is None
+    cache.add(url, 'not_found')
+    assert cache.get(url)['expires'] == now[0] + DAY
+    now[0] += DAY + 1
+    assert url not in cache
+    cache.add(url, 'removed')
+    entry = cache.get(url)
+    assert (entry['kind'], entry['failures'], entry['expires']) == ('removed', 2, now[0] + 2 * DAY)
+    cache.close()
+    cache = NegativeCache(path, clock=lambda: now[0])
+    assert len(cache) == 1
+    assert cache.stats == dict(hits=0, misses=0, added=0)
+
+
+def test_crawler_skips_dead(tmpdir, item, stubbed_pipeline):
+    """test recording the dead urls and skipping them on the next run."""
+    items = [item('p%d' % num, 'http://i.imgur.com/p%d.jpg' % num) for num in range(4)]
+    urls = [post['url'] for post in items]
+    stubbed_pipeline.errors.update({
+        urls[0]: HTTPError(urls[0], 404, 'Imgur suggests the image was removed', {}, None),
+        urls[1]: WrongFileTypeException('WRONG FILE TYPE'),
+        urls[2]: HTTPError(urls[2], 503, 'Service Unavailable', {}, None)})
+    cache = NegativeCache(str(tmpdir.join('neg.db')))
+    Crawler('pics', str(tmpdir), annotate=False, negative_cache=cache).run(items=items)
+    assert cache.get(items[0]['url'])['kind'] == 'removed'
+    assert cache.get(items[1]['url'])['kind'] == 'wrong_type'
+    assert cache.get(items[2]['url']) is None
+    del stubbed_pipeline.downloads[:]
+    crawl = Crawler('pics', str(tmpdir.join('again')), annotate=False, negative_cache=cache)
+    outcomes = [result.outcome for result in crawl.results(items=items)]
+    assert outcomes == ['known_dead', 'known_dead', 'http_error', 'downloaded']
+    assert [url for url, _ in stubbed_pipeline.downloads] == [items[2]['url'], items[3]['url']]
+    assert crawl.stats['skipped'] == 2
+
+
+def test_direct_links_looked_up_once(tmpdir, item, stubbed_pipeline):
+    """test that a direct link is looked up in the cache once per download."""
+    cache = NegativeCache(str(tmpdir.join('neg.db')))
+    cache.add('http://i.redd.it/d1.jpg', 'not_found')
+    crawl = Crawler('pics', str(tmpdir), annotate=False, negative_cache=cache)
+    outcomes = [result.outcome for result in crawl.results(items=[item('d1'), item('d2')])]
+    assert outcomes == ['known_dead', 'downloaded']
+    assert cache.stats == dict(hits=1, misses=1, added=1)
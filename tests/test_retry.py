@@ -0,0 +1,129 @@
+"""test for the retry policy and the circuit breaker."""
+import errno
+import socket
+from urllib.error import HTTPError, URLError
+
+import pytest
+
+from redditdownload.retry import (
+    RetryPolicy, CircuitBreaker, CircuitOpenError, is_retryable, parse_retry_after)
+
+
+class _Response(object):
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def _http_error(code, headers=None):
+    return HTTPError('http://x.com/', code, 'error', headers or {}, None)
+
+
+def _failing(*outcomes):
+    """func returning / raising the outcomes in turn"""
+    outcomes = list(outcomes)
+    calls = []
+
+    def func():
+        calls.append(1)
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    func.calls = calls
+    return func
+
+
+def test_classification():
+    """test which errors are retried."""
+    assert is_retryable(_http_error(503))
+    assert is_retryable(_http_error(429))
+    assert not is_retryable(_http_error(404))
+    assert is_retryable(URLError(ConnectionRefusedError(111, 'refused')))
+    assert is_retryable(URLError(socket.timeout('timed out')))
+    assert is_retryable(socket.timeout('timed out'))
+    assert is_retryable(OSError(errno.ECONNRESET, 'reset'))
+    assert not is_retryable(ValueError('unknown url type'))
+    assert not is_retryable(URLError('unknown url type: foo'))
+    assert not is_retryable(FileNotFoundError(errno.ENOENT, 'no such file'))
+    assert is_retryable(Exception('wrapped', URLError(ConnectionResetError())))
+    assert not is_retryable(Exception('wrapped', URLError('no host given')))
+    requests = pytest.importorskip('requests')
+    for error in (requests.exceptions.MissingSchema, requests.exceptions.InvalidURL,
+                  requests.exceptions.InvalidSchema, requests.exceptions.TooManyRedirects):
+        assert not is_retryable(error('bad'))
+    assert is_retryable(requests.exceptions.ConnectionError('refused'))
+    assert is_retryable(requests.exceptions.ReadTimeout('timed out'))
+    assert parse_retry_after('7') == 7
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:10 GMT', now=1445412480) == 10
+    assert parse_retry_after('soon') is None
+
+
+def test_backoff_and_retry_after():
+    """test the delays, Retry-After and the non-retryable errors."""
+    delays = []
+    policy = RetryPolicy(retries=4, base=1, sleep=delays.append)
+    func = _failing(_http_error(503), _http_error(429, {'Retry-After': '5'}), 'ok')
+    assert policy.call(func, 'http://x.com/a') == 'ok'
+    assert 0 <= delays[0] <= 1
+    assert delays[1] == 5
+
+    func = _failing(_http_error(404), 'ok')
+    with pytest.raises(HTTPError):
+        policy.call(func, 'http://x.com/a')
+    assert len(func.calls) == 1
+
+    func = _failing(_http_error(429, {'Retry-After': '3600'}), 'ok')
+    with pytest.raises(HTTPError):
+        policy.call(func, 'http://x.com/a')
+
+    func = _failing(_Response(502), _Response(502), _Response(502), _Response(502))
+    assert policy.call(func, 'http://x.com/a').status_code == 502
+    assert len(func.calls) == 4
+
+
+def test_circuit_breaker():
+    """test opening, the half-open probe and closing."""
+    now = [1000.0]
+    breaker = CircuitBreaker(threshold=3, reset_timeout=10, clock=lambda: now[0])
+    policy = RetryPolicy(retries=2, sleep=lambda delay: None)
+    errors = [URLError(ConnectionRefusedError(111, 'refused')) for _ in range(4)]
+    func = _failing(*errors)
+    for _ in range(2):
+        with pytest.raises(URLError):
+            policy.call(func, 'http://down.com/a', breaker=breaker)
+    # opened at the third failure, without the fourth attempt
+    assert len(func.calls) == 3
+    with pytest.raises(CircuitOpenError):
+        policy.call(func, 'http://down.com/b', breaker=breaker)
+    assert policy.call(lambda: 'ok', 'http://up.com/', breaker=breaker) == 'ok'
+
+    now[0] += 11
+    # the probe fails: open for twice as long
+    with pytest.raises(URLError):
+        policy.call(func, 'http://down.com/c', breaker=breaker)
+    now[0] += 11
+    with pytest.raises(CircuitOpenError):
+        breaker.check('down.com')
+    now[0] += 10
+    assert policy.call(lambda: 'ok', 'http://down.com/d', breaker=breaker) == 'ok'
+    assert not breaker.is_open('down.com')
+
+
+def test_inconclusive_probe():
+    """test that a probe failing on its url does not keep the circuit open."""
+    now = [1000.0]
+    breaker = CircuitBreaker(threshold=1, reset_timeout=10, clock=lambda: now[0])
+    policy = RetryPolicy(retries=1, sleep=lambda delay: None)
+    with pytest.raises(URLError):
+        policy.call(_failing(URLError(ConnectionRefusedError(111, 'refused'))),
+                    'http://down.com/a', breaker=breaker)
+    now[0] += 11
+    with pytest.raises(ValueError):
+        policy.call(_failing(ValueError('unknown url type')), 'http://down.com/b',
+                    breaker=breaker)
+    assert breaker.is_open('down.com')
+    # the next request is the probe again
+    assert policy.call(lambda: 'ok', 'http://down.com/c', breaker=breaker) == 'ok'
+    assert not breaker.is_open('down.com')
@@ -0,0 +1,45 @@
+"""test for the thumbnails."""
+import os
+
+from PIL import Image
+
+from redditdownload.thumbs import make_thumbnail, thumb_path, thumbnail_tree, parse_size
+
+
+def _image(path, size=(1600, 1200), fmt='JPEG', mode='RGB'):
+    Image.new(mode, size, 'red' if mode == 'RGB' else 1).save(path, fmt)
+    return path
+
+
+def test_make_thumbnail(tmpdir):
+    """test the size, the up to date check and the non-images."""
+    path = _image(str(tmpdir.join('abc.jpg')))
+    assert make_thumbnail(path, size=(200, 200)) == 'made'
+    thumb = thumb_path(path, (200, 200))
+    assert thumb == str(tmpdir.join('.thumbs', '200x200', 'abc.jpg.jpg'))
+    assert Image.open(thumb).size == (200, 150)
+    assert make_thumbnail(path, size=(200, 200)) == 'up_to_date'
+    os.utime(path, (os.stat(thumb).st_mtime + 10,) * 2)
+    assert make_thumbnail(path, size=(200, 200)) == 'made'
+    # another size or quality is another thumbnail
+    assert make_thumbnail(path, size=(100, 100)) == 'made'
+    assert Image.open(thumb_path(path, (100, 100))).size == (100, 75)
+    assert make_thumbnail(path, size=(100, 100), quality=50) == 'made'
+    assert thumb_path(path, (100, 100), 50) == str(
+        tmpdir.join('.thumbs', '100x100-q50', 'abc.jpg.jpg'))
+    assert make_thumbnail(str(tmpdir.join('clip.mp4'))) == 'skipped'
+    assert parse_size('320X240') == (320, 240)
+
+
+def test_thumbnail_tree(tmpdir):
+    """test the bulk mode over nested dirs."""
+    _image(str(tmpdir.join('a.jpg')))
+    tmpdir.mkdir('ab')
+    _image(str(tmpdir.join('ab', 'b.png')), fmt='PNG', mode='P')
+    _image(str(tmpdir.join('ab', 'c.gif')), fmt='GIF', mode='P')
+    tmpdir.join('ab', 'broken.jpg').write('nope')
+    counts = thumbnail_tree(str(tmpdir), workers=2, size=(64, 64))
+    assert counts == dict(made=3, up_to_date=0, skipped=0, failed=1)
+    assert tmpdir.join('ab', '.thumbs', '64x64', 'c.gif.jpg').check()
+    counts = thumbnail_tree(str(tmpdir), workers=2, size=(64, 64))
+    assert counts == dict(made=0, up_to_date=3, skipped=0, failed=1)
@@ -0,0 +1,50 @@
+"""test for the chrome trace recorder."""
+import json
+import threading
+
+from redditdownload.crawler import Crawler
+from redditdownload.trace import Tracer
+
+
+def test_spans_and_threads(tmpdir):
+    """test nested spans from several threads end up in the trace file."""
+    tracer = Tracer()
+
+    def _worker():
+        with tracer.span('download', url='http://i.redd.it/a.jpg') as args:
+            args['bytes'] = 10
+
+    with tracer.span('post', cat='post', id='abc'):
+        thread = threading.Thread(target=_worker, name='worker-1')
+        thread.start()
+        thread.join()
+    tracer.instant('downloaded', id='abc')
+
+    path = str(tmpdir.join('trace.json'))
+    tracer.write(path)
+    with open(path) as f:
+        events = json.load(f)['traceEvents']
+    by_name = {event['name']: event for event in events if event['ph'] != 'M'}
+    assert by_name['download']['args'] == {'url': 'http://i.redd.it/a.jpg', 'bytes': 10}
+    assert by_name['download']['tid'] != by_name['post']['tid']
+    assert by_name['post']['dur'] >= by_name['download']['dur']
+    assert by_name['downloaded']['ph'] == 'i'
+    thread_names = {event['args']['name'] for event in events if event['ph'] == 'M'}
+    assert 'worker-1' in thread_names
+
+
+def test_post_spans_with_jobs(tmpdir, item, stubbed_pipeline):
+    """test that a post span covers the downloads of the post, also in parallel."""
+    stubbed_pipeline.extract = lambda url, **kwa: [url + '?1', url + '?2']
+    tracer = Tracer()
+    crawl = Crawler('pics', str(tmpdir), annotate=False, jobs=4, tracer=tracer)
+    crawl.run(items=[item('a1'), item('a2', score=-1), item('a3')])
+    events = [event for event in tracer.events if event['ph'] == 'X']
+    posts = {event['args']['id']: event for event in events if event['name'] == 'post'}
+    assert sorted(posts) == ['a1', 'a2', 'a3']
+    downloads = [event for event in events if event['name'] == 'download']
+    assert len(downloads) == 4
+    for download in downloads:
+        post = posts[download['args']['url'].split('/')[-1][:2]]
+        assert post['ts'] <= download['ts']
+        assert download['ts'] + download['dur'] <= post['ts'] + post['dur'] + 1
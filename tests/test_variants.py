@@ -0,0 +1,73 @@
+"""test for the resolution-aware variant choice."""
+from unittest import mock
+
+from redditdownload import redditdownload
+from redditdownload.crawler import Crawler
+from redditdownload.variants import pick_variant, pick_imgur, pick_gfycat, fit_size
+
+
+def _previewed(item, post_id, url, width=6000, height=4000):
+    resolutions = [dict(url='https://preview.redd.it/%s.jpg?width=%d&amp;s=x' % (post_id, res),
+                        width=res, height=res * height // width) for res in (640, 1080, 3000)]
+    return item(post_id, url, preview=dict(images=[
+        dict(source=dict(url=url, width=width, height=height), resolutions=resolutions)]))
+
+
+def test_preview(item):
+    """test picking the smallest preview that is big enough."""
+    post = _previewed(item, 'v1', 'https://i.redd.it/v1.jpg')
+    url, info = pick_variant(post, post['url'], (1000, 1000))
+    assert url == 'https://preview.redd.it/v1.jpg?width=1080&s=x'
+    assert info == dict(variant='preview', width=1080, height=720,
+                        original_width=6000, original_height=4000)
+    # none of the previews is big enough
+    assert pick_variant(post, post['url'], (4000, 4000)) is None
+    # the original fits already
+    small = _previewed(item, 'v2', 'https://i.redd.it/v2.jpg', width=800, height=600)
+    assert pick_variant(small, small['url'], (1920, 1080)) is None
+
+
+def test_imgur_and_gallery():
+    """test the imgur size suffixes and the gallery previews."""
+    assert pick_imgur('https://i.imgur.com/AbCdE12.jpg', (600, 400))[0] == \
+        'https://i.imgur.com/AbCdE12l.jpg'
+    assert pick_imgur('https://i.imgur.com/AbCdE12.jpg', (2560, 1440)) is None
+    assert pick_imgur('https://i.imgur.com/AbCdE12.jpg', (600, 400), original=(500, 300)) is None
+    gallery = dict(id='g1', url='https://www.reddit.com/gallery/g1', media_metadata=dict(m1=dict(
+        status='valid', e='Image', m='image/jpg', s=dict(x=4000, y=2000, u='https://s/m1.jpg'),
+        p=[dict(x=320, y=160, u='https://p/m1-320.jpg'),
+           dict(x=1080, y=540, u='https://p/m1-1080.jpg')])))
+    url, info = pick_variant(gallery, 'https://i.redd.it/m1.jpg', (800, 800), single=False)
+    assert (url, info['variant'], info['original_width']) == (
+        'https://p/m1-1080.jpg', 'gallery_preview', 4000)
+
+
+def test_gfycat():
+    """test picking the smallest gfycat video that is big enough."""
+    gfy = dict(width=1920, height=1080, content_urls=dict(
+        mp4=dict(url='https://giant/x.mp4', width=1920, height=1080, size=9000000),
+        mobile=dict(url='https://thumbs/x-mobile.mp4', width=640, height=360, size=800000),
+        largeGif=dict(url='https://thumbs/x.gif', width=1920, height=1080, size=90000)))
+    assert pick_gfycat(gfy, (640, 640))[0] == 'https://thumbs/x-mobile.mp4'
+    assert pick_gfycat(gfy, (1280, 1280))[0] == 'https://giant/x.mp4'
+    variants = {}
+    gfy.update(mp4Url='https://giant/x.mp4', webmUrl='https://giant/x.webm', mp4Size=1,
+               webmSize=2)
+    with mock.patch.object(redditdownload, 'gfycat') as gfycat:
+        gfycat.return_value.more.return_value.json.return_value = gfy
+        assert redditdownload.extract_urls('https://gfycat.com/X', max_resolution=(640, 640),
+                                           variants=variants) == ['https://thumbs/x-mobile.mp4']
+        assert redditdownload.extract_urls('https://gfycat.com/X') == ['https://giant/x.mp4']
+    assert variants['https://thumbs/x-mobile.mp4']['variant'] == 'gfycat_mobile'
+    assert fit_size(1920, 1080, (640, 640)) == (640, 360)
+
+
+def test_recorded_in_results(tmpdir, item, stubbed_pipeline):
+    """test that the chosen variant is recorded in the download results."""
+    post = _previewed(item, 'v1', 'https://i.redd.it/v1.jpg')
+    crawl = Crawler('pics', str(tmpdir), annotate=False, max_resolution=(1000, 1000))
+    results = list(crawl.results(items=[post]))
+    assert [url for url, _ in stubbed_pipeline.downloads] == [
+        'https://preview.redd.it/v1.jpg?width=1080&s=x']
+    assert results[0].as_dict()['variant']['original_width'] == 6000
+    assert not crawl._variants
@@ -0,0 +1,59 @@
+"""test for the incremental run watermarks."""
+from unittest import mock
+from urllib.error import HTTPError
+
+from redditdownload import crawler
+from redditdownload.crawler import Crawler
+from redditdownload.watermark import WatermarkStore, watermark_key, is_seen
+
+
+def _posts(item, amount, newest=1000):
+    return [item('p%d' % num, name='t3_p%d' % num, score=10, created_utc=newest - num)
+            for num in range(amount)]
+
+
+def _pages(posts, page_size=5):
+    def getitems(subreddit, multireddit=False, previd='', reddit_sort=None, query=None):
+        ids = [post['id'] for post in posts]
+        start = ids.index(previd) + 1 if previd else 0
+        return posts[start:start + page_size]
+    return mock.Mock(side_effect=getitems)
+
+
+def test_store(tmpdir):
+    """test saving, loading and not moving the watermark back."""
+    key = watermark_key('pics', 'NEW')
+    assert key == 'pics:new'
+    store = WatermarkStore(str(tmpdir))
+    assert store.get(key) is None
+    store.set(key, dict(name='t3_b', created_utc=20))
+    store.set(key, dict(name='t3_a', created_utc=10))
+    store.save()
+    watermark = WatermarkStore(str(tmpdir)).get(key)
+    assert watermark == dict(name='t3_b', created_utc=20)
+    assert is_seen(dict(id='b', created_utc=25, name='t3_b'), watermark)
+    assert not is_seen(dict(id='c', created_utc=21), watermark)
+
+
+def test_incremental_crawl(tmpdir, item, stubbed_pipeline):
+    """test stopping at the watermark and keeping failures below it."""
+    posts = _posts(item, 20)
+    getitems = _pages(posts)
+    stubbed_pipeline.errors[posts[3]['url']] = HTTPError(
+        posts[3]['url'], 503, 'Service Unavailable', {}, None)
+    with mock.patch.object(crawler, 'getitems', getitems), \
+            mock.patch.object(crawler, '_LISTING_THROTTLE', 0):
+        crawl = Crawler('pics', str(tmpdir), sort_type='new', annotate=False,
+                        incremental=True, watermark=dict(name='t3_p12', created_utc=988))
+        stats = crawl.run()
+        assert stats['processed'] == 12
+        assert getitems.call_count == 3
+        assert crawl.listing_done
+        # p3 failed: p4 is the newest post that the next run can skip
+        assert crawl.new_watermark() == dict(name='t3_p4', created_utc=996)
+
+        getitems.reset_mock()
+        crawl = Crawler('pics', str(tmpdir), sort_type='new', annotate=False,
+                        incremental=True, watermark=dict(name='t3_p0', created_utc=1000))
+        assert crawl.run()['processed'] == 0
+        assert getitems.call_count == 1
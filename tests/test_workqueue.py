@@ -0,0 +1,103 @@
+"""test for the shared crawl work queue."""
+import threading
+from unittest import mock
+
+from redditdownload import crawler, workqueue
+from redditdownload.workqueue import WorkQueue, run_worker
+
+from benchmarks.fakereddit import FakeReddit
+
+
+def test_leases(tmpdir):
+    """test leasing, renewing, failing and expired leases."""
+    path = str(tmpdir.join('queue.db'))
+    queue = WorkQueue(path, lease_seconds=60, max_attempts=2)
+    assert queue.add('pics', 'NEW')
+    assert not queue.add('pics', 'new')
+    assert queue.add('aww', args=['--num', '5'])
+
+    first = queue.lease('a')
+    second = WorkQueue(path).lease('b')
+    assert (first.subreddit, first.sort_type, first.attempts) == ('pics', 'new', 1)
+    assert (second.subreddit, second.args) == ('aww', ['--num', '5'])
+    assert queue.lease('c') is None
+    assert not queue.renew(first.id, 'b')
+    assert queue.renew(first.id, 'a')
+
+    assert queue.fail(first.id, 'a', 'boom')
+    with mock.patch('time.time', return_value=10 ** 10):
+        # the lease of 'b' expired
+        again = queue.lease('c')
+    assert again.id == first.id
+    assert queue.lease('c') is None
+    assert queue.fail(first.id, 'c', 'boom again')
+    assert queue.counts() == dict(failed=1, leased=1)
+    assert not queue.complete(second.id, 'a')
+    assert queue.complete(second.id, 'b', dict(downloaded=1))
+    assert queue.requeue() == 2
+    assert queue.counts() == dict(pending=2)
+
+
+def test_workers(tmpdir):
+    """test two workers crawling each subreddit exactly once."""
+    queue_path = str(tmpdir.join('queue.db'))
+    queue = WorkQueue(queue_path)
+    subreddits = ['sub%d' % num for num in range(6)]
+    for subreddit in subreddits:
+        queue.add(subreddit)
+    crawled = []
+    crawl_task = workqueue.crawl_task
+
+    def _crawl_task(task, *args, **kwa):
+        crawled.append(task.subreddit)
+        return crawl_task(task, *args, **kwa)
+
+    fake = FakeReddit(posts=12, image_size=(16, 16)).start()
+    fake.install_opener()
+    done = []
+    try:
+        with mock.patch.object(workqueue, 'crawl_task', _crawl_task), \
+                mock.patch.object(crawler, '_LISTING_THROTTLE', 0):
+            workers = [
+                threading.Thread(target=lambda name=name: done.append(run_worker(
+                    WorkQueue(queue_path), str(tmpdir.join('out')), ['--num', '0'],
+                    worker=name, annotate=False)))
+                for name in ('node1', 'node2')]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+    finally:
+        fake.stop()
+    assert sorted(crawled) == subreddits
+    assert sum(done) == 6
+    assert queue.counts() == dict(done=6)
+    assert tmpdir.join('out', 'sub3').listdir()
+
+
+def test_lost_lease(tmpdir):
+    """test stopping the crawl and not completing a task taken over."""
+    path = str(tmpdir.join('queue.db'))
+    queue = WorkQueue(path, lease_seconds=0.3)
+    queue.add('pics')
+
+    def _crawl_task(task, target_dir, extra_args=(), keeper=None, **kwa):
+        stopped = threading.Event()
+        keeper.when_lost(stopped.set)
+        with mock.patch('time.time', return_value=10 ** 10):
+            assert WorkQueue(path).lease('other').id == task.id
+        assert stopped.wait(5)
+        return {}
+
+    with mock.patch.object(workqueue, 'crawl_task', _crawl_task):
+        assert run_worker(queue, str(tmpdir.join('out')), worker='node1') == 0
+    assert queue.counts() == dict(leased=1)
+
+    # the real crawl is stopped right away
+    task = workqueue.Task(1, 'pics', None, [], 1)
+    keeper = workqueue.LeaseKeeper(queue, task, 'node1')
+    keeper.lost.set()
+    with mock.patch.object(crawler, 'getitems', side_effect=AssertionError):
+        stats = workqueue.crawl_task(task, str(tmpdir.join('out')), keeper=keeper,
+                                     annotate=False)
+    assert stats['downloaded'] == 0